@@ -0,0 +1,390 @@
+# Copyright 2012 Yelp
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Rough throughput benchmarks for :py:mod:`mr3po.mysqldump`.
+
+Run from the top of the source tree::
+
+    PYTHONPATH=. python benchmarks/bench_mysqldump.py
+"""
+from __future__ import with_statement
+
+from functools import partial
+from StringIO import StringIO
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+from mr3po.common import Decoder
+from mr3po.common import decode_string
+from mr3po.mysqldump import BatchedInsertWriter
+from mr3po.mysqldump import MYSQL_STRING_ESCAPES
+from mr3po.mysqldump import SchemaRegistry
+from mr3po.mysqldump import STRING_ESCAPE_RE
+from mr3po.mysqldump import dump_as_insert
+from mr3po.mysqldump import escape_unicode_string
+from mr3po.mysqldump import format_identifier
+from mr3po.mysqldump import format_cols
+from mr3po.mysqldump import format_value
+from mr3po.mysqldump import iter_dump
+from mr3po.mysqldump import parse_insert
+from mr3po.mysqldump import parse_number
+from mr3po.mysqldump import string_escape_replacer
+from mr3po.mysqldump import unescape_string
+from mr3po.mysqldump import write_insert
+
+NUM_ROWS = 5000
+REPEAT = 5
+
+
+# the regex and dispatch loop parse_insert() used before it learned to
+# use m.lastindex; kept here so we can see how much faster we've gotten
+LEGACY_INSERT_RE = re.compile(r'(`(?P<identifier>.*?)`|'
+                              r'(?P<null>NULL)|'
+                              r"'(?P<string>(?:\\.|''|[^'])*?)'|"
+                              r'0x(?P<hex>[0-9a0-f]+)|'
+                              r'(?P<number>[+-]?\d+\.?\d*(?:e[+-]?\d+)?)|'
+                              r'(?P<close_paren>\)))')
+
+
+def legacy_parse_insert(sql, decimal=False, encoding=None):
+    sql = decode_string(sql, encoding)
+
+    identifiers = []
+    rows = []
+    current_row = []
+    for m in LEGACY_INSERT_RE.finditer(sql):
+        if m.group('identifier'):
+            identifiers.append(m.group('identifier'))
+        elif m.group('null'):
+            current_row.append(None)
+        elif m.group('string') is not None:
+            current_row.append(unescape_string(m.group('string')))
+        elif m.group('hex'):
+            current_row.append(m.group('hex').decode('hex'))
+        elif m.group('number'):
+            current_row.append(
+                parse_number(m.group('number'), decimal=decimal))
+        elif m.group('close_paren'):
+            if current_row:
+                rows.append(current_row)
+                current_row = []
+
+    return identifiers[0], rows
+
+
+# how we used to escape and unescape strings
+LEGACY_ESCAPES_FOR_TRANSLATE = dict(
+    (ord(c), u'\\%s' % esc) for esc, c in MYSQL_STRING_ESCAPES.iteritems())
+LEGACY_ESCAPES_FOR_TRANSLATE[ord(u'\\')] = u'\\\\'
+LEGACY_ESCAPES_FOR_TRANSLATE[ord(u"'")] = u"\\'"
+
+
+def legacy_unescape_string(s):
+    return STRING_ESCAPE_RE.sub(string_escape_replacer, s)
+
+
+def legacy_escape_unicode_string(u):
+    return u.translate(LEGACY_ESCAPES_FOR_TRANSLATE)
+
+
+# how dump_as_insert() used to format rows, before InsertEncoder
+def legacy_dump_as_insert(table, data, complete=False):
+    cols = None
+
+    if complete:
+        rows = []
+        for row_data in data:
+            row_cols, row = zip(*sorted(row_data.iteritems()))
+            if cols is None:
+                cols = row_cols
+            elif cols != row_cols:
+                raise ValueError
+
+            rows.append(row)
+    else:
+        rows = data
+
+    sql = 'INSERT INTO %s%s VALUES %s;' % (
+        format_identifier(table),
+        (' ' + format_cols(cols)) if cols else '',
+        ', '.join('(%s)' % ','.join(format_value(x) for x in row)
+                  for row in rows))
+
+    return sql.encode('utf_8')
+
+
+COLUMNS = ['id', 'name', 'score', 'city', 'misc', 'data', 'comment']
+
+CREATE_TABLE = """CREATE TABLE `user` (
+  `id` int(11) NOT NULL,
+  `name` varchar(255) NOT NULL,
+  `score` double NOT NULL,
+  `city` varchar(255) NOT NULL,
+  `misc` int(11) DEFAULT NULL,
+  `data` blob,
+  `comment` text
+);"""
+
+
+def random_row(rand, i):
+    return [
+        i,
+        u'user %d' % rand.randint(0, 10 ** 6),
+        rand.random() * 100,
+        u'Paul Erd\u0151s' if rand.random() < 0.1 else u'plain text',
+        None if rand.random() < 0.5 else rand.randint(0, 10 ** 9),
+        'blob data \x00\xff' * rand.randint(0, 4) or None,
+        u"it's got\nescapes" if rand.random() < 0.2 else u'',
+    ]
+
+
+def make_extended_insert(num_rows=NUM_ROWS, seed=0, complete=False):
+    rand = random.Random(seed)
+    rows = [random_row(rand, i) for i in xrange(num_rows)]
+    if complete:
+        rows = [dict(zip(COLUMNS, row)) for row in rows]
+    return dump_as_insert('user', rows, complete=complete)
+
+
+def make_blob_insert(num_rows=200, blob_size=16 * 1024, seed=0):
+    """An INSERT into a table of thumbnails, which is mostly hex."""
+    rand = random.Random(seed)
+    rows = [[i, ('%0*x' % (blob_size * 2,
+                           rand.getrandbits(blob_size * 8))).decode('hex')]
+            for i in xrange(num_rows)]
+    return dump_as_insert('thumbnail', rows)
+
+
+def make_wide_rows(num_rows=NUM_ROWS, num_cols=50, seed=0):
+    """Rows like a reducer might write to a wide fact table: mostly
+    numbers, with some strings and NULLs."""
+    rand = random.Random(seed)
+    rows = []
+    for i in xrange(num_rows):
+        row = [i]
+        for j in xrange(1, num_cols):
+            kind = j % 5
+            if kind == 0:
+                row.append(u'value %d' % rand.randint(0, 1000))
+            elif kind == 1:
+                row.append(None if rand.random() < 0.3 else rand.random())
+            else:
+                row.append(rand.randint(0, 10 ** 6))
+        rows.append(row)
+    return rows
+
+
+def write_batched(rows, complete=False):
+    f = StringIO()
+    with BatchedInsertWriter(f, complete=complete) as writer:
+        for row in rows:
+            writer.write('fact', row)
+    return f.getvalue()
+
+
+def write_streaming(rows, complete=False):
+    f = StringIO()
+    write_insert(f, 'fact', rows, complete=complete)
+    return f.getvalue()
+
+
+def row_size(row):
+    """Rough memory used by a row, not counting the values themselves."""
+    size = sys.getsizeof(row)
+    if not isinstance(row, (list, dict)):
+        size += sys.getsizeof(row._values)
+    return size
+
+
+def random_strings(num_strings=20000, escape_rate=0.1, seed=0):
+    """Make strings with lengths roughly like those in a real dump: mostly
+    short, with a long tail. Only some contain characters that need
+    escaping."""
+    rand = random.Random(seed)
+    strings = []
+    for _ in xrange(num_strings):
+        length = int(rand.expovariate(1 / 30.0))
+        u = u''.join(rand.choice(u'abcdefghij klmnop') for _ in xrange(length))
+        if rand.random() < escape_rate:
+            u += u"'s\nnew line\\"
+        strings.append(u)
+    return strings
+
+
+def time_func(func, arg, repeat=REPEAT):
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        func(arg)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench(name, func, line, num_rows, repeat=REPEAT, num_bytes=None):
+    best = time_func(func, line, repeat=repeat)
+    if num_bytes is None:
+        num_bytes = len(line)
+    print '%-40s %12.0f rows/s %8.2f MB/s' % (
+        name, num_rows / best, num_bytes / best / 2 ** 20)
+
+
+def bench_strings(name, func, strings, repeat=REPEAT):
+    best = time_func(lambda strings: [func(s) for s in strings], strings,
+                     repeat=repeat)
+    num_bytes = sum(len(s) for s in strings)
+    print '%-40s %12.0f strings/s %8.2f MB/s' % (
+        name, len(strings) / best, num_bytes / best / 2 ** 20)
+
+
+def main_strings():
+    for escape_rate in (0.0, 0.1, 1.0):
+        strings = random_strings(escape_rate=escape_rate)
+        escaped = [legacy_escape_unicode_string(u) for u in strings]
+
+        print
+        print 'strings with escape rate %.1f' % escape_rate
+        bench_strings('legacy unescape_string',
+                      legacy_unescape_string, escaped)
+        bench_strings('unescape_string', unescape_string, escaped)
+        bench_strings('legacy escape_unicode_string',
+                      legacy_escape_unicode_string, strings)
+        bench_strings('escape_unicode_string',
+                      escape_unicode_string, strings)
+
+
+def main_write():
+    rows = make_wide_rows()
+    cols = ['col%02d' % i for i in xrange(len(rows[0]))]
+    dict_rows = [dict(zip(cols, row)) for row in rows]
+    num_bytes = len(dump_as_insert('fact', rows))
+
+    print
+    print 'writing, %d rows of %d columns, %d bytes' % (
+        len(rows), len(cols), num_bytes)
+    bench('legacy dump_as_insert', partial(legacy_dump_as_insert, 'fact'),
+          rows, len(rows), num_bytes=num_bytes)
+    bench('dump_as_insert', partial(dump_as_insert, 'fact'),
+          rows, len(rows), num_bytes=num_bytes)
+    bench('legacy dump_as_insert(complete=True)',
+          partial(legacy_dump_as_insert, 'fact', complete=True),
+          dict_rows, len(rows), num_bytes=num_bytes)
+    bench('dump_as_insert(complete=True)',
+          partial(dump_as_insert, 'fact', complete=True),
+          dict_rows, len(rows), num_bytes=num_bytes)
+    bench('write_insert', write_streaming,
+          rows, len(rows), num_bytes=num_bytes)
+    bench('write_insert(complete=True)',
+          partial(write_streaming, complete=True),
+          dict_rows, len(rows), num_bytes=num_bytes)
+    bench('BatchedInsertWriter', write_batched,
+          rows, len(rows), num_bytes=num_bytes)
+    bench('BatchedInsertWriter(complete=True)',
+          partial(write_batched, complete=True),
+          dict_rows, len(rows), num_bytes=num_bytes)
+
+
+def main_dump(num_statements=20):
+    fd, path = tempfile.mkstemp(suffix='.sql')
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write('-- MySQL dump\n\n%s\n\nLOCK TABLES `user` WRITE;\n' %
+                    CREATE_TABLE)
+            for i in xrange(num_statements):
+                f.write(make_extended_insert(seed=i) + '\n')
+            f.write('UNLOCK TABLES;\n')
+        finally:
+            f.close()
+
+        num_rows = NUM_ROWS * num_statements
+        size = os.path.getsize(path)
+
+        print
+        print 'iter_dump(), %d rows, %d bytes' % (num_rows, size)
+        bench('iter_dump', lambda path: list(iter_dump(path)),
+              path, num_rows, repeat=3, num_bytes=size)
+    finally:
+        os.remove(path)
+
+
+def main():
+    line = make_extended_insert()
+
+    print 'parse_insert(), %d rows, %d bytes' % (NUM_ROWS, len(line))
+    bench('legacy regex', legacy_parse_insert, line, NUM_ROWS)
+    bench('parse_insert', parse_insert, line, NUM_ROWS)
+    bench('parse_insert(columns=[0, 2])',
+          partial(parse_insert, columns=[0, 2]), line, NUM_ROWS)
+    bench('parse_insert(lazy=True)',
+          partial(parse_insert, lazy=True), line, NUM_ROWS)
+
+    schema = SchemaRegistry()
+    schema.add_create_table(CREATE_TABLE)
+    bench('parse_insert(schema=...)',
+          partial(parse_insert, schema=schema), line, NUM_ROWS)
+
+    # legacy data, where every string is in latin-1
+    latin_1_line = line.decode('utf_8').encode('latin_1', 'replace')
+
+    print
+    print 'latin-1 strings, %d rows, %d bytes' % (
+        NUM_ROWS, len(latin_1_line))
+    bench('parse_insert', parse_insert, latin_1_line, NUM_ROWS)
+    bench('parse_insert(decoder=sticky)',
+          partial(parse_insert, decoder=Decoder(sticky=True)),
+          latin_1_line, NUM_ROWS)
+
+    print
+    print 'columns, %d rows, %d bytes' % (NUM_ROWS, len(line))
+    bench('parse_insert + zip(*rows)',
+          lambda line: zip(*parse_insert(line)[1]), line, NUM_ROWS)
+    bench('parse_insert(columnar=True)',
+          partial(parse_insert, columnar=True), line, NUM_ROWS)
+    bench('parse_insert(columnar=True, schema=...)',
+          partial(parse_insert, columnar=True, schema=schema),
+          line, NUM_ROWS)
+
+    line = make_extended_insert(complete=True)
+
+    print
+    print 'parse_insert(complete=True), %d rows, %d bytes' % (
+        NUM_ROWS, len(line))
+    for compact in (False, True):
+        parse = partial(parse_insert, complete=True, compact=compact)
+        bench('compact=%r' % compact, parse, line, NUM_ROWS)
+        _, rows = parse(line)
+        print '%-40s %12d bytes/row' % ('', row_size(rows[0]))
+
+    line = make_blob_insert()
+
+    print
+    print 'BLOBs, 200 rows, %d bytes' % len(line)
+    for blob in ('str', 'bytearray', 'memoryview'):
+        bench('parse_insert(blob=%r)' % blob,
+              partial(parse_insert, blob=blob), line, 200)
+    bench('parse_insert(lazy=True)',
+          partial(parse_insert, lazy=True), line, 200)
+
+    main_strings()
+    main_write()
+    main_dump()
+
+
+if __name__ == '__main__':
+    main()
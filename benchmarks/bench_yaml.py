@@ -0,0 +1,234 @@
+# Copyright 2012 Yelp
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Rough throughput benchmarks for :py:mod:`mr3po.yaml`.
+
+Run from the top of the source tree::
+
+    PYTHONPATH=. python benchmarks/bench_yaml.py
+"""
+import random
+import time
+
+from mr3po.yaml import CLoader
+from mr3po.yaml import RESOLVERS
+from mr3po.yaml import InlineDumper
+from mr3po.yaml import SafeYAMLProtocol
+from mr3po.yaml import dump_inline
+
+NUM_LINES = 2000
+REPEAT = 3
+
+BACKENDS = ['pure'] + (['c'] if CLoader is not None else [])
+
+
+def random_value(rand):
+    return {
+        'status': rand.choice(['active', 'closed', 'pending']),
+        'score': rand.randint(0, 100),
+        'tags': rand.sample(['a', 'b', 'c', 'd'], 2),
+    }
+
+
+def reducer_output(num_lines=NUM_LINES, values_per_key=1000, seed=0):
+    """What a reducer emits: the same key many times in a row."""
+    rand = random.Random(seed)
+    return [(('user', i // values_per_key), random_value(rand))
+            for i in xrange(num_lines)]
+
+
+def mapper_output(num_lines=NUM_LINES, num_keys=50, seed=0):
+    """What a mapper emits: keys that repeat, but not in order."""
+    rand = random.Random(seed)
+    return [(('user', rand.randint(1, num_keys)), random_value(rand))
+            for _ in xrange(num_lines)]
+
+
+def time_func(func, arg, repeat=REPEAT):
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        func(arg)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench(name, func, items):
+    best = time_func(func, items)
+    print '%-56s %10.0f lines/s' % (name, len(items) / best)
+
+
+def bench_write(name, p, key_values):
+    def write_all(key_values):
+        for key, value in key_values:
+            p.write(key, value)
+
+    bench(name, write_all, key_values)
+
+
+def bench_read(name, p, lines):
+    def read_all(lines):
+        for line in lines:
+            p.read(line)
+
+    bench(name, read_all, lines)
+
+
+def main_write():
+    for desc, key_values in [('reducer output', reducer_output()),
+                             ('mapper output', mapper_output())]:
+        print
+        print 'write(), %s, %d lines' % (desc, len(key_values))
+
+        for backend in BACKENDS:
+            for size in (0, 1, 100):
+                p = SafeYAMLProtocol(backend=backend,
+                                     encoded_key_cache_size=size)
+                bench_write('backend=%r, encoded_key_cache_size=%d' %
+                            (backend, size), p, key_values)
+
+
+def main_read():
+    for desc, key_values in [('reducer input', reducer_output()),
+                             ('mapper input', mapper_output())]:
+        lines = [SafeYAMLProtocol().write(k, v) for k, v in key_values]
+
+        print
+        print 'read(), %s, %d lines' % (desc, len(lines))
+
+        for backend in BACKENDS:
+            for key_size, value_size in [(1, 0), (100, 0), (100, 100)]:
+                p = SafeYAMLProtocol(backend=backend,
+                                     key_cache_size=key_size,
+                                     value_cache_size=value_size)
+                bench_read('backend=%r, key_cache_size=%d, '
+                           'value_cache_size=%d' %
+                           (backend, key_size, value_size), p, lines)
+
+
+def main_fast_path():
+    key_values = mapper_output()
+    lines = [SafeYAMLProtocol().write(k, v) for k, v in key_values]
+
+    print
+    print 'fast path, mapper output, %d lines' % len(key_values)
+
+    for backend in BACKENDS:
+        for fast_path in (False, True):
+            p = SafeYAMLProtocol(backend=backend, fast_path=fast_path)
+            bench_write('write(), backend=%r, fast_path=%r' %
+                        (backend, fast_path), p, key_values)
+            bench_read('read(), backend=%r, fast_path=%r' %
+                       (backend, fast_path), p, lines)
+
+
+def main_reuse():
+    # values the fast path can't handle
+    rand = random.Random(0)
+    values = [{'status': rand.choice(['active: yes', 'closed: no']),
+               'name': u'Qu\xe9bec %d' % rand.randint(0, 100)}
+              for _ in xrange(NUM_LINES)]
+
+    print
+    print 'dumping values PyYAML has to encode, %d lines' % len(values)
+
+    for backend in BACKENDS:
+        def dump_all(values):
+            for value in values:
+                dump_inline(value, safe=True, backend=backend)
+
+        bench('dump_inline(), backend=%r' % backend, dump_all, values)
+
+        dumper = InlineDumper(safe=True, backend=backend)
+
+        def dump_all_reused(values):
+            for value in values:
+                dumper.dump(value)
+
+        bench('InlineDumper.dump(), backend=%r' % backend,
+              dump_all_reused, values)
+
+    # enum-like values, which repeat a lot
+    lines = [SafeYAMLProtocol().write(None, {'status': value['status']})
+             for value in values]
+    data_list = [line.split('\t')[1] for line in lines]
+
+    print
+    print 'loading enum-like values, %d lines' % len(data_list)
+
+    for backend in BACKENDS:
+        p = SafeYAMLProtocol(backend=backend)
+
+        def load_all(data_list):
+            for data in data_list:
+                p.load(data)
+
+        bench('load(), backend=%r' % backend, load_all, data_list)
+        bench('load_many(), backend=%r' % backend, p.load_many, data_list)
+
+
+def main_lazy():
+    # values the fast path can't handle, so decoding them is expensive
+    rand = random.Random(0)
+    key_values = [(('user', rand.randint(1, 50)),
+                   {'status': u'Qu\xe9bec: %d' % rand.randint(0, 100)})
+                  for _ in xrange(NUM_LINES)]
+    lines = [SafeYAMLProtocol().write(k, v) for k, v in key_values]
+
+    print
+    print 'filtering on the key, %d lines' % len(lines)
+
+    for backend in BACKENDS:
+        for lazy_values in (False, True):
+            p = SafeYAMLProtocol(backend=backend, lazy_values=lazy_values)
+
+            def filter_lines(lines):
+                for line in lines:
+                    key, value = p.read(line)
+                    if key[1] % 10 == 0:
+                        p.write(key, value)
+
+            bench('backend=%r, lazy_values=%r' % (backend, lazy_values),
+                  filter_lines, lines)
+
+
+def main_resolvers():
+    key_values = mapper_output()
+    lines = [SafeYAMLProtocol().write(k, v) for k, v in key_values]
+
+    print
+    print 'read() by resolvers, mapper input, %d lines' % len(lines)
+
+    for backend in BACKENDS:
+        for fast_path in (False, True):
+            for resolvers in RESOLVERS:
+                p = SafeYAMLProtocol(backend=backend, fast_path=fast_path,
+                                     key_cache_size=0,
+                                     resolvers=resolvers)
+                bench_read('backend=%r, fast_path=%r, resolvers=%r' %
+                           (backend, fast_path, resolvers), p, lines)
+
+
+def main():
+    main_write()
+    main_read()
+    main_fast_path()
+    main_reuse()
+    main_lazy()
+    main_resolvers()
+
+
+if __name__ == '__main__':
+    main()
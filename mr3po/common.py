@@ -11,6 +11,14 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import codecs
+
+# map from codec name to the name that unicode() has a shortcut for
+_UNICODE_SHORTCUTS = {
+    'utf-8': 'utf-8',
+    'iso8859-1': 'latin-1',
+    'ascii': 'ascii',
+}
 
 
 def decode_string(s, encoding=None):
@@ -18,15 +26,178 @@ def decode_string(s, encoding=None):
 
     If *encoding* is ``None`` (the default), assume *s* is in UTF-8,
     and if it's not, fall back to latin-1.
+
+    This is stateless; protocols use :py:class:`Decoder` instead.
     """
     if isinstance(s, unicode):
         return s
 
+    # unicode() has shortcuts for 'utf-8' and 'latin-1' (spelled exactly
+    # like that) that skip the codec registry
     if not encoding:
         try:
-            return s.decode('utf_8')
-        except:
+            return unicode(s, 'utf-8')
+        except UnicodeDecodeError:
             # this should always work
-            return s.decode('latin_1')
+            return unicode(s, 'latin-1')
     else:
         return s.decode(encoding)
+
+
+class Decoder(object):
+    """Decodes input for a protocol, and keeps track of how often it had to
+    fall back to latin-1.
+
+    You can call :py:meth:`decode` on a whole line, or on each field of
+    a line; if you decode fields one at a time, one bad byte only
+    affects the field it's in.
+    """
+
+    def __init__(self, encoding=None, sticky=False):
+        """Optional parameters:
+
+        :param encoding: Character encoding to use. If not set, we try
+                         UTF-8, and fall back to latin-1.
+        :param sticky: after the first time we fall back to latin-1,
+                       assume everything else is in latin-1 too (this
+                       changes :py:attr:`encoding` to ``'latin_1'``), so
+                       that we don't have to decode legacy data twice.
+        """
+        self.sticky = sticky
+        #: how many times we've fallen back to latin-1
+        self.fallbacks = 0
+        self._set_encoding(encoding)
+
+    def _set_encoding(self, encoding):
+        self.encoding = encoding
+        #: the name of the codec to try first. You can call
+        #: ``unicode(s, decoder.codec)`` yourself, and then call
+        #: :py:meth:`fallback` if it raises :py:exc:`UnicodeDecodeError`.
+        self.codec = unicode_codec_name(encoding or 'utf_8')
+
+    def decode(self, s):
+        """Decode *s* into a unicode string, if it isn't already."""
+        if isinstance(s, unicode):
+            return s
+
+        try:
+            return unicode(s, self.codec)
+        except UnicodeDecodeError:
+            return self.fallback(s)
+
+    def fallback(self, s):
+        """Decode *s*, which wasn't in :py:attr:`codec`. This re-raises the
+        error if :py:attr:`encoding` is set."""
+        if self.encoding:
+            return unicode(s, self.codec)
+
+        self.fallbacks += 1
+        if self.sticky:
+            self._set_encoding('latin_1')
+
+        return unicode(s, 'latin-1')
+
+    def __repr__(self):
+        return '%s(%r, sticky=%r)' % (
+            self.__class__.__name__, self.encoding, self.sticky)
+
+
+def unicode_codec_name(encoding):
+    """:py:func:`unicode` decodes much faster if you call UTF-8, latin-1,
+    and ASCII by exactly these names, rather than going through the codec
+    registry. Return the name to use for *encoding*."""
+    try:
+        name = codecs.lookup(encoding).name
+    except LookupError:
+        # let unicode() raise the error
+        return encoding
+
+    return _UNICODE_SHORTCUTS.get(name, encoding)
+
+
+class LRUCache(object):
+    """A cache that holds at most *max_size* items, forgetting the least
+    recently used item when it's full. If *max_size* is 0, it holds
+    nothing.
+
+    :py:attr:`hits` and :py:attr:`misses` count calls to :py:meth:`get`,
+    so you can tell whether the cache is the right size.
+    """
+    # we keep items in a circular, doubly linked list, least recently
+    # used first. Each link is [prev, next, key, value].
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        #: number of times :py:meth:`get` found what it was looking for
+        self.hits = 0
+        #: number of times :py:meth:`get` didn't
+        self.misses = 0
+        self.clear()
+
+    def clear(self):
+        """Remove all items (but don't reset :py:attr:`hits` and
+        :py:attr:`misses`)."""
+        self._links = {}
+        self._root = root = []
+        root[:] = [root, root, None, None]
+
+    def get(self, key, default=None):
+        """Get the value for *key*, and mark it as recently used. Return
+        *default* if it's not in the cache."""
+        link = self._links.get(key)
+        if link is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._unlink(link)
+        self._append(link)
+        return link[3]
+
+    def __setitem__(self, key, value):
+        if self.max_size <= 0:
+            return
+
+        link = self._links.get(key)
+        if link is not None:
+            self._unlink(link)
+        elif len(self._links) >= self.max_size:
+            oldest = self._root[1]
+            self._unlink(oldest)
+            del self._links[oldest[2]]
+
+        link = [None, None, key, value]
+        self._append(link)
+        self._links[key] = link
+
+    def _unlink(self, link):
+        prev_link, next_link = link[0], link[1]
+        prev_link[1] = next_link
+        next_link[0] = prev_link
+
+    def _append(self, link):
+        root = self._root
+        last = root[0]
+        link[0] = last
+        link[1] = root
+        last[1] = root[0] = link
+
+    def __contains__(self, key):
+        return key in self._links
+
+    def __len__(self):
+        return len(self._links)
+
+    def keys(self):
+        """The keys in the cache, least recently used first."""
+        keys = []
+        link = self._root[1]
+        while link is not self._root:
+            keys.append(link[2])
+            link = link[1]
+        return keys
+
+    def __repr__(self):
+        return '%s(%r) <%d items, %d hits, %d misses>' % (
+            self.__class__.__name__, self.max_size, len(self),
+            self.hits, self.misses)
@@ -19,11 +19,48 @@ created when using :command:s3mysqldump with the :option:`--single-row`
 option). There are also protocols to handle rows without column names and
 multi-row ``INSERT`` statements.
 """
+from array import array
+from binascii import hexlify
+from binascii import unhexlify
+from bisect import bisect_left
+import codecs
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
 from decimal import Decimal
+import mmap
+from operator import itemgetter
+from optparse import OptionParser
+import os
 import re
 
+from mr3po.common import Decoder
 from mr3po.common import decode_string
 
+try:
+    from collections import Mapping
+    from collections import Sequence
+except ImportError:
+    # Python 2.5
+    Mapping = Sequence = None
+
+try:
+    bytearray
+except NameError:
+    # Python 2.5
+    bytearray = None
+
+try:
+    memoryview
+except NameError:
+    # Python 2.5 and 2.6
+    memoryview = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 __all__ = [
     'MySQLExtendedCompleteInsertProtocol',
     'MySQLCompleteInsertProtocol',
@@ -34,14 +71,82 @@ __all__ = [
 # Used http://dev.mysql.com/doc/refman/5.5/en/language-structure.html
 # as my guide for parsing INSERT statements
 
-INSERT_RE = re.compile(r'(`(?P<identifier>.*?)`|'
+# the part of an INSERT statement before the values: table name, and
+# optionally, column names
+INSERT_HEADER_RE = re.compile(
+    r'INSERT\b[^`]*`(?P<table>[^`]*)`\s*'
+    r'(?:\((?P<cols>\s*`[^`]*`(?:\s*,\s*`[^`]*`)*\s*)\))?')
+
+IDENTIFIER_RE = re.compile(r'`([^`]*)`')
+
+# from the output of SHOW CREATE TABLE, which is what mysqldump uses
+CREATE_TABLE_RE = re.compile(
+    r'CREATE\s+(?:TEMPORARY\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?'
+    r'`(?P<table>[^`]*)`\s*\(')
+
+# column definitions start with the column name; keys and constraints
+# start with a keyword
+COLUMN_DEFINITION_RE = re.compile(r'\s*`(?P<col>[^`]*)`\s+(?P<type>\w+)')
+
+# the parts of a CREATE TABLE statement that matter for finding where each
+# definition starts: parens and commas, plus identifiers and strings
+# (which may contain parens and commas) to skip over
+CREATE_TABLE_TOKEN_RE = re.compile(
+    r'`[^`]*`|'
+    r"'[^'\\]*(?:\\.[^'\\]*)*'|"
+    r'"[^"\\]*(?:\\.[^"\\]*)*"|'
+    r'[(),]')
+
+# just enough of INSERT_HEADER_RE to get the table name
+INSERT_TABLE_RE = re.compile(r'INSERT\b[^`]*`([^`]*)`')
+
+# the inside of a quoted string: backslash escapes, or '' for a quote
+STRING_CONTENTS = r"[^'\\]*(?:(?:\\.|'')[^'\\]*)*"
+
+# Tokens in the VALUES part of an INSERT statement. Each alternative has
+# exactly one group, so m.lastindex tells us which kind of token we matched
+# without having to call m.group() on each alternative.
+INSERT_RE = re.compile(r'`(?P<identifier>[^`]*)`|'
                        r'(?P<null>NULL)|'
-                       r"'(?P<string>(?:\\.|''|[^'])*?)'|"
-                       r'0x(?P<hex>[0-9a0-f]+)|'
-                       r'(?P<number>[+-]?\d+\.?\d*(?:e[+-]?\d+)?)|'
-                       r'(?P<close_paren>\)))')
+                       r"'(?P<string>%s)'|"
+                       r'0x(?P<hex>[0-9A-Fa-f]+)|'
+                       r'(?P<number>[+-]?\d+\.?\d*(?:[eE][+-]?\d+)?)|'
+                       r'(?P<close_paren>\))' % STRING_CONTENTS,
+                       re.DOTALL)
+
+# Anything up to and including the semicolon at the end of a SQL
+# statement. We skip over quoted strings (the same way INSERT_RE does),
+# identifiers, and comments, since they could contain semicolons.
+# Alternatives never start with the same character, and single-quoted
+# strings are matched atomically with (?=(...))\1 (Python never backtracks
+# into a lookahead), so '' can't also be read as one string ending and
+# another starting. Otherwise an unterminated string with many ''s would
+# take exponential time to fail.
+STATEMENT_RE = re.compile(
+    r"""[^;'"`/#-]*(?:(?:(?=('%s'))\1|"[^"\\]*(?:\\.[^"\\]*)*"|`[^`]*`|"""
+    r"""--[^\n]*|\#[^\n]*|/\*.*?\*/|-(?!-)|/(?!\*))[^;'"`/#-]*)*;"""
+    % STRING_CONTENTS,
+    re.DOTALL)
+
+# whitespace and comments before a statement. We treat MySQL-specific
+# /*!...*/ comments as comments too, since we don't need them.
+SKIP_TO_STATEMENT_RE = re.compile(r'(?:\s+|--[^\n]*|\#[^\n]*|/\*.*?\*/)*',
+                                  re.DOTALL)
+
+_IDENTIFIER = INSERT_RE.groupindex['identifier']
+_NULL = INSERT_RE.groupindex['null']
+_STRING = INSERT_RE.groupindex['string']
+_HEX = INSERT_RE.groupindex['hex']
+_NUMBER = INSERT_RE.groupindex['number']
+_CLOSE_PAREN = INSERT_RE.groupindex['close_paren']
 
-STRING_ESCAPE_RE = re.compile(r'\\(.)')
+_VALUE_TOKENS = frozenset([_NULL, _STRING, _HEX, _NUMBER])
+
+# for columns with more than one kind of token (m.lastindex is never 0)
+_MIXED = 0
+
+# backslash escapes, and '' (which is how you put a quote in a SQL string)
+STRING_ESCAPE_RE = re.compile(r"\\(.)|''")
 
 # from http://dev.mysql.com/doc/refman/5.5/en/string-syntax.html
 #
@@ -56,16 +161,175 @@ MYSQL_STRING_ESCAPES = {
     'Z': '\x1a',
 }
 
-MYSQL_STRING_ESCAPES_FOR_TRANSLATE = dict(
-    (ord(c), u'\\%s' % esc) for esc, c in MYSQL_STRING_ESCAPES.iteritems())
+# (char, escaped char) for escape_unicode_string(). Backslash has to go
+# first, so we don't double-escape the other escapes. We escape quotes with
+# a backslash, like mysqldump does.
+MYSQL_STRING_ESCAPES_FOR_REPLACE = [(u'\\', u'\\\\'), (u"'", u"\\'")] + [
+    (unicode(c), u'\\' + esc)
+    for esc, c in sorted(MYSQL_STRING_ESCAPES.iteritems())]
+
+# any character that escape_unicode_string() needs to escape
+NEEDS_ESCAPE_RE = re.compile(
+    u'[%s]' % u''.join(re.escape(c)
+                       for c, _ in MYSQL_STRING_ESCAPES_FOR_REPLACE))
+
+# map from the header of an INSERT statement (the part matched by
+# INSERT_HEADER_RE) to (table, cols), so we don't have to re-parse column
+# names on every line
+_HEADER_CACHE = {}
+
+# map from a tuple of column names to a subclass of Record
+_RECORD_CLASSES = {}
+
+# map from encoding to whether we can parse SQL in it as bytes
+_ASCII_COMPATIBLE = {}
+
+# map from (table, cols, num_cols, output_tab) to an InsertEncoder
+_INSERT_ENCODERS = {}
+
+# with strict=False, don't check max_error_rate until we've read at least
+# this many lines, so that a few bad lines at the start of the input don't
+# make us fail
+MIN_LINES_FOR_ERROR_RATE = 1000
+
+# MySQL's default max_allowed_packet
+DEFAULT_MAX_STATEMENT_BYTES = 1024 * 1024
+
+# dumps don't have very many tables, so if the caches get this big,
+# something odd is going on; just start over
+_MAX_CACHE_SIZE = 1000
 
 
 class AbstractMySQLInsertProtocol(object):
 
-    def __init__(self, decimal=False, encoding=None, output_tab=False):
+    # options that only show up in repr() if they're not the default
+    _OPTION_DEFAULTS = [
+        ('stream', False),
+        ('compact', False),
+        ('columns', None),
+        ('tables', None),
+        ('exclude_tables', None),
+        ('lazy', False),
+        ('schema', None),
+        ('columnar', False),
+        ('blob', 'str'),
+        ('sticky_encoding', False),
+        ('sort_columns', True),
+        ('strict', True),
+        ('bad_lines', None),
+        ('max_error_rate', None),
+    ]
+
+    def __init__(self, decimal=False, encoding=None, output_tab=False,
+                 stream=False, compact=False, columns=None, tables=None,
+                 exclude_tables=None, lazy=False, schema=None,
+                 columnar=False, blob='str', sticky_encoding=False,
+                 sort_columns=True, strict=True, bad_lines=None,
+                 max_error_rate=None):
+        """Optional parameters:
+
+        :param decimal: parse non-integer numbers as :py:class:`Decimal`
+                        rather than :py:class:`float`
+        :param encoding: Character encoding to use. We default to UTF-8,
+                         with fallback to latin-1 when decoding input.
+        :param output_tab: put a tab after the table name when writing,
+                           so that rows for the same table share a key
+        :param stream: for multi-row ``INSERT``\ s, :py:meth:`read`
+                       returns an iterator that parses rows as you consume
+                       them, rather than a list of rows
+        :param compact: for ``INSERT``\ s with column names, return
+                        :py:class:`Record`\ s instead of dicts. These
+                        act like read-only dicts, but store column names
+                        once per table rather than once per row.
+        :param columns: only return these columns, in this order. Columns
+                        may be names (if the ``INSERT`` has column names)
+                        or 0-indexed positions. Values in other columns are
+                        skipped over without being decoded.
+        :param tables: only parse ``INSERT``\ s into these tables
+        :param exclude_tables: don't parse ``INSERT``\ s into these tables
+        :param lazy: don't decode each value until it's accessed. Rows
+                     are :py:class:`LazyRow`\ s, or :py:class:`Record`\ s
+                     for ``INSERT``\ s with column names.
+        :param schema: a :py:class:`SchemaRegistry` describing some or all
+                       of the tables in the dump. Values in those tables
+                       are decoded according to their column's type, and
+                       we can get column names for ``INSERT``\ s that
+                       don't include them.
+        :param columnar: instead of a list of rows, :py:meth:`read`
+                         returns a :py:class:`Column` for each column (a
+                         list, or a dict if the ``INSERT`` has column
+                         names). Set this to ``'numpy'`` to store numbers in
+                         NumPy arrays. Can't be used with *stream* or
+                         *lazy*.
+        :param blob: what to decode hex literals (``0x...``, which is how
+                     :command:`mysqldump --hex-blob` writes ``BLOB``\ s)
+                     into: ``'str'``, ``'bytearray'``, or ``'memoryview'``.
+                     If *lazy* is set, hex isn't decoded until it's
+                     accessed.
+        :param sticky_encoding: if *encoding* isn't set, then once we find
+                                a string that isn't UTF-8, assume all the
+                                input is latin-1 from then on.
+        :param sort_columns: when writing ``INSERT``\ s with column names,
+                             put columns in sorted order. If false, use
+                             the order of the first row's keys (e.g. for
+                             :py:class:`~collections.OrderedDict`\ s).
+        :param strict: if false, :py:meth:`read` returns ``(None, None)``
+                       for lines it can't parse rather than raising an
+                       exception (see below).
+        :param bad_lines: if *strict* is false, a file-like object to
+                          write lines we can't parse to, one per line
+        :param max_error_rate: if *strict* is false, raise
+                               :py:class:`ValueError` anyway once more
+                               than this fraction of the lines we've read
+                               are bad (but not until we've read
+                               :py:data:`MIN_LINES_FOR_ERROR_RATE` lines)
+
+        If *tables* or *exclude_tables* is set, :py:meth:`read` looks at
+        just the table name of each line; for tables we don't want, it
+        returns ``(table, None)`` without parsing the rest of the line, and
+        adds one to ``self.skipped[table]``.
+
+        Strings are decoded with ``self.decoder``, a
+        :py:class:`~mr3po.common.Decoder`. Its ``fallbacks`` attribute
+        tells you how many strings weren't UTF-8.
+
+        If *strict* is false, ``self.errors`` maps the class name of each
+        error we caught (e.g. ``'ValueError'`` or ``'UnicodeDecodeError'``)
+        to the number of lines it happened on, and ``self.lines_read`` is
+        the number of lines we've been given. Only errors raised by
+        :py:meth:`read` itself are caught; with *stream* or *lazy*, bad
+        values may not be found until later.
+        """
         self.decimal = decimal
         self.encoding = encoding
         self.output_tab = output_tab
+        self.stream = stream
+        self.compact = compact
+        self.columns = columns
+        self.tables = tables
+        self.exclude_tables = exclude_tables
+        self.lazy = lazy
+        self.schema = schema
+        self.columnar = columnar
+        self.blob = blob
+        self.sticky_encoding = sticky_encoding
+        self.sort_columns = sort_columns
+        self.strict = strict
+        self.bad_lines = bad_lines
+        self.max_error_rate = max_error_rate
+
+        _check_blob_option(blob)
+
+        self.decoder = Decoder(encoding, sticky=sticky_encoding)
+
+        if columnar:
+            _check_columnar_options(columnar, stream, lazy)
+
+        self._tables = None if tables is None else frozenset(tables)
+        self._exclude_tables = frozenset(exclude_tables or ())
+        self.skipped = {}
+        self.errors = {}
+        self.lines_read = 0
 
     @property
     def complete(self):
@@ -76,12 +340,66 @@ class AbstractMySQLInsertProtocol(object):
         raise NotImplementedError
 
     def read(self, line):
+        self.lines_read += 1
+
+        try:
+            return self._read(line)
+        except ValueError, e:
+            if self.strict:
+                raise
+
+            self._bad_line(line, e)
+            return None, None
+
+    def _read(self, line):
+        if self._tables is not None or self._exclude_tables:
+            table = parse_insert_table(line, encoding=self.encoding)
+            if not self._want_table(table):
+                self.skipped[table] = self.skipped.get(table, 0) + 1
+                return table, None
+
         return parse_insert(
             line,
             complete=self.complete,
             decimal=self.decimal,
             encoding=self.encoding,
-            single_row=self.single_row)
+            single_row=self.single_row,
+            stream=self.stream,
+            compact=self.compact,
+            columns=self.columns,
+            lazy=self.lazy,
+            schema=self.schema,
+            columnar=self.columnar,
+            blob=self.blob,
+            decoder=self.decoder)
+
+    def _bad_line(self, line, error):
+        """Count a line we couldn't parse, and write it to *bad_lines*.
+        Raise an exception if we've seen too many bad lines."""
+        name = error.__class__.__name__
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+        if self.bad_lines is not None:
+            self.bad_lines.write(line + '\n')
+
+        if (self.max_error_rate is not None and
+                self.lines_read >= MIN_LINES_FOR_ERROR_RATE):
+            num_errors = sum(self.errors.itervalues())
+            if num_errors > self.max_error_rate * self.lines_read:
+                raise ValueError(
+                    '%d of %d lines were bad, more than max_error_rate=%r.'
+                    ' Last error was: %s' % (num_errors, self.lines_read,
+                                             self.max_error_rate, error))
+
+    def _want_table(self, table):
+        # if we can't find the table name, let parse_insert() raise an error
+        if table is None:
+            return True
+
+        if self._tables is not None and table not in self._tables:
+            return False
+
+        return table not in self._exclude_tables
 
     def write(self, key, value):
         return dump_as_insert(
@@ -89,12 +407,485 @@ class AbstractMySQLInsertProtocol(object):
             complete=self.complete,
             encoding=self.encoding,
             output_tab=self.output_tab,
-            single_row=self.single_row)
+            single_row=self.single_row,
+            sort_columns=self.sort_columns)
 
     def __repr__(self):
-        return '%s(decimal=%r, encoding=%r, output_tab=%r)' % (
+        return '%s(decimal=%r, encoding=%r, output_tab=%r%s)' % (
             self.__class__.__name__,
-            self.decimal, self.encoding, self.output_tab)
+            self.decimal, self.encoding, self.output_tab,
+            self._repr_options())
+
+    def _repr_options(self):
+        """Show options that aren't set to their defaults, so we don't
+        have to list every option in every repr."""
+        return ''.join(', %s=%r' % (name, getattr(self, name))
+                       for name, default in self._OPTION_DEFAULTS
+                       if getattr(self, name) != default)
+
+
+class Record(object):
+    """A read-only mapping from column name to value, used to represent
+    rows when parsing with *compact* or *lazy* set.
+
+    Values are stored in a list; column names and their positions live in
+    a subclass shared by every row with the same columns (see
+    :py:func:`record_class`), so each row costs one small object and one
+    list, rather than a dict.
+    """
+    __slots__ = ('_values',)
+
+    _columns = ()
+    _index = {}
+
+    def __init__(self, values):
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __len__(self):
+        return len(self._columns)
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = dict(other.iteritems())
+        return dict(self.iteritems()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, dict(self.iteritems()))
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        if i is None:
+            return default
+        else:
+            return self._values[i]
+
+    def keys(self):
+        return list(self._columns)
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return zip(self._columns, self._values)
+
+    def iterkeys(self):
+        return iter(self._columns)
+
+    def itervalues(self):
+        return iter(self._values)
+
+    def iteritems(self):
+        return iter(zip(self._columns, self._values))
+
+if Mapping is not None:
+    Mapping.register(Record)
+
+
+class LazyRow(object):
+    """A read-only sequence of values from an INSERT statement that are
+    decoded the first time they're accessed, used to represent rows when
+    parsing with *lazy* set.
+
+    Until then, each value is just its type and where it is in the
+    statement.
+    """
+    __slots__ = ('_sql', '_fields', '_values', '_decimal', '_converters',
+                 '_blob', '_decoder')
+
+    def __init__(self, sql, fields, decimal=False, converters=None,
+                 blob='str', decoder=None):
+        """
+        :param sql: the INSERT statement
+        :param fields: a list containing either ``None`` (for ``NULL``) or
+                       ``(kind, start, end)`` for each value
+        :param decimal: parse non-integer numbers as :py:class:`Decimal`
+        :param converters: ``(number_converters, string_converters)``,
+                           from :py:meth:`SchemaRegistry.converters`
+        :param blob: type to decode hex into (``'str'``, ``'bytearray'``,
+                     or ``'memoryview'``)
+        :param decoder: a :py:class:`~mr3po.common.Decoder` for strings in
+                        *sql*, if it's a byte string
+        """
+        self._sql = sql
+        self._fields = fields
+        self._values = None
+        self._decimal = decimal
+        self._converters = converters
+        self._blob = blob
+        self._decoder = decoder
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(len(self._fields)))]
+
+        if self._values is None:
+            self._values = [_UNDECODED] * len(self._fields)
+
+        value = self._values[i]
+        if value is _UNDECODED:
+            field = self._fields[i]
+            if field is not None:
+                if self._converters is not None:
+                    num_conv = self._converters[0][i]
+                    str_conv = self._converters[1][i]
+                else:
+                    num_conv = str_conv = None
+                value = _decode_value(self._sql, field, self._decimal,
+                                      num_conv, str_conv, self._blob,
+                                      self._decoder)
+            else:
+                value = None
+            self._values[i] = value
+
+        return value
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __iter__(self):
+        for i in xrange(len(self._fields)):
+            yield self[i]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self))
+
+if Sequence is not None:
+    Sequence.register(LazyRow)
+
+# placeholder for values LazyRow hasn't decoded yet
+_UNDECODED = object()
+
+
+def _decode_value(sql, field, decimal, num_conv=None, str_conv=None,
+                  blob='str', decoder=None):
+    """Decode a value that :py:class:`LazyRow` skipped over."""
+    kind, start, end = field
+    if kind == _HEX:
+        return _decode_hex(sql, start, end, blob)
+    return _decode_token(kind, sql[start:end], decimal, num_conv, str_conv,
+                         decoder=decoder)
+
+
+def _decode_token(kind, text, decimal, num_conv=None, str_conv=None,
+                  blob='str', decoder=None):
+    """Decode the text of a string, number, or hex value. Strings in byte
+    strings are decoded with *decoder* (a :py:class:`Decoder`), or
+    :py:func:`decode_string` if it's not set."""
+    if kind == _STRING:
+        value = unescape_string(text)
+        if str_conv and _takes_raw_bytes(str_conv):
+            return str_conv(value)
+        if decoder is not None:
+            value = decoder.decode(value)
+        else:
+            value = decode_string(value)
+        if str_conv:
+            value = str_conv(value)
+        return value
+    elif kind == _NUMBER:
+        if num_conv:
+            return num_conv(text)
+        return parse_number(text, decimal=decimal)
+    else:
+        return _blob(_unhexlify(text), blob)
+
+
+def _decode_hex(sql, start, end, blob='str'):
+    """Decode the hex digits in ``sql[start:end]``. If *sql* is a byte
+    string, read them straight out of it, rather than copying them into a
+    new string first."""
+    if isinstance(sql, str):
+        return _blob(_unhexlify(buffer(sql, start, end - start)), blob)
+    else:
+        return _blob(_unhexlify(sql[start:end]), blob)
+
+
+def _unhexlify(hex_digits):
+    """Like :py:func:`~binascii.unhexlify`, but raise :py:class:`ValueError`
+    rather than :py:class:`TypeError` if there are an odd number of digits
+    (e.g. a truncated value)."""
+    try:
+        return unhexlify(hex_digits)
+    except TypeError, e:
+        raise ValueError('bad INSERT, bad hex value: %s' % e)
+
+
+def _blob(value, blob):
+    """Convert decoded hex (a :py:class:`str`) to the type named by
+    *blob*."""
+    if blob == 'str':
+        return value
+    elif blob == 'bytearray':
+        return bytearray(value)
+    else:
+        # no copying; the memoryview just keeps value alive
+        return memoryview(value)
+
+
+def _check_blob_option(blob):
+    if blob not in ('str', 'bytearray', 'memoryview'):
+        raise ValueError(
+            "blob must be 'str', 'bytearray', or 'memoryview', not %r" %
+            (blob,))
+
+    if blob == 'bytearray' and bytearray is None:
+        raise ValueError("blob='bytearray' requires Python 2.6 or later")
+
+    if blob == 'memoryview' and memoryview is None:
+        raise ValueError("blob='memoryview' requires Python 2.7 or later")
+
+
+class Column(object):
+    """The values in one column of an ``INSERT`` statement, used when
+    parsing with *columnar* set.
+
+    *values* is an :py:class:`array.array` for columns of integers
+    (typecode ``'l'``) or floats (``'d'``), or a NumPy array if you asked
+    for one. Anything else (strings, :py:class:`Decimal`\ s, integers too
+    big for an array, columns with more than one kind of value) is a list.
+    ``NULL``\ s are ``0`` in arrays and ``None`` in lists.
+
+    *validity* is a :py:class:`bytearray` (an :py:class:`array.array` of
+    bytes on Python 2.5) with a bit for each value, set if the value isn't
+    ``NULL`` (least significant bit first, as in Apache Arrow), or ``None``
+    if there are no ``NULL``\ s. *null_count* is the
+    number of ``NULL``\ s.
+
+    Indexing or iterating over a column gives ``None`` for ``NULL``\ s.
+    """
+    __slots__ = ('values', 'validity', 'null_count')
+
+    def __init__(self, values, validity=None, null_count=0):
+        self.values = values
+        self.validity = validity
+        self.null_count = null_count
+
+    def is_null(self, i):
+        if self.validity is None:
+            return False
+        if i < 0:
+            i += len(self.values)
+        return not self.validity[i >> 3] & (1 << (i & 7))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(len(self.values)))]
+
+        value = self.values[i]
+        if self.validity is not None and self.is_null(i):
+            return None
+        return value
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        if self.validity is None:
+            return iter(self.values)
+        else:
+            return (self[i] for i in xrange(len(self.values)))
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self))
+
+if Sequence is not None:
+    Sequence.register(Column)
+
+
+def record_class(cols):
+    """Get the subclass of :py:class:`Record` for the given sequence of
+    column names, creating it if need be."""
+    cols = tuple(cols)
+
+    try:
+        return _RECORD_CLASSES[cols]
+    except KeyError:
+        if len(_RECORD_CLASSES) >= _MAX_CACHE_SIZE:
+            _RECORD_CLASSES.clear()
+
+        cls = type('Record', (Record,), {
+            '__slots__': (),
+            '_columns': cols,
+            '_index': dict((col, i) for i, col in enumerate(cols)),
+        })
+        _RECORD_CLASSES[cols] = cls
+        return cls
+
+
+def _iter_definition_starts(sql, pos):
+    """Yield the offset of each top-level definition (column, key, etc.)
+    in a ``CREATE TABLE`` statement, given *pos*, the offset just after
+    its opening paren."""
+    yield pos
+
+    depth = 1
+    for m in CREATE_TABLE_TOKEN_RE.finditer(sql, pos):
+        token = m.group()
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+            if not depth:
+                return
+        elif token == ',' and depth == 1:
+            yield m.end()
+
+
+class SchemaRegistry(object):
+    """Column names and types for tables, read from the ``CREATE TABLE``
+    statements in a dump.
+
+    Pass this to a protocol or :py:func:`parse_insert` as *schema*, and
+    values will be decoded based on their column's type, rather than
+    guessing from what they look like:
+
+    * integer types become :py:class:`int`, without trying other
+      number formats first
+    * ``DECIMAL`` and ``NUMERIC`` become :py:class:`Decimal`, and
+      ``FLOAT``/``DOUBLE`` become :py:class:`float`, regardless of
+      *decimal*
+    * ``DATETIME`` and ``TIMESTAMP`` become :py:class:`datetime.datetime`,
+      ``DATE`` becomes :py:class:`datetime.date`, and ``TIME`` becomes
+      :py:class:`datetime.timedelta` (times can be negative, or more than
+      24 hours). "Zero" dates (e.g. ``'0000-00-00'``) become ``None``.
+    * ``BLOB`` and ``BINARY`` types become bytes, even if they weren't
+      dumped in hex.
+
+    Everything else is decoded as usual.
+    """
+    def __init__(self):
+        # map from table to list of (column name, type)
+        self._tables = {}
+        # map from (table, cols, encoding) to converters
+        self._converters = {}
+
+    def add_create_table(self, sql, encoding=None):
+        """Read column names and types from a ``CREATE TABLE`` statement.
+        Replaces any existing schema for the same table."""
+        sql = decode_string(sql, encoding)
+
+        m = CREATE_TABLE_RE.search(sql)
+        if not m:
+            raise ValueError('not a CREATE TABLE statement')
+
+        table = m.group('table')
+        columns = []
+        for pos in _iter_definition_starts(sql, m.end()):
+            col_m = COLUMN_DEFINITION_RE.match(sql, pos)
+            if col_m:
+                columns.append(
+                    (col_m.group('col'), col_m.group('type').lower()))
+
+        if not columns:
+            raise ValueError('no columns in CREATE TABLE statement for `%s`'
+                             % table)
+
+        self._tables[table] = columns
+
+        # invalidate cached converters
+        self._converters = {}
+
+    def add_dump(self, lines, encoding=None):
+        """Read every ``CREATE TABLE`` statement in a dump (any iterable of
+        lines, such as a file), ignoring everything else."""
+        statement = None
+        for line in lines:
+            if statement is None:
+                if line.startswith('CREATE'):
+                    statement = []
+                else:
+                    continue
+
+            statement.append(line)
+
+            if line.rstrip().endswith(';'):
+                sql = ''.join(statement)
+                # skip CREATE DATABASE, CREATE VIEW, etc.
+                if CREATE_TABLE_RE.match(sql):
+                    self.add_create_table(sql, encoding=encoding)
+                statement = None
+
+    def __contains__(self, table):
+        return table in self._tables
+
+    def column_names(self, table):
+        """The names of the columns of *table*, in order."""
+        return [col for col, _ in self._tables[table]]
+
+    def column_types(self, table):
+        """The (lowercase) type of each column of *table*, e.g. ``'int'``
+        or ``'varchar'``, in order."""
+        return [col_type for _, col_type in self._tables[table]]
+
+    def converters(self, table, cols=(), encoding=None):
+        """Get functions to decode each column of an ``INSERT`` into
+        *table*, or ``None`` if we don't know about *table*.
+
+        :param cols: the column names from the ``INSERT``, if any.
+                     Otherwise we assume it includes every column in the
+                     table.
+        :param encoding: the encoding of the ``INSERT``, used to turn
+                         strings into bytes for ``BLOB`` columns.
+
+        Returns ``(number_converters, string_converters)``: lists with an
+        entry for each column, which is either ``None`` (decode as usual),
+        or a function. Number converters take the text of the number;
+        string converters take the unescaped string.
+        """
+        if table not in self._tables:
+            return None
+
+        key = (table, tuple(cols), encoding)
+        if key not in self._converters:
+            types = dict(self._tables[table])
+            if cols:
+                try:
+                    col_types = [types[col] for col in cols]
+                except KeyError, e:
+                    raise ValueError('bad INSERT, table %s has no column %r'
+                                     % (table, e.args[0]))
+            else:
+                col_types = self.column_types(table)
+
+            bytes_converter = _bytes_converter(encoding or 'utf_8')
+
+            num_convs = []
+            str_convs = []
+            for col_type in col_types:
+                num_conv, str_conv = MYSQL_TYPE_CONVERTERS.get(
+                    col_type, (None, None))
+                if str_conv is _bytes_converter:
+                    str_conv = bytes_converter
+                num_convs.append(num_conv)
+                str_convs.append(str_conv)
+
+            self._converters[key] = (num_convs, str_convs)
+
+        return self._converters[key]
 
 
 class MySQLCompleteInsertProtocol(AbstractMySQLInsertProtocol):
@@ -118,79 +909,814 @@ class MySQLExtendedInsertProtocol(AbstractMySQLInsertProtocol):
 
 
 def parse_insert(sql, complete=False, decimal=False, encoding=None,
-                 single_row=False):
+                 single_row=False, stream=False, compact=False,
+                 columns=None, lazy=False, schema=None, columnar=False,
+                 blob='str', decoder=None):
+
+    _check_blob_option(blob)
+
+    if decoder is None:
+        decoder = Decoder(encoding)
+
+    sql, table, cols, pos, converters = _parse_insert_header(
+        sql, complete, decoder, schema)
+
+    if columnar:
+        _check_columnar_options(columnar, stream, lazy)
+        num_rows, out_cols, data = _parse_columns(
+            sql, pos, cols, decimal=decimal, columns=columns,
+            converters=converters, use_numpy=(columnar == 'numpy'),
+            blob=blob, decoder=decoder)
+
+        if single_row and num_rows != 1:
+            raise ValueError(
+                'bad INSERT, expected 1 row but got %d' % num_rows)
+
+        if complete:
+            return table, dict(zip(out_cols, data))
+        else:
+            return table, data
+
+    rows = _iter_rows(sql, pos, cols, complete=complete, decimal=decimal,
+                      compact=compact, columns=columns, lazy=lazy,
+                      converters=converters, blob=blob, decoder=decoder)
+
+    if stream and not single_row:
+        return table, rows
+
+    results = list(rows)
+
+    if single_row:
+        if len(results) == 1:
+            return table, results[0]
+        else:
+            raise ValueError(
+                'bad INSERT, expected 1 row but got %d' % len(results))
+    else:
+        return table, results
+
+
+def iter_insert_rows(sql, complete=False, decimal=False, encoding=None,
+                     compact=False, columns=None, lazy=False, schema=None,
+                     blob='str', decoder=None):
+    """Parse an INSERT statement, yielding ``(table, row)`` as soon as
+    each row's close paren is read, so that only one row needs to be in
+    memory at a time.
+
+    Takes the same arguments as :py:func:`parse_insert`. Errors in the
+    table name or column names are raised before the first row is
+    yielded; errors in the values are raised when we reach them.
+    """
+    _check_blob_option(blob)
+
+    if decoder is None:
+        decoder = Decoder(encoding)
+
+    sql, table, cols, pos, converters = _parse_insert_header(
+        sql, complete, decoder, schema)
+
+    for row in _iter_rows(sql, pos, cols, complete=complete, decimal=decimal,
+                          compact=compact, columns=columns, lazy=lazy,
+                          converters=converters, blob=blob,
+                          decoder=decoder):
+        yield table, row
+
+
+def parse_insert_table(sql, encoding=None):
+    """Get the table name from an INSERT statement, without decoding or
+    parsing the rest of it. Returns ``None`` if *sql* doesn't look like an
+    INSERT.
+    """
+    m = INSERT_TABLE_RE.match(sql)
+
+    # this happens with encodings that aren't a superset of ASCII,
+    # like UTF-16
+    if m is None and not isinstance(sql, unicode):
+        m = INSERT_TABLE_RE.match(decode_string(sql, encoding))
 
-    sql = decode_string(sql, encoding)
+    if m is None:
+        return None
+    else:
+        return decode_string(m.group(1), encoding)
+
+
+def _parse_insert_header(sql, complete, decoder, schema=None):
+    """Parse everything before the values.
+
+    Returns ``(sql, table, cols, pos, converters)``, where *cols* is a
+    (possibly empty) tuple of column names, *pos* is where the values
+    start, and *converters* is from :py:meth:`SchemaRegistry.converters`
+    (or ``None``).
+
+    If *sql* is a byte string in an encoding where that's safe (see
+    :py:func:`is_ascii_compatible`), we leave it alone, and it's up to the
+    caller to decode strings as it parses them. Otherwise, *sql* is
+    decoded with *decoder* (a :py:class:`~mr3po.common.Decoder`).
+
+    If *complete* is true and the INSERT doesn't have column names, we
+    get them from *schema*, if we can.
+    """
+    encoding = decoder.encoding
+
+    if isinstance(sql, str) and not is_ascii_compatible(encoding):
+        sql = decoder.decode(sql)
 
     if not sql.startswith('INSERT'):
         raise ValueError('not an INSERT statement')
 
-    identifiers = []
-    rows = []
+    header = INSERT_HEADER_RE.match(sql)
+    if not header:
+        raise ValueError('bad INSERT, no identifiers')
+
+    # the same bytes mean different things in different encodings
+    key = (header.group(0), encoding)
+    try:
+        table, cols = _HEADER_CACHE[key]
+    except KeyError:
+        if len(_HEADER_CACHE) >= _MAX_CACHE_SIZE:
+            _HEADER_CACHE.clear()
+
+        table = decoder.decode(header.group('table'))
+        cols = header.group('cols')
+        if cols:
+            cols = tuple(decoder.decode(col)
+                         for col in IDENTIFIER_RE.findall(cols))
+        else:
+            cols = ()
+        _HEADER_CACHE[key] = table, cols
+
+    if complete and not cols:
+        if schema is not None and table in schema:
+            cols = tuple(schema.column_names(table))
+        else:
+            raise ValueError('incomplete INSERT, no column names')
+
+    if schema is not None:
+        converters = schema.converters(table, cols, encoding=encoding)
+    else:
+        converters = None
+
+    return sql, table, cols, header.end(), converters
+
+
+def is_ascii_compatible(encoding):
+    """Can we parse SQL in *encoding* without decoding it first? This is
+    true for UTF-8 and for single-byte encodings that extend ASCII
+    (latin-1, cp1252, etc.), where any byte that looks like a quote or a
+    backslash really is one. *encoding* may be ``None`` (UTF-8, falling
+    back to latin-1).
+    """
+    try:
+        return _ASCII_COMPATIBLE[encoding]
+    except KeyError:
+        pass
+
+    if not encoding:
+        result = True
+    else:
+        try:
+            name = codecs.lookup(encoding).name
+        except LookupError:
+            # let the decoder raise the error
+            name = None
+
+        result = bool(name) and (
+            name in ('utf-8', 'ascii') or
+            name.startswith(('iso8859-', 'cp125', 'koi8-')))
+
+    _ASCII_COMPATIBLE[encoding] = result
+    return result
+
+
+def _column_positions(columns, cols):
+    """Convert *columns* (names or positions) to a list of positions,
+    using the column names *cols* from the INSERT statement."""
+    positions = []
+    for col in columns:
+        if isinstance(col, (int, long)):
+            if col < 0:
+                raise ValueError('bad column position: %d' % col)
+            positions.append(col)
+        elif col in cols:
+            positions.append(cols.index(col))
+        else:
+            raise ValueError('bad INSERT, no column named %r' % (col,))
+    return positions
+
+
+def _iter_rows(sql, pos, cols, complete=False, decimal=False, compact=False,
+               columns=None, lazy=False, converters=None, blob='str',
+               decoder=None):
+    """Yield each row of values in *sql*, starting at *pos*. Rows are lists,
+    or if *complete* is true, dicts (or :py:class:`Record`\ s if *compact*
+    is true).
+
+    If *lazy* is true, rows are :py:class:`LazyRow`\ s (wrapped in
+    :py:class:`Record`\ s if *complete* is true).
+
+    *converters* is ``(number_converters, string_converters)``, from
+    :py:meth:`SchemaRegistry.converters`.
+
+    If *sql* is a byte string, we decode each string with *decoder* (a
+    :py:class:`~mr3po.common.Decoder`).
+    """
+    decode = isinstance(sql, str)
+    if decoder is None:
+        decoder = Decoder()
+    # we call unicode() ourselves rather than decoder.decode(), since this
+    # is the inner loop
+    codec = decoder.codec
+
+    if columns is None:
+        positions = wanted = None
+        out_cols = cols
+    else:
+        positions = _column_positions(columns, cols)
+        wanted = frozenset(positions)
+        if complete:
+            out_cols = tuple(cols[i] for i in positions)
+
+    if complete and (compact or lazy):
+        make_record = record_class(out_cols)
+    else:
+        make_record = None
+
+    if converters is not None:
+        num_convs, str_convs = converters
+        # the schema tells us how long rows should be
+        row_len = len(num_convs)
+
+        if lazy and positions is not None:
+            lazy_converters = ([num_convs[i] for i in positions],
+                               [str_convs[i] for i in positions])
+        else:
+            lazy_converters = converters
+    else:
+        num_convs = str_convs = lazy_converters = None
+        row_len = len(cols) if cols else None
+
+    num_rows = 0
+
     current_row = []
-    for m in INSERT_RE.finditer(sql):
-        if m.group('identifier'):
-            identifiers.append(m.group('identifier'))
-        elif m.group('null'):
-            current_row.append(None)
-        elif m.group('string') is not None:  # parse empty strings!
-            current_row.append(unescape_string(m.group('string')))
-        elif m.group('hex'):
-            current_row.append(m.group('hex').decode('hex'))
-        elif m.group('number'):
-            current_row.append(
-                parse_number(m.group('number'), decimal=decimal))
-        elif m.group('close_paren'):
+    append = current_row.append
+    for m in INSERT_RE.finditer(sql, pos):
+        # check the most common tokens first
+        kind = m.lastindex
+
+        # skip over columns we don't want without decoding them
+        if (wanted is not None and kind in _VALUE_TOKENS and
+                len(current_row) not in wanted):
+            append(None)
+            continue
+
+        # just remember where the value is; LazyRow will decode it
+        if lazy and kind in _VALUE_TOKENS:
+            if kind == _NULL:
+                append(None)
+            else:
+                append((kind, m.start(kind), m.end(kind)))
+            continue
+
+        if kind == _STRING:
+            value = unescape_string(m.group(_STRING))
+            str_conv = None
+            if str_convs:
+                i = len(current_row)
+                if i < row_len:
+                    str_conv = str_convs[i]
+                    # BLOBs are already bytes; don't decode them
+                    if str_conv and _takes_raw_bytes(str_conv):
+                        append(str_conv(value))
+                        continue
+            if decode:
+                try:
+                    value = unicode(value, codec)
+                except UnicodeDecodeError:
+                    value = decoder.fallback(value)
+                    # the decoder may have switched to latin-1
+                    codec = decoder.codec
+            if str_conv:
+                value = str_conv(value)
+            append(value)
+        elif kind == _NUMBER:
+            if num_convs:
+                i = len(current_row)
+                if i < row_len and num_convs[i]:
+                    append(num_convs[i](m.group(_NUMBER)))
+                    continue
+            append(parse_number(m.group(_NUMBER), decimal=decimal))
+        elif kind == _NULL:
+            append(None)
+        elif kind == _CLOSE_PAREN:
             # woot, I'm a parser
-            if current_row:
-                rows.append(current_row)
-                current_row = []
+            if not current_row:
+                continue
+
+            if row_len is None:
+                row_len = len(current_row)
+            elif len(current_row) != row_len:
+                if converters is not None:
+                    raise ValueError(
+                        'bad INSERT, schema has %d columns but row %d has'
+                        ' %d values' % (row_len, num_rows, len(current_row)))
+                elif cols:
+                    raise ValueError(
+                        'bad INSERT, %d column names but row %d has'
+                        ' %d values' % (row_len, num_rows, len(current_row)))
+                else:
+                    raise ValueError(
+                        'bad INSERT, row 0 has %d values, but row %d has'
+                        ' %d values' % (row_len, num_rows, len(current_row)))
+
+            if positions is not None:
+                if num_rows == 0 and positions and max(positions) >= row_len:
+                    raise ValueError(
+                        'bad INSERT, no column %d in rows with %d values' %
+                        (max(positions), row_len))
+                values = [current_row[i] for i in positions]
+            else:
+                values = current_row
+
+            if lazy:
+                values = LazyRow(sql, values, decimal=decimal,
+                                 converters=lazy_converters, blob=blob,
+                                 decoder=decoder)
+
+            if make_record:
+                yield make_record(values)
+            elif complete:
+                yield dict(zip(out_cols, values))
+            else:
+                yield values
+            num_rows += 1
+
+            current_row = []
+            append = current_row.append
+        elif kind == _HEX:
+            append(_decode_hex(sql, m.start(_HEX), m.end(_HEX), blob))
         else:
-            assert False, 'should not be reached!'
+            raise ValueError(
+                'bad INSERT, unexpected identifier %r' %
+                decoder.decode(m.group(_IDENTIFIER)))
 
     if current_row:
         raise ValueError('bad INSERT, missing close paren')
 
-    if not rows:
+    if not num_rows:
         raise ValueError('bad INSERT, no values')
 
-    row_len = len(rows[0])
-    for i, row in enumerate(rows[1:]):
-        if len(row) != row_len:
+
+def _check_columnar_options(columnar, stream=False, lazy=False):
+    if columnar not in (True, 'numpy'):
+        raise ValueError("columnar must be True or 'numpy', not %r" %
+                         (columnar,))
+
+    if columnar == 'numpy' and numpy is None:
+        raise ImportError("columnar='numpy' requires NumPy")
+
+    if stream or lazy:
+        raise ValueError("columnar can't be used with stream or lazy")
+
+
+def _parse_columns(sql, pos, cols, decimal=False, columns=None,
+                   converters=None, use_numpy=False, blob='str',
+                   decoder=None):
+    """Parse the values in *sql*, starting at *pos*, into a
+    :py:class:`Column` for each column.
+
+    We make one pass over *sql* to collect the text of each value, and
+    then decode each column's values all at once.
+
+    Returns ``(num_rows, out_cols, data)``, where *data* is a list of
+    :py:class:`Column`\ s, and *out_cols* are their names (if *cols* is
+    non-empty).
+    """
+    if converters is not None:
+        num_convs, str_convs = converters
+        row_len = len(num_convs)
+    else:
+        num_convs = str_convs = None
+        row_len = len(cols) if cols else None
+
+    if columns is None:
+        positions = wanted = None
+    else:
+        positions = _column_positions(columns, cols)
+        wanted = frozenset(positions)
+
+    # for each column: a list of the text of each value (None for NULL),
+    # or None if we're skipping the column
+    texts = []
+    # the kind of token in each column, or _MIXED
+    kinds = []
+    # the rows where each column is NULL
+    nulls = []
+
+    num_rows = 0
+    i = 0
+    for m in INSERT_RE.finditer(sql, pos):
+        kind = m.lastindex
+
+        if kind == _CLOSE_PAREN:
+            if not i:
+                continue
+
+            if row_len is None:
+                row_len = i
+            elif i != row_len:
+                if converters is not None:
+                    raise ValueError(
+                        'bad INSERT, schema has %d columns but row %d has'
+                        ' %d values' % (row_len, num_rows, i))
+                elif cols:
+                    raise ValueError(
+                        'bad INSERT, %d column names but row %d has'
+                        ' %d values' % (row_len, num_rows, i))
+                else:
+                    raise ValueError(
+                        'bad INSERT, row 0 has %d values, but row %d has'
+                        ' %d values' % (row_len, num_rows, i))
+
+            num_rows += 1
+            i = 0
+            continue
+        elif kind == _IDENTIFIER:
             raise ValueError(
-                'bad INSERT, row 0 has %d values, but row %d has %d values' %
-                (row_len, i + 1, len(row)))
+                'bad INSERT, unexpected identifier %r' %
+                decoder.decode(m.group(_IDENTIFIER)))
 
-    if not identifiers:
-        raise ValueError('bad INSERT, no identifiers')
+        try:
+            column = texts[i]
+        except IndexError:
+            if num_rows:
+                # too many values; the check at the close paren will
+                # raise an error
+                i += 1
+                continue
+
+            # first row, so we're still finding out how many columns
+            # there are
+            if wanted is None or i in wanted:
+                column = []
+            else:
+                column = None
+            texts.append(column)
+            kinds.append(None)
+            nulls.append([])
 
-    table, cols = identifiers[0], identifiers[1:]
+        if column is not None:
+            if kinds[i] == kind:
+                column.append(m.group(kind))
+            elif kind == _NULL:
+                column.append(None)
+                nulls[i].append(num_rows)
+            elif kinds[i] is None:
+                kinds[i] = kind
+                column.append(m.group(kind))
+            else:
+                if kinds[i] != _MIXED:
+                    # from now on, remember the kind of each value
+                    column[:] = [None if t is None else (kinds[i], t)
+                                 for t in column]
+                    kinds[i] = _MIXED
+                column.append((kind, m.group(kind)))
 
-    if cols and len(cols) != row_len:
+        i += 1
+
+    if i:
+        raise ValueError('bad INSERT, missing close paren')
+
+    if not num_rows:
+        raise ValueError('bad INSERT, no values')
+
+    if positions is None:
+        positions = range(row_len)
+    elif positions and max(positions) >= row_len:
         raise ValueError(
-            'bad INSERT, %d column names but rows have %d values' %
-            (len(cols), row_len))
+            'bad INSERT, no column %d in rows with %d values' %
+            (max(positions), row_len))
 
-    if complete:
-        if cols:
-            results = [dict(zip(cols, row)) for row in rows]
+    data = []
+    for i in positions:
+        if converters is not None:
+            num_conv = num_convs[i]
+            str_conv = str_convs[i]
         else:
-            raise ValueError('incomplete INSERT, no column names')
+            num_conv = str_conv = None
+
+        data.append(_make_column(
+            texts[i], kinds[i], nulls[i], decimal=decimal,
+            num_conv=num_conv, str_conv=str_conv, use_numpy=use_numpy,
+            blob=blob, decoder=decoder))
+
+    out_cols = tuple(cols[i] for i in positions) if cols else ()
+
+    return num_rows, out_cols, data
+
+
+def _make_column(texts, kind, nulls, decimal=False, num_conv=None,
+                 str_conv=None, use_numpy=False, blob='str', decoder=None):
+    """Decode the text of every value in a column (from
+    :py:func:`_parse_columns`), and wrap them in a :py:class:`Column`.
+
+    *nulls* is the indexes of the ``NULL``\ s in *texts*. (We don't
+    just look for ``None`` in *texts*, since comparing unicode to ``None``
+    is slow.)
+    """
+    if nulls:
+        all_valid = '\xff' * ((len(texts) + 7) // 8)
+        if bytearray is not None:
+            validity = bytearray(all_valid)
+        else:
+            validity = array('B', all_valid)
+        for i in nulls:
+            validity[i >> 3] &= ~(1 << (i & 7))
     else:
-        results = rows
+        validity = None
 
-    if single_row:
-        if len(results) == 1:
-            return table, results[0]
+    if kind == _NUMBER and num_conv in (None, int, float):
+        values = _number_values(texts, nulls, decimal, num_conv)
+        if use_numpy and isinstance(values, array):
+            values = numpy.frombuffer(values, dtype=values.typecode)
+    elif kind is None:
+        # all NULL
+        values = texts
+    else:
+        if kind == _STRING:
+            if str_conv and _takes_raw_bytes(str_conv):
+                def decode(text):
+                    return str_conv(unescape_string(text))
+            elif str_conv:
+                def decode(text):
+                    return str_conv(decoder.decode(unescape_string(text)))
+            else:
+                def decode(text):
+                    return decoder.decode(unescape_string(text))
+        elif kind == _HEX:
+            def decode(text):
+                return _blob(_unhexlify(text), blob)
+        elif kind == _NUMBER:
+            decode = num_conv
         else:
-            raise ValueError(
-                'bad INSERT, expected 1 row but got %d' % len(results))
+            def decode(field):
+                return _decode_token(field[0], field[1], decimal,
+                                     num_conv, str_conv, blob, decoder)
+
+        if nulls:
+            values = [None if t is None else decode(t) for t in texts]
+        else:
+            values = map(decode, texts)
+
+    return Column(values, validity, len(nulls))
+
+
+def _number_values(texts, nulls, decimal, num_conv=None):
+    """Convert a column of numbers to an :py:class:`array.array` of ints
+    or floats, if we can, and a list if we can't."""
+    if nulls:
+        filled = list(texts)
+        for i in nulls:
+            filled[i] = '0'
     else:
-        return table, results
+        filled = texts
+
+    if num_conv is not float:
+        try:
+            ints = map(int, filled)
+        except ValueError:
+            # not all integers. Let the schema's int() raise an error
+            if num_conv is int:
+                raise
+        else:
+            try:
+                return array('l', ints)
+            except OverflowError:
+                if nulls:
+                    return [None if t is None else n
+                            for t, n in zip(texts, ints)]
+                return ints
+
+        if decimal:
+            if nulls:
+                return [None if t is None else Decimal(t) for t in texts]
+            return map(Decimal, texts)
+
+    return array('d', map(float, filled))
+
+
+def iter_statements(buf, pos=0, endpos=None):
+    """Find the SQL statements in *buf* (a string, or anything that
+    supports the buffer interface, like an :py:class:`mmap.mmap`), ignoring
+    comments and whitespace between them.
+
+    Yields ``(start, end)`` for each statement; *end* is just after the
+    semicolon. If the last statement doesn't end in a semicolon, it runs
+    to *endpos*.
+    """
+    if endpos is None:
+        endpos = len(buf)
+
+    while pos < endpos:
+        pos = SKIP_TO_STATEMENT_RE.match(buf, pos, endpos).end()
+        if pos >= endpos:
+            return
+
+        m = STATEMENT_RE.match(buf, pos, endpos)
+        if m:
+            end = m.end()
+        else:
+            end = endpos
+
+        yield pos, end
+        pos = end
+
+
+def iter_dump(dump, complete=False, decimal=False, encoding=None,
+              compact=False, columns=None, lazy=False, schema=None,
+              tables=None, exclude_tables=None, start=0, end=None,
+              blob='str', decoder=None):
+    """Read a whole file from :command:`mysqldump`, yielding
+    ``(table, row)`` for every row of every ``INSERT`` statement.
+
+    Unlike the protocols, ``INSERT`` statements needn't be on a line by
+    themselves. Other statements are skipped, except that if *schema* is
+    set, we add any ``CREATE TABLE`` statements to it (so it's fine
+    to pass in an empty :py:class:`SchemaRegistry`).
+
+    The file is memory-mapped rather than read, so it should be seekable,
+    and in an encoding that's a superset of ASCII (e.g. UTF-8 or latin-1).
+    We find statement boundaries and skip unwanted tables in place, but
+    each ``INSERT`` we actually parse is still copied out of the mapping
+    once: lazy rows keep a reference to their statement, which has to
+    outlive the mapping (we close it when we're done), and the tokenizer
+    relies on the statement being a :py:class:`str`. The copy is cheap
+    next to parsing the rows (well under 1% of the time).
+
+    :param dump: path or file object for the dump file
+    :param tables: only read ``INSERT``\ s into these tables
+    :param exclude_tables: don't read ``INSERT``\ s into these tables
+    :param start: byte offset to start reading at. This should be the start
+                  of a statement (see :py:func:`split_dump`).
+    :param end: byte offset to stop reading at (default is end of file).
+                We read every statement that starts before *end*, even
+                if it ends after it.
+
+    All other options are as for :py:func:`parse_insert`. Rows for
+    ``INSERT``\ s that don't have column names are dicts if *complete* is
+    set and *schema* knows the names of the table's columns. (When reading
+    part of a dump, the ``CREATE TABLE`` statements may be in some other
+    part, so fill *schema* beforehand with
+    :py:meth:`SchemaRegistry.add_dump`.)
+
+    Strings are decoded with *decoder*, a :py:class:`~mr3po.common.Decoder`
+    (by default, a new one for *encoding*), which is shared by all the
+    statements in the dump.
+    """
+    if decoder is None:
+        decoder = Decoder(encoding)
+
+    if isinstance(dump, basestring):
+        f = open(dump, 'rb')
+    else:
+        f = dump
+
+    try:
+        # can't mmap an empty file
+        f.seek(0, 2)
+        if not f.tell():
+            return
+
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for stmt_start, stmt_end in _iter_statements_starting_in(
+                    buf, start, end):
+                if buf[stmt_start:stmt_start + 6] == 'INSERT':
+                    if tables is not None or exclude_tables:
+                        m = INSERT_TABLE_RE.match(buf, stmt_start, stmt_end)
+                        table = m and decoder.decode(m.group(1))
+                        if ((tables is not None and table not in tables) or
+                                (exclude_tables and table in exclude_tables)):
+                            continue
+
+                    # copy the statement; see docstring for why
+                    for table_and_row in iter_insert_rows(
+                            buf[stmt_start:stmt_end], complete=complete,
+                            decimal=decimal, compact=compact,
+                            columns=columns, lazy=lazy, schema=schema,
+                            blob=blob, decoder=decoder):
+                        yield table_and_row
+
+                elif (schema is not None and
+                      CREATE_TABLE_RE.match(buf, stmt_start, stmt_end)):
+                    schema.add_create_table(buf[stmt_start:stmt_end],
+                                            encoding=decoder.encoding)
+        finally:
+            buf.close()
+    finally:
+        if f is not dump:
+            f.close()
+
+
+def _iter_statements_starting_in(buf, start=0, end=None):
+    """Like :py:func:`iter_statements`, except that we stop at the first
+    statement that starts at or after *end*, rather than cutting off
+    statements at *end*."""
+    for stmt_start, stmt_end in iter_statements(buf, start):
+        if end is not None and stmt_start >= end:
+            return
+        yield stmt_start, stmt_end
+
+
+def write_statement_index(dump, index_path=None):
+    """Scan a dump file once, and write the byte offset of the start of
+    each statement to a sidecar file, one per line. Any of these offsets
+    is a safe place to start reading the dump (see :py:func:`split_dump`).
+
+    :param dump: path to the dump file
+    :param index_path: where to write the index. Defaults to *dump* plus
+                       ``.idx``.
+
+    Returns the path of the index.
+    """
+    if index_path is None:
+        index_path = dump + '.idx'
+
+    f = open(dump, 'rb')
+    try:
+        index = open(index_path, 'w')
+        try:
+            # can't mmap an empty file
+            f.seek(0, 2)
+            if f.tell():
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    for start, _ in iter_statements(buf):
+                        index.write('%d\n' % start)
+                finally:
+                    buf.close()
+        finally:
+            index.close()
+    finally:
+        f.close()
+
+    return index_path
+
+
+def read_statement_index(index_path):
+    """Read the offsets written by :py:func:`write_statement_index`."""
+    f = open(index_path)
+    try:
+        return [int(line) for line in f]
+    finally:
+        f.close()
+
+
+def split_dump(dump, num_splits, index_path=None):
+    """Split a dump file into (at most) *num_splits* byte ranges of about
+    the same size, each of which starts at the beginning of a statement,
+    so that they can be read in parallel (e.g. with
+    :py:func:`iter_dump`'s *start* and *end* options).
+
+    We use the index written by :py:func:`write_statement_index`, creating
+    it if it doesn't exist.
+
+    :param dump: path to the dump file
+    :param num_splits: how many pieces to split the dump into
+    :param index_path: path of the index. Defaults to *dump* plus
+                       ``.idx``.
+
+    Returns a list of ``(start, end)``. Fewer than *num_splits* ranges are
+    returned if there aren't enough statements to go around.
+    """
+    if num_splits < 1:
+        raise ValueError('num_splits must be at least 1')
+
+    if index_path is None:
+        index_path = dump + '.idx'
+
+    if not os.path.exists(index_path):
+        write_statement_index(dump, index_path)
+
+    offsets = read_statement_index(index_path)
+    size = os.path.getsize(dump)
+
+    if not offsets:
+        return []
+
+    # the first range always starts at 0, so it includes anything before
+    # the first statement
+    boundaries = [0]
+    for i in xrange(1, num_splits):
+        j = bisect_left(offsets, size * i // num_splits)
+        if j < len(offsets) and offsets[j] > boundaries[-1]:
+            boundaries.append(offsets[j])
+    boundaries.append(size)
+
+    return zip(boundaries[:-1], boundaries[1:])
 
 
 def dump_as_insert(table, data, complete=False, encoding=None,
-                   output_tab=False, single_row=False):
+                   output_tab=False, single_row=False, sort_columns=True):
     if not table or not isinstance(table, basestring):
         raise ValueError('Bad table name')
 
@@ -200,37 +1726,314 @@ def dump_as_insert(table, data, complete=False, encoding=None,
     if single_row:
         data = [data]
 
-    cols = None
+    if complete:
+        encoder = insert_encoder(
+            table, cols=row_columns(data[0], sort_columns),
+            output_tab=output_tab)
+    else:
+        encoder = insert_encoder(
+            table, num_cols=len(data[0]), output_tab=output_tab)
+
+    sql = '%s%s;' % (encoder.prefix, ', '.join(encoder.format_rows(data)))
+
+    return sql.encode(encoding or 'utf_8')
+
+
+def write_insert(fileobj, table, rows, complete=False, encoding=None,
+                 output_tab=False, sort_columns=True):
+    """Write an ``INSERT`` statement to *fileobj*, followed by a newline.
+    This writes the same statement as :py:func:`dump_as_insert`, but it
+    formats, encodes, and writes one row at a time, so giant statements
+    never have to fit in memory. Use it with a buffered file.
+
+    *rows* may be any iterable, including a generator. If a row doesn't
+    match the first row's columns, we raise :py:class:`ValueError`, after
+    having written the rows before it.
+
+    Returns the number of rows written.
+    """
+    if not table or not isinstance(table, basestring):
+        raise ValueError('Bad table name')
+
+    rows = iter(rows)
+    try:
+        first_row = rows.next()
+    except StopIteration:
+        raise ValueError('No data to insert')
 
     if complete:
-        rows = []
-        for row_num, row_data in enumerate(data):
-            row_cols, row = zip(*sorted(row_data.iteritems()))
-            if cols is None:
-                cols = row_cols
-            elif cols != row_cols:
-                raise ValueError(
-                    'row 0 has columns %r, but row %d has columns %r'
-                    % (cols, row_num, row_cols))
+        insert_enc = insert_encoder(
+            table, cols=row_columns(first_row, sort_columns),
+            output_tab=output_tab)
+    else:
+        insert_enc = insert_encoder(
+            table, num_cols=len(first_row), output_tab=output_tab)
+
+    # an incremental encoder only puts the BOM (if any) at the start
+    encode = codecs.getincrementalencoder(encoding or 'utf_8')().encode
+    write = fileobj.write
+    get_values = insert_enc.values
+
+    write(encode(insert_enc.prefix + insert_enc.format_row(first_row)))
+
+    num_rows = 1
+    for row in rows:
+        values = get_values(row)
+        if values is None:
+            raise insert_enc._bad_row_error(row, num_rows)
+
+        write(encode(', ' + format_row(values)))
+        num_rows += 1
+
+    write(encode(';\n'))
+
+    return num_rows
 
-            rows.append(row)
+
+def row_columns(row, sort_columns=True):
+    """Get the column names of *row* (a dict), in the order we write them:
+    sorted, or if *sort_columns* is false, the order *row* iterates in."""
+    if sort_columns:
+        return tuple(sorted(row))
     else:
-        num_cols = len(data[0])
-        for i, row_data in enumerate(data[1:]):
-            if len(row_data) != num_cols:
-                raise ValueError(
-                    'row 0 has %d items, but row %d has %d items' %
-                    (num_cols, i + 1, len(row_data)))
+        return tuple(row)
 
-        rows = data
 
-    sql = 'INSERT INTO %s%s%s VALUES %s;' % (
-        format_identifier(table),
-        '\t' if output_tab else '',
-        (' ' + format_cols(cols)) if cols else '',
-        ', '.join(format_row(row) for row in rows))
+class InsertEncoder(object):
+    """Formats rows for ``INSERT``\ s into one table, with one set of
+    columns.
 
-    return sql.encode(encoding or 'utf_8')
+    Everything that's the same for every row (the quoted table and column
+    names, and how to pull values out of a dict in column order) is worked
+    out once, when the encoder is created. Values are formatted by looking
+    up their exact type in :py:data:`VALUE_FORMATTERS`, falling back to
+    :py:func:`format_value` for anything else (e.g. subclasses).
+
+    Use :py:func:`insert_encoder` to get a cached encoder rather than
+    making a new one for every statement.
+    """
+    def __init__(self, table, cols=None, num_cols=None, output_tab=False):
+        """
+        :param table: name of the table
+        :param cols: if rows are dicts, the column names, in the order to
+                     write them. If this is ``None``, rows are sequences
+                     of values.
+        :param num_cols: if rows are sequences, how many values each row
+                         must have (``None`` means any number)
+        :param output_tab: put a tab after the table name
+        """
+        self.table = table
+        self.output_tab = output_tab
+
+        if cols is None:
+            self.cols = None
+            self.num_cols = num_cols
+            self._get_values = None
+        else:
+            self.cols = cols = tuple(cols)
+            self.num_cols = len(cols)
+            if len(cols) > 1:
+                self._get_values = itemgetter(*cols)
+            else:
+                # itemgetter() with one key doesn't return a tuple
+                self._get_values = lambda row: tuple([row[c] for c in cols])
+
+        self.prefix = 'INSERT INTO %s%s%s VALUES ' % (
+            format_identifier(table),
+            '\t' if output_tab else '',
+            (' ' + format_cols(cols)) if cols else '')
+
+    def values(self, row):
+        """Get the values from *row* in the order we write them, or
+        ``None`` if *row* doesn't have the right columns (or number of
+        values)."""
+        if self.num_cols is not None and len(row) != self.num_cols:
+            return None
+
+        if self._get_values is None:
+            return row
+
+        try:
+            return self._get_values(row)
+        except KeyError:
+            return None
+
+    def format_row(self, row):
+        """Format *row* as ``(value,value,...)``. Raise :py:class:`ValueError`
+        if it doesn't have the right columns."""
+        values = self.values(row)
+        if values is None:
+            raise self._bad_row_error(row, 0)
+        return format_row(values)
+
+    def format_rows(self, rows):
+        """Format each row in *rows* (see :py:meth:`format_row`), and
+        return a list."""
+        get_formatter = VALUE_FORMATTERS.get
+        values = self.values
+        formatted = []
+
+        for row_num, row in enumerate(rows):
+            row_values = values(row)
+            if row_values is None:
+                raise self._bad_row_error(row, row_num)
+
+            formatted.append('(%s)' % ','.join([
+                get_formatter(x.__class__, format_value)(x)
+                for x in row_values]))
+
+        return formatted
+
+    def _bad_row_error(self, row, row_num):
+        if self.cols is None:
+            return ValueError(
+                'row 0 has %d items, but row %d has %d items' %
+                (self.num_cols, row_num, len(row)))
+        else:
+            return ValueError(
+                'row 0 has columns %r, but row %d has columns %r' %
+                (self.cols, row_num, row_columns(row)))
+
+    def __repr__(self):
+        if self.cols is None:
+            return 'InsertEncoder(%r, num_cols=%r, output_tab=%r)' % (
+                self.table, self.num_cols, self.output_tab)
+        else:
+            return 'InsertEncoder(%r, cols=%r, output_tab=%r)' % (
+                self.table, self.cols, self.output_tab)
+
+
+def insert_encoder(table, cols=None, num_cols=None, output_tab=False):
+    """Get an :py:class:`InsertEncoder` for the given table and columns,
+    creating it if need be."""
+    key = (table, cols, num_cols, output_tab)
+
+    try:
+        return _INSERT_ENCODERS[key]
+    except KeyError:
+        if len(_INSERT_ENCODERS) >= _MAX_CACHE_SIZE:
+            _INSERT_ENCODERS.clear()
+
+        encoder = InsertEncoder(table, cols=cols, num_cols=num_cols,
+                                output_tab=output_tab)
+        _INSERT_ENCODERS[key] = encoder
+        return encoder
+
+
+class BatchedInsertWriter(object):
+    """Write rows to a file as multi-row ``INSERT`` statements, one per
+    line, which MySQL can load much faster than one ``INSERT`` per row.
+
+    Consecutive rows for the same table and columns are grouped into a
+    single statement, up to *max_bytes* per statement (including the
+    trailing newline). A new statement is started whenever the table or
+    columns change.
+
+    Use it like this::
+
+        writer = BatchedInsertWriter(f, complete=True)
+        for table, row in rows:
+            writer.write(table, row)
+        writer.flush()
+
+    or use it as a context manager, which calls :py:meth:`flush` for you.
+    """
+    def __init__(self, fileobj, complete=False, encoding=None,
+                 max_bytes=DEFAULT_MAX_STATEMENT_BYTES, sort_columns=True):
+        """
+        :param fileobj: file-like object to write bytes to
+        :param complete: rows are dicts; include column names in the
+                         ``INSERT`` statements
+        :param encoding: Character encoding to use (default is UTF-8)
+        :param max_bytes: maximum size of each ``INSERT`` statement, in
+                          bytes. Should be no more than MySQL's
+                          ``max_allowed_packet``. A row too big to fit in
+                          a statement by itself is written on its own
+                          anyway.
+        :param sort_columns: if *complete* is set, write columns in sorted
+                             order. If false, use the order of the first
+                             row's keys (e.g. for
+                             :py:class:`~collections.OrderedDict`\ s).
+        """
+        self.fileobj = fileobj
+        self.complete = complete
+        self.encoding = encoding or 'utf_8'
+        self.max_bytes = max_bytes
+        self.sort_columns = sort_columns
+
+        # use an incremental encoder for each statement so that encodings
+        # with a BOM (e.g. UTF-16) only put it at the start of the
+        # statement, just like dump_as_insert()
+        self._new_encoder = codecs.getincrementalencoder(self.encoding)
+        encoder = self._new_encoder()
+        encoder.encode(u'')
+        self._row_sep = encoder.encode(u', ')
+        self._end = encoder.encode(u';\n')
+
+        # InsertEncoder for the current statement
+        self._insert_encoder = None
+        self._encoder = None
+        self._prefix = None
+        self._rows = []
+        self._size = 0
+
+    def write(self, table, row):
+        """Add one row (a dict if *complete* is set, otherwise a
+        sequence) to the current statement, or start a new one."""
+        if not table or not isinstance(table, basestring):
+            raise ValueError('Bad table name')
+
+        # usually, the row goes in the current statement
+        insert_enc = self._insert_encoder
+        values = None
+        if insert_enc is not None and table == insert_enc.table:
+            values = insert_enc.values(row)
+
+        if values is None:
+            self.flush()
+            if self.complete:
+                insert_enc = insert_encoder(
+                    table, cols=row_columns(row, self.sort_columns))
+            else:
+                insert_enc = insert_encoder(table, num_cols=len(row))
+            self._insert_encoder = insert_enc
+            self._start_statement()
+            values = insert_enc.values(row)
+
+        encoded_row = self._encoder.encode(format_row(values))
+
+        if (self._rows and self._size + len(self._row_sep) +
+                len(encoded_row) > self.max_bytes):
+            self.flush()
+
+        if self._rows:
+            self._size += len(self._row_sep)
+        self._size += len(encoded_row)
+        self._rows.append(encoded_row)
+
+    def _start_statement(self):
+        self._encoder = self._new_encoder()
+        self._prefix = self._encoder.encode(self._insert_encoder.prefix)
+        self._size = len(self._prefix) + len(self._end)
+
+    def flush(self):
+        """Write out the current statement, if any. Rows written after
+        this go in a new statement."""
+        if self._rows:
+            self.fileobj.write(
+                self._prefix + self._row_sep.join(self._rows) + self._end)
+            self._rows = []
+            self._start_statement()
+
+    def close(self):
+        """Write out the current statement. Doesn't close *fileobj*."""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
 
 
 def format_identifier(identifier):
@@ -243,7 +2046,15 @@ def format_cols(cols):
 
 
 def format_row(items):
-    return '(%s)' % ','.join(format_value(x) for x in items)
+    get_formatter = VALUE_FORMATTERS.get
+    return '(%s)' % ','.join([get_formatter(x.__class__, format_value)(x)
+                              for x in items])
+
+
+# types we write as hex literals (bytearray and memoryview don't exist in
+# older Pythons)
+_BYTES_TYPES = tuple(t for t in (str, bytearray, memoryview)
+                     if t is not None)
 
 
 def format_value(x):
@@ -253,27 +2064,176 @@ def format_value(x):
         return str(x)
     elif isinstance(x, unicode):
         return "'%s'" % escape_unicode_string(x)
-    elif isinstance(x, str):
-        return '0x%s' % x.encode('hex').upper()
+    elif isinstance(x, _BYTES_TYPES):
+        return '0x%s' % hexlify(x).upper()
     else:
         raise TypeError("can't encode values of type %s" %
                         x.__class__.__name__)
 
 
+def _format_null(x):
+    return 'NULL'
+
+
+def _format_unicode(u):
+    return "'%s'" % escape_unicode_string(u)
+
+
+def _format_bytes(b):
+    return '0x%s' % hexlify(b).upper()
+
+
+# map from type to function that formats values of exactly that type, so
+# we don't have to go through format_value()'s chain of isinstance()
+# checks for every value. Other types (including subclasses, like bool)
+# go through format_value().
+VALUE_FORMATTERS = {
+    type(None): _format_null,
+    int: str,
+    long: str,
+    float: str,
+    Decimal: str,
+    unicode: _format_unicode,
+}
+
+for _type in _BYTES_TYPES:
+    VALUE_FORMATTERS[_type] = _format_bytes
+del _type
+
+
 def string_escape_replacer(match):
     c = match.group(1)
+    if c is None:
+        return "'"
     return MYSQL_STRING_ESCAPES.get(c, c)
 
 
 def unescape_string(s):
-    return STRING_ESCAPE_RE.sub(string_escape_replacer, s)
+    # most strings don't have escapes
+    if '\\' not in s and "''" not in s:
+        return s
+
+    # split() puts what we matched at the odd indexes, and is quite a bit
+    # faster than calling string_escape_replacer() for each match
+    parts = STRING_ESCAPE_RE.split(s)
+    parts[1::2] = ["'" if c is None else MYSQL_STRING_ESCAPES.get(c, c)
+                   for c in parts[1::2]]
+    return s[:0].join(parts)
 
 
 def escape_unicode_string(u):
     if not isinstance(u, unicode):
         raise TypeError
-    # TODO: translate() was pretty slow last I checked; maybe try regex?
-    return u.translate(MYSQL_STRING_ESCAPES_FOR_TRANSLATE)
+
+    # most strings don't need escaping
+    if not NEEDS_ESCAPE_RE.search(u):
+        return u
+
+    # replace() is much faster than translate() or re.sub(), even with
+    # several passes
+    for c, escaped in MYSQL_STRING_ESCAPES_FOR_REPLACE:
+        if c in u:
+            u = u.replace(c, escaped)
+
+    return u
+
+
+def parse_datetime(s):
+    """Parse a MySQL ``DATETIME`` or ``TIMESTAMP`` (e.g.
+    ``'2012-06-19 15:13:46'``, possibly with fractional seconds). Return
+    ``None`` for zero dates."""
+    d = parse_date(s[:10])
+    if d is None:
+        return None
+
+    if len(s) > 20:
+        microsecond = int(s[20:26].ljust(6, '0'))
+    else:
+        microsecond = 0
+
+    return datetime(d.year, d.month, d.day,
+                    int(s[11:13]), int(s[14:16]), int(s[17:19]),
+                    microsecond)
+
+
+def parse_date(s):
+    """Parse a MySQL ``DATE`` (e.g. ``'2012-06-19'``). Return ``None`` for
+    zero dates."""
+    if s.startswith('0000-00-00'):
+        return None
+
+    if len(s) != 10 or s[4] != '-' or s[7] != '-':
+        raise ValueError('bad date: %r' % (s,))
+
+    return date(int(s[:4]), int(s[5:7]), int(s[8:10]))
+
+
+def parse_time(s):
+    """Parse a MySQL ``TIME`` (e.g. ``'-838:59:59'``) into a
+    :py:class:`timedelta`."""
+    sign = 1
+    if s.startswith('-'):
+        sign = -1
+        s = s[1:]
+
+    hms, _, fraction = s.partition('.')
+    hours, minutes, seconds = hms.split(':')
+
+    return sign * timedelta(
+        hours=int(hours), minutes=int(minutes), seconds=int(seconds),
+        microseconds=int(fraction.ljust(6, '0')[:6]))
+
+
+def _bytes_converter(encoding):
+    """Make a function that turns (unescaped) strings into bytes.
+
+    This is called on strings *before* they're decoded (see
+    :py:func:`_takes_raw_bytes`), so byte strings are passed through
+    as-is. Unicode strings only happen when we had to decode the whole
+    ``INSERT`` first; they're encoded with *encoding*, the codec that
+    decoded them.
+    """
+    def to_bytes(value):
+        if isinstance(value, unicode):
+            return value.encode(encoding)
+        else:
+            return value
+
+    to_bytes.raw_bytes = True
+    return to_bytes
+
+
+def _takes_raw_bytes(str_conv):
+    """Should *str_conv* be given strings without decoding them first?"""
+    return getattr(str_conv, 'raw_bytes', False)
+
+
+# map from (lowercase) MySQL type to (number converter, string converter),
+# for SchemaRegistry. _bytes_converter is a placeholder; SchemaRegistry
+# replaces it with a function that uses the right encoding.
+MYSQL_TYPE_CONVERTERS = {}
+
+for _type in ('tinyint', 'smallint', 'mediumint', 'int', 'integer',
+              'bigint', 'year'):
+    MYSQL_TYPE_CONVERTERS[_type] = (int, None)
+
+for _type in ('decimal', 'numeric', 'dec', 'fixed'):
+    MYSQL_TYPE_CONVERTERS[_type] = (Decimal, None)
+
+for _type in ('float', 'double', 'real'):
+    MYSQL_TYPE_CONVERTERS[_type] = (float, None)
+
+for _type in ('datetime', 'timestamp'):
+    MYSQL_TYPE_CONVERTERS[_type] = (None, parse_datetime)
+
+MYSQL_TYPE_CONVERTERS['date'] = (None, parse_date)
+MYSQL_TYPE_CONVERTERS['time'] = (None, parse_time)
+
+for _type in ('binary', 'varbinary', 'tinyblob', 'blob', 'mediumblob',
+              'longblob'):
+    MYSQL_TYPE_CONVERTERS[_type] = (None, _bytes_converter)
+
+del _type
 
 
 def parse_number(x, decimal=False):
@@ -284,3 +2244,34 @@ def parse_number(x, decimal=False):
             return Decimal(x)
         else:
             return float(x)
+
+
+def main(args=None):
+    """Write a statement index (see :py:func:`write_statement_index`) for
+    each dump file named on the command line. With :option:`--splits`,
+    also print the byte ranges to split each dump into, one per line
+    as ``path<tab>start<tab>end``. Run it as::
+
+        python -m mr3po.mysqldump [--splits N] DUMP [DUMP ...]
+    """
+    parser = OptionParser(usage='%prog [--splits N] DUMP [DUMP ...]')
+    parser.add_option(
+        '--splits', dest='splits', type='int', default=None,
+        help='Print byte ranges to split each dump into this many pieces')
+    options, paths = parser.parse_args(args)
+
+    if not paths:
+        parser.error('no dump files given')
+
+    if options.splits is not None and options.splits < 1:
+        parser.error('--splits must be at least 1')
+
+    for path in paths:
+        index_path = write_statement_index(path)
+        if options.splits:
+            for start, end in split_dump(path, options.splits, index_path):
+                print '%s\t%d\t%d' % (path, start, end)
+
+
+if __name__ == '__main__':
+    main()
@@ -24,12 +24,53 @@ a superset of JSON data types, and are supported across YAML implementations.
 
 We also provide :py:class:`YAMLValueProtocol` and :py:class:`SafeYAMLProtocol`
 to handle values without keys.
+
+By default, we use PyYAML's pure-Python loaders and dumpers. If PyYAML was
+built with libyaml, you can pass ``backend='auto'`` or ``backend='c'`` to
+any of the protocols to use the (much faster) libyaml bindings instead.
+Either backend can read what the other writes. Output is the same for
+nearly all data; the exceptions are mapping keys that are empty strings or
+aliases, tagged empty values (e.g. classes and functions), and (with
+*allow_unicode*) strings containing ``u'\\x85'``, which libyaml writes
+differently.
+
+Simple data (``None``, bools, numbers, ASCII strings, and lists and dicts
+of these) is read and written without calling PyYAML at all, which is
+several times faster than either backend. Pass ``fast_path=False`` if you
+need PyYAML to see everything (e.g. because you've added your own
+representers or constructors for basic types).
+
+Pass ``resolvers='json-like'`` to read unquoted values the way JSON would
+(no timestamps, sexagesimal numbers, ``yes``/``no``, etc.), or
+``resolvers='strings-only'`` to read them all as strings. Protocols set up
+this way also quote any string that a ``'json-like'`` reader would otherwise
+read as something else (e.g. ``'1e5'``, which isn't a float in YAML 1.1), so
+that they can read their own output. With the default, ``'full'``, we write
+exactly what PyYAML would.
 """
 from __future__ import absolute_import
 
+from copy import deepcopy
+from datetime import date
+from datetime import datetime
+from decimal import Decimal
+import re
+from StringIO import StringIO
+
 import yaml
+from yaml.constructor import SafeConstructor
 
-from mr3po.common import decode_string
+try:
+    from yaml import CDumper
+    from yaml import CLoader
+    from yaml import CSafeDumper
+    from yaml import CSafeLoader
+except ImportError:
+    # PyYAML was built without libyaml
+    CDumper = CLoader = CSafeDumper = CSafeLoader = None
+
+from mr3po.common import Decoder
+from mr3po.common import LRUCache
 
 
 __all__ = [
@@ -40,7 +81,173 @@ __all__ = [
 ]
 
 
-def dump_inline(data, allow_unicode=None, encoding=None, safe=False):
+# types we can return from a cache without copying (tuples only need
+# copying if they contain something mutable)
+_IMMUTABLE_TYPES = set([
+    type(None), bool, int, long, float, str, unicode, Decimal, date,
+    datetime, frozenset])
+
+# types whose encoded form we can cache, keyed on (type, value). Equal
+# values of these types always encode the same way; that's not true of
+# floats (0.0 == -0.0) or Decimals (Decimal('1.0') == Decimal('1.00')).
+_CACHEABLE_TYPES = set([type(None), bool, int, long, str, unicode])
+
+# used to tell a cache miss from a cached None
+_MISSING = object()
+
+# choices for the *backend* option
+BACKENDS = ('auto', 'c', 'pure')
+
+# choices for the *resolvers* option
+RESOLVERS = ('full', 'json-like', 'strings-only')
+
+_INT_TAG = u'tag:yaml.org,2002:int'
+_FLOAT_TAG = u'tag:yaml.org,2002:float'
+_BOOL_TAG = u'tag:yaml.org,2002:bool'
+_NULL_TAG = u'tag:yaml.org,2002:null'
+
+# implicit resolvers (tag, regexp, first characters) for each choice of
+# *resolvers* other than 'full', which uses PyYAML's. 'json-like' is
+# roughly the YAML 1.2 core schema: no timestamps, sexagesimal numbers,
+# yes/no/on/off, hex/octal, or <<. Order matters; the first match wins.
+_IMPLICIT_RESOLVERS = {
+    'json-like': [
+        (_BOOL_TAG,
+         re.compile(ur'^(?:true|True|TRUE|false|False|FALSE)$'),
+         list(u'tTfF')),
+        (_INT_TAG,
+         re.compile(ur'^[-+]?(?:0|[1-9][0-9]*)$'),
+         list(u'-+0123456789')),
+        (_FLOAT_TAG,
+         re.compile(ur'''^(?:[-+]?(?:[0-9]+\.[0-9]*|\.[0-9]+)
+                         (?:[eE][-+]?[0-9]+)?
+                     |[-+]?[0-9]+[eE][-+]?[0-9]+
+                     |[-+]?\.(?:inf|Inf|INF)
+                     |\.(?:nan|NaN|NAN))$''', re.X),
+         list(u'-+0123456789.')),
+        (_NULL_TAG,
+         re.compile(ur'^(?:~|null|Null|NULL|)$'),
+         [u'~', u'n', u'N', u'']),
+    ],
+    'strings-only': [],
+}
+
+# loader subclasses for each (loader class, resolvers) pair
+_RESOLVER_LOADERS = {}
+
+
+def yaml_classes(safe=False, backend='pure', resolvers='full'):
+    """Get the loader and dumper classes to use, as a tuple.
+
+    :param safe: if True, get the classes that only handle basic value
+                 types (e.g. :py:class:`yaml.SafeLoader`)
+    :param backend: ``'pure'`` for PyYAML's pure-Python implementation,
+                    ``'c'`` for the libyaml bindings (raise
+                    :py:class:`ImportError` if they're not available), or
+                    ``'auto'`` to use libyaml if we can.
+    :param resolvers: which types the loader recognizes in plain
+                      (unquoted, untagged) scalars. ``'full'`` for all of
+                      PyYAML's, ``'json-like'`` for just ``null``,
+                      booleans, and decimal ints and floats, or
+                      ``'strings-only'`` to load them all as strings.
+                      Other than with ``'full'``, the dumper is a subclass
+                      of PyYAML's that also quotes strings that
+                      ``'json-like'`` would read as something else (e.g.
+                      ``'1e5'``), so that the loader can read its output.
+    """
+    if backend not in BACKENDS:
+        raise ValueError('backend must be one of %s, not %r' %
+                         (', '.join(BACKENDS), backend))
+
+    if resolvers not in RESOLVERS:
+        raise ValueError('resolvers must be one of %s, not %r' %
+                         (', '.join(RESOLVERS), resolvers))
+
+    if backend == 'c' and CLoader is None:
+        raise ImportError('PyYAML was built without libyaml')
+
+    if backend != 'pure' and CLoader is not None:
+        if safe:
+            loader, dumper = CSafeLoader, CSafeDumper
+        else:
+            loader, dumper = CLoader, CDumper
+    else:
+        if safe:
+            loader, dumper = yaml.SafeLoader, yaml.SafeDumper
+        else:
+            loader, dumper = yaml.Loader, yaml.Dumper
+
+    if resolvers != 'full':
+        loader = _resolver_loader(loader, resolvers)
+        dumper = _QUOTING_DUMPERS[dumper]
+
+    return loader, dumper
+
+
+def _resolver_loader(loader, resolvers):
+    """Get a subclass of *loader* that only has the implicit resolvers
+    for *resolvers* (see :py:func:`yaml_classes`)."""
+    if (loader, resolvers) not in _RESOLVER_LOADERS:
+        implicit_resolvers = {}
+        for tag, regexp, first in _IMPLICIT_RESOLVERS[resolvers]:
+            for ch in first:
+                implicit_resolvers.setdefault(ch, []).append((tag, regexp))
+
+        name = ''.join(word.capitalize() for word in resolvers.split('-'))
+        _RESOLVER_LOADERS[(loader, resolvers)] = type(
+            name + loader.__name__, (loader,),
+            {'yaml_implicit_resolvers': implicit_resolvers})
+
+    return _RESOLVER_LOADERS[(loader, resolvers)]
+
+
+def _quoting_resolvers(dumper):
+    """Get *dumper*'s implicit resolvers, followed by the ``'json-like'``
+    ones, so that a dumper with them quotes any string either would
+    match."""
+    implicit_resolvers = dict(
+        (ch, list(tags_and_regexps)) for ch, tags_and_regexps
+        in dumper.yaml_implicit_resolvers.iteritems())
+
+    for tag, regexp, first in _IMPLICIT_RESOLVERS['json-like']:
+        for ch in first:
+            implicit_resolvers.setdefault(ch, []).append((tag, regexp))
+
+    return implicit_resolvers
+
+
+# Dumpers for resolvers other than 'full' (see yaml_classes()). These are
+# module-level classes rather than made on the fly so that the unsafe dumper
+# can write (and the loader read back) objects that refer to them.
+class _QuotingDumper(yaml.Dumper):
+    yaml_implicit_resolvers = _quoting_resolvers(yaml.Dumper)
+
+
+class _QuotingSafeDumper(yaml.SafeDumper):
+    yaml_implicit_resolvers = _quoting_resolvers(yaml.SafeDumper)
+
+
+# map from PyYAML's dumpers to the above
+_QUOTING_DUMPERS = {
+    yaml.Dumper: _QuotingDumper,
+    yaml.SafeDumper: _QuotingSafeDumper,
+}
+
+if CDumper is not None:
+    class _QuotingCDumper(CDumper):
+        yaml_implicit_resolvers = _quoting_resolvers(CDumper)
+
+    class _QuotingCSafeDumper(CSafeDumper):
+        yaml_implicit_resolvers = _quoting_resolvers(CSafeDumper)
+
+    _QUOTING_DUMPERS[CDumper] = _QuotingCDumper
+    _QUOTING_DUMPERS[CSafeDumper] = _QuotingCSafeDumper
+else:
+    _QuotingCDumper = _QuotingCSafeDumper = None
+
+
+def dump_inline(data, allow_unicode=None, encoding=None, safe=False,
+                backend='pure', fast_path=True, resolvers='full'):
     """Dump YAML on a single line.
 
     :param allow_unicode: Don't escape non-ASCII characters in the result.
@@ -48,56 +255,706 @@ def dump_inline(data, allow_unicode=None, encoding=None, safe=False):
                      return unicode
     :param safe: if True, use :py:func:`yaml.safe_dump`; that is, only encode
                  basic value types; otherwise use :py:func:`yaml.dump`
-    :param kwargs: additional keyword arguments to pass through to
-                   :py:func:`yaml.dump`. Only *allow_unicode* and
-                   *encoding* seem to be useful.
+    :param backend: which implementation to use; see
+                    :py:func:`yaml_classes`
+    :param fast_path: if True, write simple data (``None``, bools,
+                      numbers, ASCII strings, and lists and dicts of
+                      these) ourselves, without calling PyYAML. The output
+                      is the same either way; turn this off if you've added
+                      representers for these types to the dumper.
+    :param resolvers: the *resolvers* the output will be read with; see
+                      :py:func:`yaml_classes`
     """
-    dump = yaml.safe_dump if safe else yaml.dump
+    dumper = yaml_classes(safe, backend, resolvers)[1]
+
+    if fast_path:
+        out = _fast_dump(data, safe, dumper)
+        if out is not None:
+            if encoding is None:
+                return out
+            else:
+                return out.encode(encoding)
 
-    out = dump(
+    out = yaml.dump(
         data,
+        Dumper=dumper,
         allow_unicode=allow_unicode,
         default_flow_style='block',
+        encoding=None,
         explicit_end=False,
         explicit_start=False,
         line_break='\n',
-        width=float('inf')).rstrip()
+        width=_line_width(dumper)).rstrip()
 
     if out.endswith(u'\n...'):
         out = out[:-3].rstrip()
 
-    return out.encode(encoding)
+    if encoding is None:
+        return out
+    else:
+        return out.encode(encoding)
+
+
+def _line_width(dumper):
+    """The *width* to pass to *dumper* so that it never wraps lines."""
+    if dumper in (CDumper, CSafeDumper, _QuotingCDumper, _QuotingCSafeDumper):
+        # libyaml wants an int, and treats -1 as "no limit"
+        return -1
+    else:
+        return float('inf')
+
+
+class InlineDumper(object):
+    """Dump many values, each on a single line.
+
+    This produces the same output as :py:func:`dump_inline`, but keeps a
+    single dumper open, writing each value as a separate document, rather
+    than setting up a new dumper for every value.
+
+    Optional parameters:
+
+    :param allow_unicode: Don't escape non-ASCII characters in the result.
+    :param safe: if True, only encode basic value types
+    :param backend: which implementation to use; see
+                    :py:func:`yaml_classes`
+    :param fast_path: write simple data without calling PyYAML; see
+                      :py:func:`dump_inline`
+    :param resolvers: the *resolvers* the output will be read with; see
+                      :py:func:`yaml_classes`
+    """
+    # what the dumper writes around each document
+    _START = u'--- '
+    _END = u'\n...\n'
+
+    def __init__(self, allow_unicode=None, safe=False, backend='pure',
+                 fast_path=True, resolvers='full'):
+        self.allow_unicode = allow_unicode
+        self.safe = safe
+        self.backend = backend
+        self.fast_path = fast_path
+        self.resolvers = resolvers
+
+        self.dumper_class = yaml_classes(safe, backend, resolvers)[1]
+
+        self._stream = None
+        self._dumper = None
+
+    def dump(self, data, encoding=None):
+        """Dump *data* on a single line.
+
+        :param encoding: Optional character encoding to use. If not set,
+                         return unicode
+        """
+        out = None
+        if self.fast_path:
+            out = _fast_dump(data, self.safe, self.dumper_class)
+
+        if out is None:
+            out = self._dump(data)
+
+        if encoding is None:
+            return out
+        else:
+            return out.encode(encoding)
+
+    def _dump(self, data):
+        if self._dumper is None:
+            self._stream = StringIO()
+            self._dumper = self.dumper_class(
+                self._stream,
+                allow_unicode=self.allow_unicode,
+                default_flow_style='block',
+                encoding=None,
+                explicit_end=True,
+                explicit_start=True,
+                line_break='\n',
+                width=_line_width(self.dumper_class))
+            self._dumper.open()
+
+        try:
+            self._dumper.represent(data)
+            out = self._stream.getvalue()
+        except:
+            # the dumper may have been left half-way through a document
+            self._dumper = None
+            raise
+        finally:
+            self._stream.seek(0)
+            self._stream.truncate()
+
+        if out.startswith(self._START) and out.endswith(self._END):
+            return out[len(self._START):-len(self._END)].rstrip()
+        else:
+            # shouldn't happen, but dump_inline() is always correct
+            return dump_inline(data, allow_unicode=self.allow_unicode,
+                               safe=self.safe, backend=self.backend,
+                               fast_path=False)
+
+
+# The fast path: most records are made of ints, short strings, lists, and
+# flat dicts. For those, we can write and read single-line flow-style YAML
+# ourselves, rather than going through PyYAML's emitter, scanner, parser,
+# composer, and resolver. The output is exactly what PyYAML would write;
+# anything we're not sure about goes through PyYAML instead.
+
+# strings that PyYAML writes without quotes, unless they look like some
+# other type (e.g. '1' or 'true'), in which case it puts them in single
+# quotes. No escaping needed either way.
+_PLAIN_RE = re.compile(
+    r'^[A-Za-z0-9_](?:[A-Za-z0-9_ +./-]*[A-Za-z0-9_+./-])?\Z')
+
+# a plain scalar, when reading. This also allows a leading '-', as in -5.
+_PLAIN_TOKEN_RE = re.compile(
+    r'-?[A-Za-z0-9_](?:[A-Za-z0-9_ +./-]*[A-Za-z0-9_+./-])?')
+
+# a single-quoted scalar that doesn't need unescaping
+_QUOTED_TOKEN_RE = re.compile(r"'([A-Za-z0-9_ +./-]*)'")
+
+# numbers we can convert with int() and float() and get the same result
+# as PyYAML's constructors (which also handle things like 0x1F and 1_000)
+_SIMPLE_INT_RE = re.compile(r'^-?(?:0|[1-9][0-9]*)\Z')
+_SIMPLE_FLOAT_RE = re.compile(r'^-?[0-9]+\.[0-9]*(?:e[-+][0-9]+)?\Z')
+
+# PyYAML writes keys this long or longer as complex keys (``? key``)
+_MAX_SIMPLE_KEY_LENGTH = 100
+
+# prefixes for tags we might write or read in non-safe mode
+_UNICODE_TAG_PREFIX = u'!!python/unicode '
+_TUPLE_TAG_PREFIX = u'!!python/tuple '
+
+
+class _NotSimple(Exception):
+    """Raised when data isn't something the fast path can handle."""
+
+
+def _implicit_tag(value, resolver):
+    """Get the tag that *resolver* (a Loader or Dumper class) would give
+    the plain scalar *value*, or ``None`` if it's just a string."""
+    for resolvers in (resolver.yaml_implicit_resolvers.get(value[0], ()),
+                      resolver.yaml_implicit_resolvers.get(None, ())):
+        for tag, regexp in resolvers:
+            if regexp.match(value):
+                return tag
+
+    return None
+
+
+def _fast_dump(data, safe, dumper):
+    """Write *data* as PyYAML would (with *dumper*, in flow style), or
+    return ``None`` if it's not one of the simple cases we handle."""
+    try:
+        return _fast_dump_value(data, safe, dumper, set())
+    except _NotSimple:
+        return None
+
+
+def _fast_dump_value(data, safe, dumper, seen):
+    cls = data.__class__
+
+    # PyYAML would use an anchor and an alias if it saw this object twice
+    # (it doesn't bother for strs, ints, and other simple types)
+    if cls is list or cls is dict or cls is long or (cls is tuple and data):
+        if id(data) in seen:
+            raise _NotSimple
+        seen.add(id(data))
+
+    if cls is int or (cls is long and safe):
+        return unicode(data)
+    elif data is None:
+        return u'null'
+    elif cls is bool:
+        return u'true' if data else u'false'
+    elif cls is str or cls is unicode:
+        return _fast_dump_str(data, safe, dumper)
+    elif cls is float:
+        return _fast_dump_float(data, dumper)
+    elif cls is list or cls is tuple or cls is dict:
+        if cls is dict:
+            items = sorted(data.iteritems())
+            out = u'{%s}' % u', '.join([
+                u'%s: %s' % (_fast_dump_key(k, safe, dumper),
+                             _fast_dump_value(v, safe, dumper, seen))
+                for k, v in items])
+        else:
+            out = u'[%s]' % u', '.join([
+                _fast_dump_value(x, safe, dumper, seen) for x in data])
+
+        if cls is tuple and not safe:
+            return _TUPLE_TAG_PREFIX + out
+        else:
+            return out
+    else:
+        raise _NotSimple
+
+
+def _fast_dump_key(key, safe, dumper):
+    if ((key.__class__ is not str and key.__class__ is not unicode) or
+            not 0 < len(key) < _MAX_SIMPLE_KEY_LENGTH):
+        raise _NotSimple
+
+    return _fast_dump_str(key, safe, dumper)
+
+
+def _fast_dump_str(s, safe, dumper):
+    if s.__class__ is unicode and (dumper is CDumper or
+                                   dumper is _QuotingCDumper):
+        # libyaml leaves tagged strings unquoted when it can
+        raise _NotSimple
+
+    if s == '':
+        out = u"''"
+    elif _PLAIN_RE.match(s):
+        if s.__class__ is unicode and not safe:
+            out = u"'%s'" % s
+        elif _implicit_tag(s, dumper) is None:
+            out = unicode(s)
+        else:
+            out = u"'%s'" % s
+    else:
+        raise _NotSimple
+
+    # non-safe mode marks (ASCII) unicode strings
+    if s.__class__ is unicode and not safe:
+        return _UNICODE_TAG_PREFIX + out
+    else:
+        return out
+
+
+def _fast_dump_float(x, dumper):
+    # this is how PyYAML's represent_float() works
+    if x != x or x in (float('inf'), float('-inf')):
+        raise _NotSimple
+
+    out = unicode(repr(x)).lower()
+    if u'.' not in out and u'e' in out:
+        out = out.replace(u'e', u'.0e', 1)
+
+    if _implicit_tag(out, dumper) != _FLOAT_TAG:
+        raise _NotSimple
+
+    return out
+
+
+def _fast_load(text, safe, loader):
+    """Read *text* as *loader* would, or return ``_MISSING`` if it's not
+    one of the simple cases we handle."""
+    try:
+        value, pos = _fast_load_value(text, 0, safe, loader)
+    except _NotSimple:
+        return _MISSING
+
+    if pos != len(text):
+        return _MISSING
+
+    return value
+
+
+def _fast_load_value(text, pos, safe, loader):
+    """Read a value from *text*, starting at *pos*. Return the value, and
+    the position after it."""
+    c = text[pos:pos + 1]
+
+    if c == u'[':
+        return _fast_load_list(text, pos + 1, safe, loader)
+    elif c == u'{':
+        return _fast_load_dict(text, pos + 1, safe, loader)
+    elif c == u'!' and not safe:
+        if text.startswith(_UNICODE_TAG_PREFIX, pos):
+            m = _QUOTED_TOKEN_RE.match(text, pos + len(_UNICODE_TAG_PREFIX))
+            if m:
+                return m.group(1), m.end()
+        elif text.startswith(_TUPLE_TAG_PREFIX + u'[', pos):
+            value, pos = _fast_load_list(
+                text, pos + len(_TUPLE_TAG_PREFIX) + 1, safe, loader)
+            return tuple(value), pos
+
+        raise _NotSimple
+    else:
+        return _fast_load_scalar(text, pos, loader)
+
+
+def _fast_load_scalar(text, pos, loader):
+    m = _QUOTED_TOKEN_RE.match(text, pos)
+    if m:
+        # quoted scalars are always strings. Like PyYAML, return ASCII
+        # strings as bytes
+        return m.group(1).encode('ascii'), m.end()
+
+    m = _PLAIN_TOKEN_RE.match(text, pos)
+    if not m:
+        raise _NotSimple
+
+    value = m.group(0)
+    tag = _implicit_tag(value, loader)
+
+    if tag is None:
+        value = value.encode('ascii')
+    elif tag == _INT_TAG and _SIMPLE_INT_RE.match(value):
+        value = int(value)
+    elif tag == _FLOAT_TAG and _SIMPLE_FLOAT_RE.match(value):
+        value = float(value)
+    elif tag == _BOOL_TAG:
+        value = SafeConstructor.bool_values[value.lower()]
+    elif tag == _NULL_TAG:
+        value = None
+    else:
+        raise _NotSimple
+
+    return value, m.end()
+
+
+def _fast_load_list(text, pos, safe, loader):
+    """Read a list, starting just after its ``[``."""
+    items = []
+
+    if text.startswith(u']', pos):
+        return items, pos + 1
+
+    while True:
+        value, pos = _fast_load_value(text, pos, safe, loader)
+        items.append(value)
+
+        if text.startswith(u', ', pos):
+            pos += 2
+        elif text.startswith(u']', pos):
+            return items, pos + 1
+        else:
+            raise _NotSimple
+
+
+def _fast_load_dict(text, pos, safe, loader):
+    """Read a dict, starting just after its ``{``."""
+    d = {}
+
+    if text.startswith(u'}', pos):
+        return d, pos + 1
+
+    while True:
+        if text.startswith(u'!', pos):
+            # tagged keys (e.g. unicode in non-safe mode)
+            key, pos = _fast_load_value(text, pos, safe, loader)
+            if key.__class__ is not unicode:
+                raise _NotSimple
+        else:
+            key, pos = _fast_load_scalar(text, pos, loader)
+
+        if not text.startswith(u': ', pos):
+            raise _NotSimple
+
+        d[key], pos = _fast_load_value(text, pos + 2, safe, loader)
+
+        if text.startswith(u', ', pos):
+            pos += 2
+        elif text.startswith(u'}', pos):
+            return d, pos + 1
+        else:
+            raise _NotSimple
+
+
+def _copy_value(value):
+    """Copy a decoded value, so that the copy in a cache can't be
+    modified."""
+    cls = value.__class__
+
+    if cls in _IMMUTABLE_TYPES:
+        return value
+    elif cls is list:
+        return [_copy_value(x) for x in value]
+    elif cls is dict:
+        # keys are hashable, so we can use them as-is
+        return dict((k, _copy_value(v)) for k, v in value.iteritems())
+    elif cls is set:
+        return set(value)
+    else:
+        return deepcopy(value)
+
+
+def _cache_key(data):
+    """Get the key to cache the encoded form of *data* under, or ``None``
+    if we shouldn't cache it."""
+    cls = data.__class__
+
+    if cls in _CACHEABLE_TYPES:
+        return cls, data
+    elif cls is tuple:
+        for x in data:
+            if x.__class__ not in _CACHEABLE_TYPES:
+                return None
+        return cls, tuple([(x.__class__, x) for x in data])
+    else:
+        return None
+
+
+class LazyValue(object):
+    """A value read by a protocol with ``lazy_values=True``. We don't
+    decode *raw* until something uses the value.
+
+    This passes through attribute access, indexing, iteration,
+    comparison, and so on, so a :py:class:`LazyValue` for a dict can
+    mostly be used as a dict. Use :py:attr:`value` to get the real
+    object (e.g. for :py:func:`isinstance`, or to put it inside another
+    value you're going to write).
+    """
+    def __init__(self, raw, protocol):
+        #: the value's encoded form, as read from the input
+        self.raw = raw
+        #: the protocol that read it (and will decode it)
+        self.protocol = protocol
+        self._value = _MISSING
+
+    @property
+    def loaded(self):
+        """True if we've decoded the value."""
+        return self._value is not _MISSING
+
+    @property
+    def value(self):
+        """The decoded value. Raises :py:class:`yaml.YAMLError` if *raw*
+        isn't valid YAML."""
+        if self._value is _MISSING:
+            self._value = self.protocol._load_cached(
+                self.raw, self.protocol.value_cache)
+
+        return self._value
+
+    def __getattr__(self, name):
+        # don't decode for copy, pickle, etc.
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        return getattr(self.value, name)
+
+    def __getitem__(self, key):
+        return self.value[key]
+
+    def __setitem__(self, key, value):
+        self.value[key] = value
+
+    def __delitem__(self, key):
+        del self.value[key]
+
+    def __contains__(self, item):
+        return item in self.value
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __nonzero__(self):
+        return bool(self.value)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyValue):
+            other = other.value
+        return self.value == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __deepcopy__(self, memo):
+        value_copy = self.__class__(self.raw, self.protocol)
+        if self.loaded:
+            value_copy._value = deepcopy(self._value, memo)
+        return value_copy
+
+    def __repr__(self):
+        if self.loaded:
+            return '%s(%r)' % (self.__class__.__name__, self._value)
+        else:
+            return '%s(raw=%r)' % (self.__class__.__name__, self.raw)
 
 
 class YAMLProtocolBase(object):
 
     safe = True
 
-    def __init__(self, allow_unicode=False, encoding=None):
+    def __init__(self, allow_unicode=False, encoding=None,
+                 sticky_encoding=False, backend='pure', key_cache_size=1,
+                 value_cache_size=0, encoded_key_cache_size=1,
+                 fast_path=True, lazy_values=False, resolvers='full'):
         """Optional parameters:
 
         :param allow_unicode: Allow non-ASCII characters in the output
                               (e.g. accented characters).
         :param encoding: Character encoding to use. We default to UTF-8,
                          with fallback to latin-1 when decoding input.
+        :param sticky_encoding: if *encoding* isn't set, then once we find
+                                input that isn't UTF-8, assume all the
+                                input is latin-1 from then on.
+        :param backend: ``'pure'`` to use PyYAML's pure-Python loaders and
+                        dumpers, ``'c'`` to use libyaml, or ``'auto'`` to
+                        use libyaml if PyYAML was built with it.
+        :param key_cache_size: remember this many decoded keys (1 is
+                               plenty for sorted reducer input; mappers
+                               may need more)
+        :param value_cache_size: remember this many decoded values. Only
+                                 useful if values repeat a lot (e.g.
+                                 enums or small dicts).
+        :param encoded_key_cache_size: when writing, remember how we
+                                       encoded this many keys. Only
+                                       ``None``, :py:class:`bool`,
+                                       integers, strings, and tuples of
+                                       these are cached.
+        :param fast_path: read and write simple data (see
+                          :py:func:`dump_inline`) without calling PyYAML.
+                          Turn this off if you've added constructors or
+                          representers for basic types to PyYAML.
+        :param lazy_values: :py:meth:`read` returns a
+                            :py:class:`LazyValue` for each value, which
+                            is only decoded when used. If you
+                            :py:meth:`write` a :py:class:`LazyValue` that
+                            hasn't been decoded, we write its original
+                            form, as long as it was read by a protocol
+                            with the same *allow_unicode*, *encoding*,
+                            *resolvers*, and safety. This is handy for jobs
+                            that filter on the key and pass most values
+                            through unchanged. Bad values aren't detected until
+                            they're used (or ever, if they're passed
+                            through).
+        :param resolvers: ``'full'``, ``'json-like'``, or
+                          ``'strings-only'``; which types to recognize in
+                          unquoted values when reading. Other than
+                          ``'full'``, we also quote strings that
+                          ``'json-like'`` would read as something else
+                          when writing. See :py:func:`yaml_classes`.
+
+        ``self.key_cache`` and ``self.value_cache`` are
+        :py:class:`~mr3po.common.LRUCache`\ s, keyed on the raw
+        (undecoded) string. Their ``hits`` and ``misses`` attributes can
+        help you size them. ``self.encoded_key_cache`` does the same
+        for :py:meth:`write`. Cached values are copied before we return
+        them (unless they're immutable), so it's safe to modify them.
+
+        Input is decoded with ``self.decoder``, a
+        :py:class:`~mr3po.common.Decoder`. Its ``fallbacks`` attribute
+        tells you how much of the input wasn't UTF-8.
         """
         self.allow_unicode = allow_unicode
         self.encoding = encoding
+        self.sticky_encoding = sticky_encoding
+        self.backend = backend
+        self.key_cache_size = key_cache_size
+        self.value_cache_size = value_cache_size
+        self.encoded_key_cache_size = encoded_key_cache_size
+        self.fast_path = fast_path
+        self.lazy_values = lazy_values
+        self.resolvers = resolvers
+
+        self.decoder = Decoder(encoding, sticky=sticky_encoding)
+        self._loader = yaml_classes(self.safe, backend, resolvers)[0]
+        self._dumper = InlineDumper(allow_unicode=allow_unicode,
+                                    safe=self.safe, backend=backend,
+                                    fast_path=fast_path,
+                                    resolvers=resolvers)
+
+        self.key_cache = LRUCache(key_cache_size)
+        self.value_cache = LRUCache(value_cache_size)
+        self.encoded_key_cache = LRUCache(encoded_key_cache_size)
 
     def load(self, data):
-        unicode_data = decode_string(data, encoding=self.encoding)
+        text = self.decoder.decode(data)
+
+        if self.fast_path:
+            value = _fast_load(text, self.safe, self._loader)
+            if value is not _MISSING:
+                return value
+
+        return yaml.load(text, Loader=self._loader)
+
+    def load_many(self, data_list):
+        """Decode a batch of YAML strings (e.g. the values from many
+        lines), and return a list of values. Strings that appear more than
+        once in the batch are only decoded once."""
+        loaded = {}
+        values = []
+
+        for data in data_list:
+            value = loaded.get(data, _MISSING)
+            if value is _MISSING:
+                value = loaded[data] = self.load(data)
+            else:
+                value = _copy_value(value)
 
-        if self.safe:
-            return yaml.safe_load(unicode_data)
+            values.append(value)
+
+        return values
+
+    def _load_cached(self, data, cache):
+        """Like :py:meth:`load`, but look in *cache* first."""
+        if not cache.max_size:
+            return self.load(data)
+
+        value = cache.get(data, _MISSING)
+        if value is _MISSING:
+            value = self.load(data)
+            cache[data] = value
+
+        if value.__class__ in _IMMUTABLE_TYPES:
+            return value
         else:
-            return yaml.load(unicode_data)
+            return _copy_value(value)
 
     def dump(self, data):
-        return dump_inline(
-            data,
-            allow_unicode=self.allow_unicode,
-            encoding=self.encoding or 'utf_8',  # never return Unicode
-            safe=self.safe)
+        # never return Unicode
+        return self._dumper.dump(data, encoding=self.encoding or 'utf_8')
+
+    def _load_value(self, data):
+        """Load a value, lazily if *lazy_values* is set."""
+        if self.lazy_values:
+            return LazyValue(data, self)
+        else:
+            return self._load_cached(data, self.value_cache)
+
+    def _dump_value(self, value):
+        """Dump a value, passing through :py:class:`LazyValue`\ s that
+        haven't been decoded where we can."""
+        if value.__class__ is LazyValue:
+            if not value.loaded and self._can_pass_through(value):
+                return value.raw
+
+            value = value.value
+
+        return self.dump(value)
+
+    def _can_pass_through(self, lazy_value):
+        """Could we write *lazy_value*'s raw form as-is?"""
+        other = lazy_value.protocol
+
+        if other is not self and (other.safe != self.safe or
+                                  other.allow_unicode != self.allow_unicode or
+                                  other.encoding != self.encoding or
+                                  other.resolvers != self.resolvers):
+            return False
+
+        if self.encoding is None:
+            # without an encoding, input may be latin-1; output never is
+            try:
+                lazy_value.raw.decode('utf_8')
+            except UnicodeDecodeError:
+                return False
+
+        return True
+
+    def _dump_cached(self, data, cache):
+        """Like :py:meth:`dump`, but look in *cache* first."""
+        if not cache.max_size:
+            return self.dump(data)
+
+        cache_key = _cache_key(data)
+        if cache_key is None:
+            return self.dump(data)
+
+        out = cache.get(cache_key)
+        if out is None:
+            out = self.dump(data)
+            cache[cache_key] = out
+
+        return out
 
 
 class SafeYAMLProtocol(YAMLProtocolBase):
@@ -111,16 +968,12 @@ class SafeYAMLProtocol(YAMLProtocolBase):
     def read(self, line):
         key_str, value_str = line.split('\t')
 
-        # cache last key
-        if key_str != getattr(self, '_key_cache', [None])[0]:
-            self._key_cache = (key_str, self.load(key_str))
-
-        key = self._key_cache[1]
-
-        return key, self.load(value_str)
+        return (self._load_cached(key_str, self.key_cache),
+                self._load_value(value_str))
 
     def write(self, key, value):
-        return '%s\t%s' % (self.dump(key), self.dump(value))
+        return '%s\t%s' % (self._dump_cached(key, self.encoded_key_cache),
+                            self._dump_value(value))
 
 
 class YAMLProtocol(SafeYAMLProtocol):
@@ -138,10 +991,10 @@ class SafeYAMLValueProtocol(YAMLProtocolBase):
     Note that this will encode tuples as lists.
     """
     def read(self, line):
-        return None, self.load(line)
+        return None, self._load_value(line)
 
     def write(self, _, value):
-        return self.dump(value)
+        return self._dump_value(value)
 
 
 class YAMLValueProtocol(SafeYAMLValueProtocol):
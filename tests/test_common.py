@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# Copyright 2012 Yelp
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+try:
+    import unittest2 as unittest
+    unittest  # quiet "redefinition of unused ..." warning from pyflakes
+except ImportError:
+    import unittest
+
+from mr3po.common import Decoder
+from mr3po.common import LRUCache
+from mr3po.common import decode_string
+from mr3po.common import unicode_codec_name
+
+
+class DecodeStringTestCase(unittest.TestCase):
+
+    def test_unicode(self):
+        self.assertEqual(decode_string(u'Erdős'), u'Erdős')
+
+    def test_utf_8(self):
+        self.assertEqual(decode_string('Erdős'), u'Erdős')
+
+    def test_latin_1_fallback(self):
+        self.assertEqual(decode_string('Erd\xf6s'), u'Erdös')
+
+    def test_encoding(self):
+        self.assertEqual(decode_string('Erdős', 'latin_1'),
+                         'Erdős'.decode('latin_1'))
+        self.assertRaises(UnicodeDecodeError,
+                          decode_string, 'Erd\xf6s', 'utf_8')
+
+
+class DecoderTestCase(unittest.TestCase):
+
+    def test_utf_8(self):
+        decoder = Decoder()
+        self.assertEqual(decoder.decode('Erdős'), u'Erdős')
+        self.assertEqual(decoder.decode(u'Erdős'), u'Erdős')
+        self.assertEqual(decoder.fallbacks, 0)
+
+    def test_count_fallbacks(self):
+        decoder = Decoder()
+        self.assertEqual(decoder.decode('Erd\xf6s'), u'Erdös')
+        self.assertEqual(decoder.decode('Erdős'), u'Erdős')
+        self.assertEqual(decoder.decode('Erd\xf6s'), u'Erdös')
+        self.assertEqual(decoder.fallbacks, 2)
+        self.assertEqual(decoder.encoding, None)
+
+    def test_sticky(self):
+        decoder = Decoder(sticky=True)
+        self.assertEqual(decoder.decode('Erdős'), u'Erdős')
+        self.assertEqual(decoder.encoding, None)
+
+        self.assertEqual(decoder.decode('Erd\xf6s'), u'Erdös')
+        self.assertEqual(decoder.encoding, 'latin_1')
+        self.assertEqual(decoder.codec, 'latin-1')
+
+        # from now on, everything is latin-1, even if it's valid UTF-8
+        self.assertEqual(decoder.decode('Erdős'), 'Erdős'.decode('latin_1'))
+        self.assertEqual(decoder.fallbacks, 1)
+
+    def test_encoding(self):
+        decoder = Decoder('utf_16')
+        self.assertEqual(decoder.decode(u'Erdős'.encode('utf_16')), u'Erdős')
+
+    def test_no_fallback_with_encoding(self):
+        decoder = Decoder('utf_8', sticky=True)
+        self.assertRaises(UnicodeDecodeError, decoder.decode, 'Erd\xf6s')
+        self.assertEqual(decoder.fallbacks, 0)
+        self.assertEqual(decoder.encoding, 'utf_8')
+
+    def test_fallback(self):
+        # fallback() is for when you call unicode() yourself
+        decoder = Decoder()
+        s = 'Erd\xf6s'
+        try:
+            u = unicode(s, decoder.codec)
+        except UnicodeDecodeError:
+            u = decoder.fallback(s)
+
+        self.assertEqual(u, u'Erdös')
+        self.assertEqual(decoder.fallbacks, 1)
+
+    def test_repr(self):
+        self.assertEqual(repr(Decoder('latin_1', sticky=True)),
+                         "Decoder('latin_1', sticky=True)")
+
+
+class UnicodeCodecNameTestCase(unittest.TestCase):
+
+    def test_shortcuts(self):
+        self.assertEqual(unicode_codec_name('utf_8'), 'utf-8')
+        self.assertEqual(unicode_codec_name('UTF8'), 'utf-8')
+        self.assertEqual(unicode_codec_name('latin_1'), 'latin-1')
+        self.assertEqual(unicode_codec_name('iso-8859-1'), 'latin-1')
+        self.assertEqual(unicode_codec_name('ascii'), 'ascii')
+
+    def test_other_encodings(self):
+        self.assertEqual(unicode_codec_name('utf_16'), 'utf_16')
+        self.assertEqual(unicode_codec_name('no-such-encoding'),
+                         'no-such-encoding')
+
+
+class LRUCacheTestCase(unittest.TestCase):
+
+    def test_get_and_set(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('b', 0), 0)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(len(cache), 1)
+
+    def test_forget_least_recently_used(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache.get('a')
+        cache['c'] = 3
+
+        self.assertEqual(cache.keys(), ['a', 'c'])
+        self.assertEqual(cache.get('b'), None)
+
+    def test_replace(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache['a'] = 3
+
+        self.assertEqual(cache.keys(), ['b', 'a'])
+        self.assertEqual(cache.get('a'), 3)
+
+    def test_stats(self):
+        cache = LRUCache(1)
+        cache.get('a')
+        cache['a'] = 1
+        cache.get('a')
+        cache.get('a')
+
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        self.assertEqual(repr(cache),
+                         'LRUCache(1) <1 items, 2 hits, 1 misses>')
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.hits, 2)
+
+    def test_size_zero(self):
+        cache = LRUCache(0)
+        cache['a'] = 1
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.get('a'), None)
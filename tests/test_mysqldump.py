@@ -13,7 +13,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from array import array
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
 from decimal import Decimal
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
 
 try:
     import unittest2 as unittest
@@ -21,13 +29,44 @@ try:
 except ImportError:
     import unittest
 
+from mock import patch
+
 from mr3po.mysqldump import MySQLExtendedCompleteInsertProtocol
 from mr3po.mysqldump import MySQLCompleteInsertProtocol
 from mr3po.mysqldump import MySQLExtendedInsertProtocol
 from mr3po.mysqldump import MySQLInsertProtocol
+from mr3po.mysqldump import BatchedInsertWriter
+from mr3po.mysqldump import Column
+from mr3po.mysqldump import InsertEncoder
+from mr3po.mysqldump import LazyRow
+from mr3po.mysqldump import MIN_LINES_FOR_ERROR_RATE
+from mr3po.mysqldump import Record
+from mr3po.mysqldump import SchemaRegistry
+from mr3po.mysqldump import dump_as_insert
+from mr3po.mysqldump import escape_unicode_string
+from mr3po.mysqldump import format_value
+from mr3po.mysqldump import insert_encoder
+from mr3po.mysqldump import is_ascii_compatible
+from mr3po.mysqldump import iter_dump
+from mr3po.mysqldump import iter_insert_rows
+from mr3po.mysqldump import iter_statements
+from mr3po.mysqldump import parse_insert
+from mr3po.mysqldump import parse_insert_table
+from mr3po.mysqldump import parse_time
+from mr3po.mysqldump import read_statement_index
+from mr3po.mysqldump import record_class
+from mr3po.mysqldump import split_dump
+from mr3po.mysqldump import unescape_string
+from mr3po.mysqldump import write_insert
+from mr3po.mysqldump import write_statement_index
 
 from tests.roundtrip import RoundTripTestCase
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class GoodInputTestCase(unittest.TestCase):
 
@@ -81,6 +120,16 @@ class GoodInputTestCase(unittest.TestCase):
                                       u'data': None,
                                       u'misc': None}]))
 
+    def test_tokens(self):
+        p = MySQLInsertProtocol()
+        key, value = p.read(
+            "INSERT INTO `misc` VALUES"
+            " ('it''s','a\\'b\\\\','',0xc0de,-1.5e3,2E2,+7,NULL);")
+        self.assertEqual(
+            (key, value),
+            (u'misc', [u"it's", u"a'b\\", u'', '\xc0\xde',
+                       -1500.0, 200.0, 7, None]))
+
 
 class BadInputTestCase(unittest.TestCase):
 
@@ -108,6 +157,12 @@ class BadInputTestCase(unittest.TestCase):
             "INSERT INTO `user` (`id`) VALUES"
             " (1,'David Marin',25.25,0xC0DE,NULL);")
 
+    def test_identifier_in_values(self):
+        p = MySQLExtendedInsertProtocol()
+        self.assertRaises(
+            ValueError,
+            p.read, "INSERT INTO `user` VALUES (1,`name`);")
+
     def test_differing_row_sizes(self):
         p = MySQLExtendedInsertProtocol()
         self.assertRaises(
@@ -117,6 +172,918 @@ class BadInputTestCase(unittest.TestCase):
             " (1,'David Marin',25.25,0xC0DE,NULL), (2);")
 
 
+class NonStrictTestCase(unittest.TestCase):
+
+    GOOD_LINE = "INSERT INTO `user` VALUES (1,'David Marin');"
+    BAD_LINE = "INSERT INTO `user` VALUES (1,'David Marin'"
+    NON_UTF_8_LINE = "INSERT INTO `user` VALUES (1,'Erd\xf6s');"
+
+    def test_strict_by_default(self):
+        p = MySQLExtendedInsertProtocol()
+        self.assertRaises(ValueError, p.read, self.BAD_LINE)
+
+    def test_bad_lines_return_none(self):
+        p = MySQLExtendedInsertProtocol(strict=False)
+        self.assertEqual(p.read(self.BAD_LINE), (None, None))
+        self.assertEqual(p.read('USE test;'), (None, None))
+        self.assertEqual(p.read(self.GOOD_LINE),
+                         (u'user', [[1, u'David Marin']]))
+
+        self.assertEqual(p.errors, {'ValueError': 2})
+        self.assertEqual(p.lines_read, 3)
+
+    def test_count_errors_by_class(self):
+        p = MySQLExtendedInsertProtocol(encoding='utf_8', strict=False)
+        p.read(self.BAD_LINE)
+        p.read(self.NON_UTF_8_LINE)
+        p.read(self.NON_UTF_8_LINE)
+
+        self.assertEqual(p.errors,
+                         {'ValueError': 1, 'UnicodeDecodeError': 2})
+
+    def test_odd_length_hex(self):
+        line = "INSERT INTO `user` VALUES (1,0xABC);"
+
+        self.assertRaises(ValueError, MySQLExtendedInsertProtocol().read,
+                          line)
+
+        p = MySQLExtendedInsertProtocol(strict=False)
+        self.assertEqual(p.read(line), (None, None))
+        self.assertEqual(p.errors, {'ValueError': 1})
+
+    def test_write_bad_lines(self):
+        bad_lines = StringIO()
+        p = MySQLExtendedInsertProtocol(strict=False, bad_lines=bad_lines)
+        p.read(self.BAD_LINE)
+        p.read(self.GOOD_LINE)
+        p.read('USE test;')
+
+        self.assertEqual(bad_lines.getvalue(),
+                         self.BAD_LINE + '\nUSE test;\n')
+
+    def test_max_error_rate(self):
+        p = MySQLExtendedInsertProtocol(strict=False, max_error_rate=0.1)
+
+        # don't give up just because the first few lines are bad
+        for _ in xrange(MIN_LINES_FOR_ERROR_RATE - 1):
+            self.assertEqual(p.read(self.BAD_LINE), (None, None))
+
+        # now we've read enough lines to know that too many are bad
+        self.assertRaises(ValueError, p.read, self.BAD_LINE)
+
+    def test_below_max_error_rate(self):
+        p = MySQLExtendedInsertProtocol(strict=False, max_error_rate=0.1)
+        for i in xrange(MIN_LINES_FOR_ERROR_RATE * 2):
+            if i % 20 == 0:
+                self.assertEqual(p.read(self.BAD_LINE), (None, None))
+            else:
+                p.read(self.GOOD_LINE)
+
+        self.assertEqual(p.errors, {'ValueError': 100})
+
+    def test_repr(self):
+        p = MySQLExtendedInsertProtocol(strict=False, max_error_rate=0.01)
+        self.assertEqual(
+            repr(p), 'MySQLExtendedInsertProtocol(decimal=False, '
+            'encoding=None, output_tab=False, strict=False,'
+            ' max_error_rate=0.01)')
+
+
+class StreamingTestCase(unittest.TestCase):
+
+    def test_iter_insert_rows(self):
+        rows = iter_insert_rows(
+            "INSERT INTO `user` (`id`, `name`) VALUES"
+            " (1,'David Marin'), (2,'Nully Nullington');",
+            complete=True)
+
+        self.assertEqual(
+            rows.next(), (u'user', {u'id': 1, u'name': u'David Marin'}))
+        self.assertEqual(
+            rows.next(), (u'user', {u'id': 2, u'name': u'Nully Nullington'}))
+        self.assertRaises(StopIteration, rows.next)
+
+    def test_rows_yielded_before_bad_values(self):
+        rows = iter_insert_rows(
+            "INSERT INTO `user` VALUES (1,'David Marin'), (2);")
+
+        self.assertEqual(rows.next(), (u'user', [1, u'David Marin']))
+        self.assertRaises(ValueError, rows.next)
+
+    def test_stream_protocol(self):
+        p = MySQLExtendedInsertProtocol(stream=True)
+        key, value = p.read(
+            "INSERT INTO `user` VALUES"
+            " (1,'David Marin',25.25,0xC0DE,NULL),"
+            " (2,'Nully Nullington',NULL,NULL,NULL);")
+
+        self.assertEqual(key, u'user')
+        self.assertNotIsInstance(value, list)
+        self.assertEqual(
+            list(value),
+            [[1, u'David Marin', 25.25, '\xc0\xde', None],
+             [2, u'Nully Nullington', None, None, None]])
+
+    def test_stream_protocol_bad_header(self):
+        p = MySQLExtendedCompleteInsertProtocol(stream=True)
+        # missing column names are caught right away
+        self.assertRaises(
+            ValueError, p.read, "INSERT INTO `user` VALUES (1);")
+
+    def test_stream_single_row(self):
+        # stream has no effect on single-row protocols
+        p = MySQLInsertProtocol(stream=True)
+        self.assertEqual(
+            p.read("INSERT INTO `user` VALUES (1,'David Marin');"),
+            (u'user', [1, u'David Marin']))
+
+    def test_repr(self):
+        self.assertEqual(
+            repr(MySQLExtendedInsertProtocol(stream=True)),
+            'MySQLExtendedInsertProtocol(decimal=False, encoding=None,'
+            ' output_tab=False, stream=True)')
+
+
+class CompactTestCase(unittest.TestCase):
+
+    def test_compact_records(self):
+        p = MySQLExtendedCompleteInsertProtocol(compact=True)
+        key, value = p.read(
+            "INSERT INTO `user` (`id`, `name`) VALUES"
+            " (1,'David Marin'), (2,NULL);")
+
+        self.assertEqual(key, u'user')
+        self.assertEqual(len(value), 2)
+        for row in value:
+            self.assertIsInstance(row, Record)
+
+        self.assertEqual(value[0], {u'id': 1, u'name': u'David Marin'})
+        self.assertEqual(value[1], {u'id': 2, u'name': None})
+
+        self.assertEqual(value[0][u'name'], u'David Marin')
+        self.assertEqual(value[0].get(u'score', 0), 0)
+        self.assertIn(u'id', value[0])
+        self.assertEqual(sorted(value[0]), [u'id', u'name'])
+        self.assertEqual(dict(value[1]), {u'id': 2, u'name': None})
+        self.assertRaises(KeyError, lambda: value[0][u'score'])
+
+        # both rows share a class, which knows the column names
+        self.assertIs(type(value[0]), type(value[1]))
+        self.assertIs(type(value[0]), record_class([u'id', u'name']))
+
+    def test_no_per_row_dict(self):
+        row = record_class(['id'])([1])
+        self.assertFalse(hasattr(row, '__dict__'))
+
+    def test_compact_ignored_without_column_names(self):
+        p = MySQLInsertProtocol(compact=True)
+        self.assertEqual(
+            p.read("INSERT INTO `user` VALUES (1,'David Marin');"),
+            (u'user', [1, u'David Marin']))
+
+
+class ColumnsTestCase(unittest.TestCase):
+
+    def test_complete_insert(self):
+        p = MySQLCompleteInsertProtocol(columns=['name', 'id'])
+        self.assertEqual(
+            p.read("INSERT INTO `user` (`id`, `name`, `score`, `data`) VALUES"
+                   " (1,'David Marin',25.25,0xC0DE);"),
+            (u'user', {u'id': 1, u'name': u'David Marin'}))
+
+    def test_compact(self):
+        p = MySQLExtendedCompleteInsertProtocol(columns=['data'],
+                                                compact=True)
+        key, value = p.read(
+            "INSERT INTO `user` (`id`, `name`, `score`, `data`) VALUES"
+            " (1,'David Marin',25.25,0xC0DE), (2,NULL,NULL,NULL);")
+        self.assertEqual(value, [{u'data': '\xc0\xde'}, {u'data': None}])
+        self.assertEqual(value[0].keys(), [u'data'])
+
+    def test_positions(self):
+        p = MySQLExtendedInsertProtocol(columns=[3, 0])
+        self.assertEqual(
+            p.read("INSERT INTO `user` VALUES"
+                   " (1,'David Marin',25.25,0xC0DE),"
+                   " (2,'Nully Nullington',NULL,NULL);"),
+            (u'user', [['\xc0\xde', 1], [None, 2]]))
+
+    def test_names_without_column_names(self):
+        p = MySQLInsertProtocol(columns=['id'])
+        self.assertRaises(
+            ValueError, p.read, "INSERT INTO `user` VALUES (1,'David Marin');")
+
+    def test_unknown_name(self):
+        p = MySQLCompleteInsertProtocol(columns=['id', 'email'])
+        self.assertRaises(
+            ValueError, p.read,
+            "INSERT INTO `user` (`id`, `name`) VALUES (1,'David Marin');")
+
+    def test_position_out_of_range(self):
+        p = MySQLInsertProtocol(columns=[2])
+        self.assertRaises(
+            ValueError, p.read, "INSERT INTO `user` VALUES (1,'David Marin');")
+
+    def test_skipped_values_are_not_decoded(self):
+        # odd-length hex can't be decoded, but we never try
+        self.assertRaises(
+            ValueError, MySQLInsertProtocol().read,
+            "INSERT INTO `user` VALUES (1,0xABC);")
+
+        p = MySQLInsertProtocol(columns=[0])
+        self.assertEqual(
+            p.read("INSERT INTO `user` VALUES (1,0xABC);"), (u'user', [1]))
+
+    def test_bad_rows_still_caught(self):
+        p = MySQLExtendedInsertProtocol(columns=[0])
+        self.assertRaises(
+            ValueError, p.read,
+            "INSERT INTO `user` VALUES (1,'David Marin'), (2);")
+
+
+class TablesTestCase(unittest.TestCase):
+
+    USER_INSERT = "INSERT INTO `user` VALUES (1,'David Marin');"
+    SCORE_INSERT = "INSERT INTO `score` VALUES (1,25.25);"
+    # we should never look at the values of this line
+    BAD_SCORE_INSERT = "INSERT INTO `score` VALUES (1,25.25"
+
+    def test_parse_insert_table(self):
+        self.assertEqual(parse_insert_table(self.USER_INSERT), u'user')
+        self.assertEqual(parse_insert_table(self.BAD_SCORE_INSERT), u'score')
+        self.assertEqual(parse_insert_table('USE test;'), None)
+        self.assertEqual(
+            parse_insert_table(u'INSERT INTO `Qu\xe9bec` VALUES (1);'
+                               .encode('utf16'),
+                               encoding='utf16'),
+            u'Qu\xe9bec')
+
+    def test_tables(self):
+        p = MySQLInsertProtocol(tables=['user'])
+
+        self.assertEqual(p.read(self.USER_INSERT),
+                         (u'user', [1, u'David Marin']))
+        self.assertEqual(p.read(self.BAD_SCORE_INSERT), (u'score', None))
+        self.assertEqual(p.read(self.SCORE_INSERT), (u'score', None))
+
+        self.assertEqual(p.skipped, {u'score': 2})
+
+    def test_exclude_tables(self):
+        p = MySQLInsertProtocol(exclude_tables=['score'])
+
+        self.assertEqual(p.read(self.USER_INSERT),
+                         (u'user', [1, u'David Marin']))
+        self.assertEqual(p.read(self.BAD_SCORE_INSERT), (u'score', None))
+
+        self.assertEqual(p.skipped, {u'score': 1})
+
+    def test_non_insert(self):
+        p = MySQLInsertProtocol(tables=['user'])
+        self.assertRaises(ValueError, p.read, 'USE test;')
+
+    def test_multi_byte_encoding(self):
+        p = MySQLInsertProtocol(tables=['user'], encoding='utf16')
+
+        self.assertEqual(p.read(self.SCORE_INSERT.decode('ascii')
+                                .encode('utf16')),
+                         (u'score', None))
+        self.assertEqual(p.read(self.USER_INSERT.decode('ascii')
+                                .encode('utf16')),
+                         (u'user', [1, u'David Marin']))
+
+
+class LazyTestCase(unittest.TestCase):
+
+    def test_lazy_row(self):
+        p = MySQLInsertProtocol(lazy=True, decimal=True)
+        key, value = p.read(
+            "INSERT INTO `user` VALUES"
+            " (1,'David\\tMarin',25.25,0xC0DE,NULL);")
+
+        self.assertEqual(key, u'user')
+        self.assertIsInstance(value, LazyRow)
+        self.assertEqual(len(value), 5)
+        self.assertEqual(value[1], u'David\tMarin')
+        self.assertEqual(value[2], Decimal('25.25'))
+        self.assertEqual(value[-2:], ['\xc0\xde', None])
+        self.assertEqual(
+            value, [1, u'David\tMarin', Decimal('25.25'), '\xc0\xde', None])
+
+    def test_decode_only_on_access(self):
+        p = MySQLInsertProtocol(lazy=True)
+        # odd-length hex can't be decoded
+        key, value = p.read("INSERT INTO `user` VALUES (1,0xABC);")
+
+        self.assertEqual(value[0], 1)
+        self.assertRaises(ValueError, lambda: value[1])
+
+    def test_memoized(self):
+        p = MySQLInsertProtocol(lazy=True)
+        key, value = p.read("INSERT INTO `user` VALUES (1,'David Marin');")
+
+        self.assertIs(value[1], value[1])
+
+    def test_lazy_complete(self):
+        p = MySQLExtendedCompleteInsertProtocol(lazy=True)
+        key, value = p.read(
+            "INSERT INTO `user` (`id`, `name`) VALUES"
+            " (1,'David Marin'), (2,NULL);")
+
+        self.assertIsInstance(value[0], Record)
+        self.assertEqual(value[0][u'name'], u'David Marin')
+        self.assertEqual(value, [{u'id': 1, u'name': u'David Marin'},
+                                 {u'id': 2, u'name': None}])
+
+    def test_lazy_columns(self):
+        p = MySQLCompleteInsertProtocol(lazy=True, columns=['name'])
+        self.assertEqual(
+            p.read("INSERT INTO `user` (`id`, `name`) VALUES"
+                   " (0xABC,'David Marin');"),
+            (u'user', {u'name': u'David Marin'}))
+
+
+class BlobTestCase(unittest.TestCase):
+
+    SQL = "INSERT INTO `user` VALUES (1,0xC0DE),(2,0xAB),(3,NULL);"
+
+    def test_str(self):
+        p = MySQLExtendedInsertProtocol()
+        self.assertEqual(p.read(self.SQL),
+                         (u'user', [[1, '\xc0\xde'], [2, '\xab'], [3, None]]))
+
+    def test_bytearray(self):
+        p = MySQLExtendedInsertProtocol(blob='bytearray')
+        _, rows = p.read(self.SQL)
+
+        self.assertIsInstance(rows[0][1], bytearray)
+        self.assertEqual(rows[0][1], bytearray('\xc0\xde'))
+
+    def test_memoryview(self):
+        p = MySQLExtendedInsertProtocol(blob='memoryview')
+        _, rows = p.read(self.SQL)
+
+        self.assertIsInstance(rows[0][1], memoryview)
+        self.assertEqual(rows[0][1].tobytes(), '\xc0\xde')
+        self.assertEqual(rows[0][1][1:].tobytes(), '\xde')
+
+    def test_lazy(self):
+        p = MySQLInsertProtocol(blob='bytearray', lazy=True)
+        _, row = p.read("INSERT INTO `user` VALUES (1,0xC0DE,0xABC);")
+
+        self.assertEqual(row[1], bytearray('\xc0\xde'))
+        # odd-length hex, but we don't decode it unless asked
+        self.assertEqual(row[0], 1)
+        self.assertRaises(ValueError, lambda: row[2])
+
+    def test_columnar(self):
+        p = MySQLExtendedInsertProtocol(blob='memoryview', columnar=True)
+        _, [ids, data] = p.read(self.SQL)
+
+        self.assertIsInstance(data[0], memoryview)
+        self.assertEqual([x and x.tobytes() for x in data],
+                         ['\xc0\xde', '\xab', None])
+
+    def test_write(self):
+        self.assertEqual(
+            dump_as_insert('user', [[bytearray('\xc0\xde'),
+                                     memoryview('\xab')]]),
+            'INSERT INTO `user` VALUES (0xC0DE,0xAB);')
+
+    def test_bad_blob(self):
+        self.assertRaises(ValueError, MySQLInsertProtocol, blob='buffer')
+        self.assertRaises(ValueError, parse_insert, self.SQL, blob='buffer')
+
+    def test_blob_types_missing_from_older_pythons(self):
+        with patch('mr3po.mysqldump.memoryview', None, create=True):
+            self.assertRaises(ValueError, MySQLInsertProtocol,
+                              blob='memoryview')
+            # other types still work
+            self.assertEqual(
+                parse_insert(self.SQL, blob='bytearray'),
+                parse_insert(self.SQL, blob='str'))
+
+        with patch('mr3po.mysqldump.bytearray', None, create=True):
+            self.assertRaises(ValueError, parse_insert, self.SQL,
+                              blob='bytearray')
+
+    def test_repr(self):
+        self.assertEqual(
+            repr(MySQLInsertProtocol(blob='bytearray')),
+            "MySQLInsertProtocol(decimal=False, encoding=None,"
+            " output_tab=False, blob='bytearray')")
+
+
+CREATE_USER_TABLE = """\
+CREATE TABLE `user` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `name` varchar(255) DEFAULT NULL,
+  `score` decimal(5,2) DEFAULT NULL,
+  `ratio` double DEFAULT NULL,
+  `data` blob,
+  `created` datetime NOT NULL,
+  `birthday` date DEFAULT NULL,
+  `wake_up` time DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `name` (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+"""
+
+
+class SchemaTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.schema = SchemaRegistry()
+        self.schema.add_create_table(CREATE_USER_TABLE)
+
+    def test_columns(self):
+        self.assertIn(u'user', self.schema)
+        self.assertNotIn(u'score', self.schema)
+        self.assertEqual(
+            self.schema.column_names(u'user'),
+            [u'id', u'name', u'score', u'ratio', u'data', u'created',
+             u'birthday', u'wake_up'])
+        self.assertEqual(
+            self.schema.column_types(u'user'),
+            [u'int', u'varchar', u'decimal', u'double', u'blob',
+             u'datetime', u'date', u'time'])
+
+    def test_add_dump(self):
+        schema = SchemaRegistry()
+        schema.add_dump(
+            ['-- MySQL dump 10.13\n',
+             'CREATE DATABASE /*!32312 IF NOT EXISTS*/ `app`'
+             ' /*!40100 DEFAULT CHARACTER SET utf8 */;\n',
+             'USE `app`;\n',
+             'DROP TABLE IF EXISTS `user`;\n'] +
+            CREATE_USER_TABLE.splitlines(True) +
+            ['LOCK TABLES `user` WRITE;\n',
+             "INSERT INTO `user` VALUES (1,'a',1,1,NULL,NULL,NULL,NULL);\n",
+             'CREATE TABLE `score` (\n',
+             '  `user_id` int(11) NOT NULL\n',
+             ');\n',
+             'CREATE VIEW `top_user` AS\n',
+             'SELECT `id` FROM `user`;\n'])
+
+        self.assertEqual(schema.column_names(u'user')[:2], [u'id', u'name'])
+        self.assertEqual(schema.column_names(u'score'), [u'user_id'])
+        self.assertNotIn(u'top_user', schema)
+
+    def test_not_create_table(self):
+        self.assertRaises(ValueError, self.schema.add_create_table,
+                          'DROP TABLE IF EXISTS `user`;')
+
+    def test_first_column_on_same_line_as_paren(self):
+        self.schema.add_create_table(
+            'CREATE TABLE `t` (`id` int,\n  `name` varchar(5)\n);')
+        self.assertEqual(self.schema.column_names(u't'), [u'id', u'name'])
+
+    def test_one_line_create_table(self):
+        self.schema.add_create_table(
+            'CREATE TABLE `t` (`id` int, `name` varchar(5));')
+        self.assertEqual(self.schema.column_names(u't'), [u'id', u'name'])
+        self.assertEqual(self.schema.column_types(u't'),
+                         [u'int', u'varchar'])
+
+        p = MySQLInsertProtocol(schema=self.schema)
+        self.assertEqual(p.read("INSERT INTO `t` VALUES (1,'a');"),
+                         (u't', [1, u'a']))
+
+    def test_commas_and_parens_inside_definitions(self):
+        self.schema.add_create_table(
+            "CREATE TABLE `t` (`price` decimal(10,2),"
+            " `size` enum('S, `x` int','M)') COMMENT 'a, `y` int',"
+            " `z` int, PRIMARY KEY (`price`,`z`));")
+        self.assertEqual(self.schema.column_names(u't'),
+                         [u'price', u'size', u'z'])
+
+    def test_no_columns(self):
+        self.assertRaises(ValueError, self.schema.add_create_table,
+                          'CREATE TABLE `t` (PRIMARY KEY (`id`));')
+
+    def test_typed_values(self):
+        p = MySQLInsertProtocol(schema=self.schema)
+        key, value = p.read(
+            "INSERT INTO `user` VALUES (1,'David Marin',25.25,1,"
+            "'\\0\xc3\xa9','2012-06-19 15:13:46','1980-02-29','-01:30:00');")
+
+        self.assertEqual(key, u'user')
+        self.assertEqual(
+            value,
+            [1, u'David Marin', Decimal('25.25'), 1.0, '\0\xc3\xa9',
+             datetime(2012, 6, 19, 15, 13, 46), date(1980, 2, 29),
+             timedelta(hours=-1, minutes=-30)])
+        self.assertEqual(
+            [type(x) for x in value],
+            [int, unicode, Decimal, float, str, datetime, date, timedelta])
+
+    def test_binary_values(self):
+        # BLOBs dumped without --hex-blob, that aren't valid UTF-8
+        sql = ("INSERT INTO `user` VALUES (1,'a',1,1,'\xff\\0\x80abc',"
+               "NULL,NULL,NULL),(2,'\xe9',1,1,'\xc3',NULL,NULL,NULL);")
+
+        for kwargs in (dict(), dict(encoding='latin_1'),
+                       dict(lazy=True), dict(columnar=True)):
+            table, rows = parse_insert(sql, schema=self.schema, **kwargs)
+            if kwargs.get('columnar'):
+                data = list(rows[4])
+            else:
+                data = [row[4] for row in rows]
+
+            self.assertEqual(data, ['\xff\0\x80abc', '\xc3'])
+
+        # other strings are still decoded (falling back to latin-1)
+        table, rows = parse_insert(sql, schema=self.schema)
+        self.assertEqual(rows[1][1], u'\xe9')
+
+        # strictly UTF-8 strings don't affect BLOBs
+        self.assertRaises(UnicodeDecodeError, parse_insert, sql,
+                          schema=self.schema, encoding='utf_8')
+        table, rows = parse_insert(sql.replace("'\xe9'", "'e'"),
+                                   schema=self.schema, encoding='utf_8')
+        self.assertEqual(rows[0][4], '\xff\0\x80abc')
+
+    def test_binary_values_in_decoded_sql(self):
+        # SQL we have to decode as a whole; BLOBs are re-encoded with the
+        # same codec
+        sql = (u"INSERT INTO `user` VALUES (1,'a',1,1,'\xff\\0\x80abc',"
+               u"NULL,NULL,NULL);")
+
+        table, row = parse_insert(sql.encode('utf_16_le'), single_row=True,
+                                  schema=self.schema, encoding='utf_16_le')
+        self.assertEqual(row[4], u'\xff\0\x80abc'.encode('utf_16_le'))
+
+    def test_nulls_and_zero_dates(self):
+        p = MySQLInsertProtocol(schema=self.schema)
+        key, value = p.read(
+            "INSERT INTO `user` VALUES (1,NULL,NULL,NULL,0xC0DE,"
+            "'0000-00-00 00:00:00','0000-00-00',NULL);")
+
+        self.assertEqual(
+            value, [1, None, None, None, '\xc0\xde', None, None, None])
+
+    def test_complete_insert(self):
+        p = MySQLCompleteInsertProtocol(schema=self.schema)
+        key, value = p.read(
+            "INSERT INTO `user` (`score`, `created`) VALUES"
+            " (25.25,'2012-06-19 15:13:46.5');")
+
+        self.assertEqual(
+            value, {u'score': Decimal('25.25'),
+                    u'created': datetime(2012, 6, 19, 15, 13, 46, 500000)})
+
+    def test_unknown_column(self):
+        p = MySQLCompleteInsertProtocol(schema=self.schema)
+        self.assertRaises(
+            ValueError,
+            p.read, "INSERT INTO `user` (`email`) VALUES ('dave@yelp.com');")
+
+    def test_wrong_number_of_values(self):
+        p = MySQLInsertProtocol(schema=self.schema)
+        self.assertRaises(
+            ValueError, p.read, "INSERT INTO `user` VALUES (1,'David Marin');")
+
+    def test_unknown_table(self):
+        p = MySQLInsertProtocol(schema=self.schema)
+        self.assertEqual(
+            p.read("INSERT INTO `score` VALUES (1,25.25);"),
+            (u'score', [1, 25.25]))
+
+    def test_lazy(self):
+        p = MySQLCompleteInsertProtocol(schema=self.schema, lazy=True,
+                                        columns=['created', 'score'])
+        key, value = p.read(
+            "INSERT INTO `user` (`id`, `score`, `created`) VALUES"
+            " (1,25.25,'2012-06-19 15:13:46');")
+
+        self.assertEqual(value[u'score'], Decimal('25.25'))
+        self.assertEqual(value[u'created'], datetime(2012, 6, 19, 15, 13, 46))
+
+    def test_parse_time(self):
+        self.assertEqual(parse_time('838:59:59'),
+                         timedelta(hours=838, minutes=59, seconds=59))
+        self.assertEqual(parse_time('00:00:01.25'),
+                         timedelta(seconds=1, microseconds=250000))
+
+
+class ColumnarTestCase(unittest.TestCase):
+
+    SQL = ("INSERT INTO `user` (`id`, `name`, `score`, `data`) VALUES"
+           " (1,'David Marin',25.25,0xC0DE),"
+           " (2,NULL,NULL,NULL),"
+           " (3,'Paul Erd\\'os',100,'');")
+
+    def test_columns(self):
+        p = MySQLExtendedInsertProtocol(columnar=True)
+        key, value = p.read(self.SQL)
+
+        self.assertEqual(key, u'user')
+        self.assertEqual(len(value), 4)
+        for column in value:
+            self.assertIsInstance(column, Column)
+
+        ids, names, scores, data = value
+        self.assertEqual(ids.values, array('l', [1, 2, 3]))
+        self.assertEqual(names.values, [u'David Marin', None, u"Paul Erd'os"])
+        self.assertEqual(scores.values, array('d', [25.25, 0.0, 100.0]))
+        # hex and '' mixed in one column
+        self.assertEqual(data.values, ['\xc0\xde', None, u''])
+
+    def test_same_as_rows(self):
+        _, rows = MySQLExtendedInsertProtocol().read(self.SQL)
+        _, columns = MySQLExtendedInsertProtocol(columnar=True).read(self.SQL)
+
+        self.assertEqual([list(column) for column in columns],
+                         map(list, zip(*rows)))
+
+    def test_nulls(self):
+        _, columns = MySQLExtendedInsertProtocol(columnar=True).read(
+            "INSERT INTO `t` VALUES " +
+            ','.join('(%s)' % ('NULL' if i % 3 == 0 else i)
+                     for i in xrange(10)) + ';')
+
+        [column] = columns
+        self.assertEqual(column.null_count, 4)
+        self.assertEqual(column.validity, bytearray('\xb6\xfd'))
+        self.assertEqual(column.values,
+                         array('l', [0, 1, 2, 0, 4, 5, 0, 7, 8, 0]))
+        self.assertEqual(column.is_null(0), True)
+        self.assertEqual(column.is_null(1), False)
+        self.assertEqual(column[-1], None)
+        self.assertEqual(column[1:3], [1, 2])
+        self.assertEqual(
+            column, [None, 1, 2, None, 4, 5, None, 7, 8, None])
+
+    def test_no_nulls(self):
+        _, [column] = MySQLExtendedInsertProtocol(columnar=True).read(
+            "INSERT INTO `t` VALUES (1),(2);")
+
+        self.assertEqual(column.null_count, 0)
+        self.assertEqual(column.validity, None)
+        self.assertEqual(column.is_null(0), False)
+
+    def test_all_null(self):
+        _, [column] = MySQLExtendedInsertProtocol(columnar=True).read(
+            "INSERT INTO `t` VALUES (NULL),(NULL);")
+
+        self.assertEqual(column.values, [None, None])
+        self.assertEqual(column.null_count, 2)
+
+    def test_complete(self):
+        p = MySQLExtendedCompleteInsertProtocol(columnar=True,
+                                                columns=['score', 'id'])
+        key, value = p.read(self.SQL)
+
+        self.assertEqual(sorted(value), [u'id', u'score'])
+        self.assertEqual(value[u'id'], [1, 2, 3])
+        self.assertEqual(value[u'score'], [25.25, None, 100.0])
+
+    def test_decimal(self):
+        _, [column] = MySQLExtendedInsertProtocol(
+            columnar=True, decimal=True).read(
+                "INSERT INTO `t` VALUES (1.5),(NULL),(2);")
+
+        self.assertEqual(column.values, [Decimal('1.5'), None, Decimal(2)])
+
+    def test_big_ints(self):
+        _, [column] = MySQLExtendedInsertProtocol(columnar=True).read(
+            "INSERT INTO `t` VALUES (18446744073709551615),(1);")
+
+        self.assertEqual(column.values, [18446744073709551615, 1])
+
+    def test_schema(self):
+        schema = SchemaRegistry()
+        schema.add_create_table(CREATE_USER_TABLE)
+        p = MySQLExtendedInsertProtocol(columnar=True, schema=schema,
+                                        columns=[2, 3, 5])
+        _, [scores, ratios, created] = p.read(
+            "INSERT INTO `user` VALUES"
+            " (1,'a',25.25,1,NULL,'2012-06-19 15:13:46',NULL,NULL),"
+            " (2,'b',NULL,2.5,NULL,'0000-00-00 00:00:00',NULL,NULL);")
+
+        self.assertEqual(scores.values, [Decimal('25.25'), None])
+        # double columns are always floats
+        self.assertEqual(ratios.values, array('d', [1.0, 2.5]))
+        self.assertEqual(created.values,
+                         [datetime(2012, 6, 19, 15, 13, 46), None])
+
+    def test_single_row(self):
+        p = MySQLCompleteInsertProtocol(columnar=True)
+        self.assertEqual(
+            p.read("INSERT INTO `user` (`id`) VALUES (1);"),
+            (u'user', {u'id': [1]}))
+        self.assertRaises(ValueError, p.read,
+                          "INSERT INTO `user` (`id`) VALUES (1),(2);")
+
+    def test_bad_rows(self):
+        p = MySQLExtendedInsertProtocol(columnar=True)
+        self.assertRaises(ValueError, p.read,
+                          "INSERT INTO `user` VALUES (1,2),(3);")
+        self.assertRaises(ValueError, p.read,
+                          "INSERT INTO `user` VALUES (1),(2,3);")
+        self.assertRaises(ValueError, p.read,
+                          "INSERT INTO `user` VALUES (1),(2;")
+        self.assertRaises(ValueError, p.read,
+                          "INSERT INTO `user` VALUES (1,`id`);")
+
+    def test_bad_options(self):
+        self.assertRaises(ValueError, MySQLExtendedInsertProtocol,
+                          columnar=True, stream=True)
+        self.assertRaises(ValueError, MySQLExtendedInsertProtocol,
+                          columnar=True, lazy=True)
+        self.assertRaises(ValueError, MySQLExtendedInsertProtocol,
+                          columnar='pandas')
+
+    def test_repr(self):
+        self.assertEqual(
+            repr(MySQLExtendedInsertProtocol(columnar=True)),
+            'MySQLExtendedInsertProtocol(decimal=False, encoding=None,'
+            ' output_tab=False, columnar=True)')
+
+    def test_numpy(self):
+        if numpy is None:
+            self.assertRaises(ImportError, MySQLExtendedInsertProtocol,
+                              columnar='numpy')
+            return
+
+        p = MySQLExtendedInsertProtocol(columnar='numpy')
+        _, [ids, names, scores, data] = p.read(self.SQL)
+
+        self.assertIsInstance(ids.values, numpy.ndarray)
+        self.assertEqual(ids.values.tolist(), [1, 2, 3])
+        self.assertEqual(scores.values.tolist(), [25.25, 0.0, 100.0])
+        self.assertEqual(scores, [25.25, None, 100.0])
+        self.assertEqual(names.values, [u'David Marin', None, u"Paul Erd'os"])
+
+
+DUMP = """\
+-- MySQL dump 10.13  Distrib 5.5.24, for debian-linux-gnu (x86_64)
+--
+-- Host: localhost    Database: test
+-- ------------------------------------------------------
+/*!40101 SET @OLD_CHARACTER_SET_CLIENT=@@CHARACTER_SET_CLIENT */;
+/*!40101 SET NAMES utf8 */;
+
+--
+-- Table structure for table `user`
+--
+
+DROP TABLE IF EXISTS `user`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+%s/*!40101 SET character_set_client = @saved_cs_client */;
+
+LOCK TABLES `user` WRITE;
+/*!40000 ALTER TABLE `user` DISABLE KEYS */;
+INSERT INTO `user` VALUES (1,'David Marin',25.25,NULL,0xC0DE,\
+'2012-06-19 15:13:46',NULL,NULL),(2,'semi;colon -- /* \\';',\
+NULL,NULL,NULL,'2012-06-19 15:13:46',NULL,NULL);
+INSERT INTO `user` VALUES
+(3,'Paul Erdős',0,NULL,NULL,'2012-06-19 15:13:46',NULL,NULL);
+/*!40000 ALTER TABLE `user` ENABLE KEYS */;
+UNLOCK TABLES;
+INSERT INTO `score` VALUES (1,3),(2,5);
+/*!40101 SET CHARACTER_SET_CLIENT=@OLD_CHARACTER_SET_CLIENT */;
+
+-- Dump completed on 2012-06-19 15:13:46
+""" % CREATE_USER_TABLE
+
+
+class DumpTestCase(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.sql')
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(DUMP)
+        finally:
+            f.close()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_iter_statements(self):
+        sql = "USE test; -- hi;\nSELECT ';' /* ; */;SELECT 1"
+        self.assertEqual(
+            [sql[start:end] for start, end in iter_statements(sql)],
+            ['USE test;', "SELECT ';' /* ; */;", 'SELECT 1'])
+
+    def test_iter_statements_with_quote_escapes(self):
+        sql = "SELECT 'it''s;'; SELECT 'a\\';'; SELECT 1;"
+        self.assertEqual(
+            [sql[start:end] for start, end in iter_statements(sql)],
+            ["SELECT 'it''s;';", "SELECT 'a\\';';", 'SELECT 1;'])
+
+    def test_truncated_string_with_many_quote_escapes(self):
+        # this used to take time exponential in the number of ''s
+        sql = "INSERT INTO `user` VALUES (1,'" + "a''" * 100
+        self.assertEqual(list(iter_statements(sql)), [(0, len(sql))])
+
+    def test_iter_dump(self):
+        self.assertEqual(
+            list(iter_dump(self.path, columns=[0, 1])),
+            [(u'user', [1, u'David Marin']),
+             (u'user', [2, u"semi;colon -- /* ';"]),
+             (u'user', [3, u'Paul Erdős']),
+             (u'score', [1, 3]),
+             (u'score', [2, 5])])
+
+    def test_file_object(self):
+        f = open(self.path, 'rb')
+        try:
+            self.assertEqual(len(list(iter_dump(f))), 5)
+        finally:
+            f.close()
+
+    def test_tables(self):
+        self.assertEqual(
+            list(iter_dump(self.path, tables=[u'score'])),
+            [(u'score', [1, 3]), (u'score', [2, 5])])
+        self.assertEqual(
+            [table for table, row in
+             iter_dump(self.path, exclude_tables=[u'score'])],
+            [u'user', u'user', u'user'])
+
+    def test_schema(self):
+        # picks up CREATE TABLE from the dump
+        schema = SchemaRegistry()
+        rows = list(iter_dump(self.path, schema=schema, complete=True,
+                              tables=[u'user'], columns=['id', 'created']))
+
+        self.assertEqual(
+            rows[0],
+            (u'user', {u'id': 1,
+                       u'created': datetime(2012, 6, 19, 15, 13, 46)}))
+        self.assertIn(u'user', schema)
+
+    def test_empty_file(self):
+        open(self.path, 'wb').close()
+        self.assertEqual(list(iter_dump(self.path)), [])
+
+
+class SplitDumpTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'dump.sql')
+        f = open(self.path, 'wb')
+        try:
+            f.write(DUMP)
+        finally:
+            f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_statement_index(self):
+        index_path = write_statement_index(self.path)
+        self.assertEqual(index_path, self.path + '.idx')
+
+        offsets = read_statement_index(index_path)
+        self.assertEqual(offsets,
+                         [start for start, end in iter_statements(DUMP)])
+
+    def test_custom_index_path(self):
+        index_path = os.path.join(self.tmp_dir, 'foo.idx')
+        self.assertEqual(write_statement_index(self.path, index_path),
+                         index_path)
+        self.assertEqual(split_dump(self.path, 1, index_path),
+                         [(0, len(DUMP))])
+        self.assertFalse(os.path.exists(self.path + '.idx'))
+
+    def test_splits_start_at_statements(self):
+        offsets = set(start for start, end in iter_statements(DUMP))
+
+        for num_splits in xrange(1, 10):
+            splits = split_dump(self.path, num_splits)
+            self.assertTrue(1 <= len(splits) <= num_splits)
+            # ranges cover the whole file, with no gaps
+            self.assertEqual(splits[0][0], 0)
+            self.assertEqual(splits[-1][1], len(DUMP))
+            for (_, end), (start, _) in zip(splits, splits[1:]):
+                self.assertEqual(end, start)
+                self.assertIn(start, offsets)
+
+    def test_read_splits(self):
+        schema = SchemaRegistry()
+        schema.add_dump(StringIO(DUMP))
+        all_rows = list(iter_dump(self.path, schema=schema))
+
+        for num_splits in xrange(1, 10):
+            rows = []
+            for start, end in split_dump(self.path, num_splits):
+                rows.extend(iter_dump(self.path, schema=schema,
+                                      start=start, end=end))
+            self.assertEqual(rows, all_rows)
+
+    def test_bad_num_splits(self):
+        self.assertRaises(ValueError, split_dump, self.path, 0)
+
+    def test_empty_file(self):
+        open(self.path, 'wb').close()
+        self.assertEqual(read_statement_index(
+            write_statement_index(self.path)), [])
+        self.assertEqual(split_dump(self.path, 3), [])
+
+
 class EncodingTestCase(unittest.TestCase):
 
     def test_default_encoding(self):
@@ -156,6 +1123,105 @@ class EncodingTestCase(unittest.TestCase):
                                      u'data': '\x0e\x2d\x05',
                                      u'misc': None}))
 
+    def test_fallback_is_per_string(self):
+        p = MySQLInsertProtocol()
+        # one string in UTF-8, and one in latin-1
+        self.assertEqual(
+            p.read("INSERT INTO `user` VALUES ('Paul Erdős','Erd\xf6s');"),
+            (u'user', [u'Paul Erdős', u'Erdös']))
+
+    def test_count_fallbacks(self):
+        p = MySQLExtendedInsertProtocol()
+        p.read("INSERT INTO `user` VALUES ('Erd\xf6s'),('Erdős'),"
+               "('Erd\xf6s');")
+        self.assertEqual(p.decoder.fallbacks, 2)
+
+    def test_sticky_encoding(self):
+        p = MySQLInsertProtocol(sticky_encoding=True)
+        self.assertEqual(
+            p.read("INSERT INTO `user` VALUES ('Erd\xf6s','Erdős');"),
+            (u'user', [u'Erdös', 'Erdős'.decode('latin_1')]))
+        self.assertEqual(p.decoder.encoding, 'latin_1')
+        self.assertEqual(
+            p.read("INSERT INTO `user` VALUES ('Erdős');"),
+            (u'user', ['Erdős'.decode('latin_1')]))
+        self.assertEqual(p.decoder.fallbacks, 1)
+
+    def test_sticky_encoding_repr(self):
+        self.assertEqual(
+            repr(MySQLInsertProtocol(sticky_encoding=True)),
+            'MySQLInsertProtocol(decimal=False, encoding=None,'
+            ' output_tab=False, sticky_encoding=True)')
+
+    def test_decoder_is_shared_by_lazy_rows(self):
+        p = MySQLInsertProtocol(lazy=True)
+        _, row = p.read("INSERT INTO `user` VALUES ('Erd\xf6s');")
+        self.assertEqual(p.decoder.fallbacks, 0)
+        self.assertEqual(row[0], u'Erdös')
+        self.assertEqual(p.decoder.fallbacks, 1)
+
+    def test_non_ascii_identifiers(self):
+        p = MySQLCompleteInsertProtocol(encoding='cp1252')
+        self.assertEqual(
+            p.read("INSERT INTO `caf\xe9` (`\x80`) VALUES ('\x80\\'s');"),
+            (u'caf\xe9', {u'€': u"€'s"}))
+
+    def test_utf_16(self):
+        # not a superset of ASCII, so we have to decode the whole line
+        sql = u"INSERT INTO `user` VALUES (1,'Paul Erdős',0xC0DE);"
+        for lazy in (False, True):
+            p = MySQLInsertProtocol(encoding='utf_16', lazy=lazy)
+            self.assertEqual(p.read(sql.encode('utf_16')),
+                             (u'user', [1, u'Paul Erdős', '\xc0\xde']))
+
+    def test_lazy_and_columnar_decode_strings(self):
+        sql = "INSERT INTO `user` VALUES ('Paul Erdős','Erd\xf6s');"
+
+        _, row = MySQLInsertProtocol(lazy=True).read(sql)
+        self.assertEqual(row, [u'Paul Erdős', u'Erdös'])
+
+        _, columns = MySQLInsertProtocol(columnar=True).read(sql)
+        self.assertEqual(columns, [[u'Paul Erdős'], [u'Erdös']])
+
+    def test_is_ascii_compatible(self):
+        for encoding in (None, 'utf8', 'UTF-8', 'latin1', 'cp1252',
+                         'iso-8859-15', 'ascii'):
+            self.assertEqual(is_ascii_compatible(encoding), True, encoding)
+
+        # in Shift JIS, the second byte of a character can be a backslash
+        for encoding in ('utf_16', 'utf_32', 'shift_jis', 'utf-8-sig',
+                         'no-such-encoding'):
+            self.assertEqual(is_ascii_compatible(encoding), False, encoding)
+
+
+class StringEscapingTestCase(unittest.TestCase):
+
+    def test_no_escapes(self):
+        u = u'David Marin'
+        self.assertIs(unescape_string(u), u)
+        self.assertIs(escape_unicode_string(u), u)
+
+    def test_unescape(self):
+        self.assertEqual(
+            unescape_string(u"it\\'s a \\\\ \\n\\t\\0\\Z\\r\\b\\% ''test''"),
+            u"it's a \\ \n\t\0\x1a\r\b% 'test'")
+
+    def test_unescape_bytes(self):
+        self.assertEqual(unescape_string('caf\xc3\xa9\\n'), 'caf\xc3\xa9\n')
+
+    def test_escape(self):
+        self.assertEqual(
+            escape_unicode_string(u"it's a \\ \n\t\0\x1a\r\b test"),
+            u"it\\'s a \\\\ \\n\\t\\0\\Z\\r\\b test")
+
+    def test_escape_requires_unicode(self):
+        self.assertRaises(TypeError, escape_unicode_string, 'David Marin')
+
+    def test_round_trip(self):
+        for u in [u'', u"'", u'\\', u"\\'", u'\\n', u"''", u'\n\\n',
+                  u'Paul Erdős', u'\\\\\'\x1a']:
+            self.assertEqual(unescape_string(escape_unicode_string(u)), u)
+
 
 class NumberTestCase(unittest.TestCase):
 
@@ -195,6 +1261,242 @@ class OutputTabTestCase(unittest.TestCase):
         self.assertNotEqual(row1.split('\t')[0], row2.split('\t')[0])
 
 
+class InsertEncoderTestCase(unittest.TestCase):
+
+    def test_format_rows(self):
+        encoder = InsertEncoder('user', cols=['name', 'id'])
+        self.assertEqual(encoder.prefix,
+                         'INSERT INTO `user` (`name`,`id`) VALUES ')
+        self.assertEqual(
+            encoder.format_rows([{'id': 1, 'name': u'David Marin'},
+                                 {'id': 2, 'name': None}]),
+            [u"('David Marin',1)", '(NULL,2)'])
+
+    def test_sequences(self):
+        encoder = InsertEncoder('user', num_cols=2, output_tab=True)
+        self.assertEqual(encoder.prefix, 'INSERT INTO `user`\t VALUES ')
+        self.assertEqual(encoder.format_row((1, '\xc0\xde')), '(1,0xC0DE)')
+        self.assertRaises(ValueError, encoder.format_row, [1])
+
+    def test_wrong_columns(self):
+        encoder = InsertEncoder('user', cols=['id'])
+        self.assertEqual(encoder.values({'id': 1}), (1,))
+        self.assertEqual(encoder.values({'uid': 1}), None)
+        self.assertEqual(encoder.values({'id': 1, 'name': None}), None)
+        self.assertRaises(ValueError, encoder.format_rows,
+                          [{'id': 1}, {'id': 2, 'name': None}])
+
+    def test_same_as_format_value(self):
+        class Name(unicode):
+            pass
+
+        values = [None, 0, -1, 10 ** 30, 0.1, 1e100, float('inf'),
+                  Decimal('2010.66'), True, u'', u"O'Neil\\", Name(u'Ezra'),
+                  '', '\x00\xff', bytearray('\xc0\xde'), memoryview('abc')]
+
+        encoder = InsertEncoder('t', num_cols=len(values))
+        self.assertEqual(
+            encoder.format_row(values),
+            '(%s)' % ','.join(format_value(x) for x in values))
+
+    def test_cached(self):
+        self.assertIs(insert_encoder('user', cols=('id',)),
+                      insert_encoder('user', cols=('id',)))
+        self.assertIsNot(insert_encoder('user', cols=('id',)),
+                         insert_encoder('user', cols=('id',),
+                                        output_tab=True))
+
+    def test_sort_columns(self):
+        Row = record_class(['name', 'id'])
+        rows = [Row([u'David Marin', 1]), Row([u'Paul Erdős', 3])]
+
+        self.assertEqual(
+            dump_as_insert('user', rows, complete=True),
+            "INSERT INTO `user` (`id`,`name`) VALUES "
+            "(1,'David Marin'), (3,'Paul Erdős');")
+
+        self.assertEqual(
+            dump_as_insert('user', rows, complete=True, sort_columns=False),
+            "INSERT INTO `user` (`name`,`id`) VALUES "
+            "('David Marin',1), ('Paul Erdős',3);")
+
+        p = MySQLCompleteInsertProtocol(sort_columns=False)
+        self.assertEqual(p.write('user', rows[0]),
+                         "INSERT INTO `user` (`name`,`id`) VALUES "
+                         "('David Marin',1);")
+        self.assertEqual(
+            repr(p), 'MySQLCompleteInsertProtocol(decimal=False, '
+            'encoding=None, output_tab=False, sort_columns=False)')
+
+        # other rows just need the same columns, in any order
+        f = StringIO()
+        with BatchedInsertWriter(f, complete=True,
+                                 sort_columns=False) as writer:
+            writer.write('user', rows[0])
+            writer.write('user', {'id': 2, 'name': u'Nully Nullington'})
+
+        self.assertEqual(
+            f.getvalue(),
+            "INSERT INTO `user` (`name`,`id`) VALUES "
+            "('David Marin',1), ('Nully Nullington',2);\n")
+
+
+class WriteInsertTestCase(unittest.TestCase):
+
+    USER_ROWS = [
+        {'id': 1, 'name': u'David Marin'},
+        {'id': 2, 'name': u'Nully Nullington'},
+        {'id': 3, 'name': u'Paul Erdős'},
+    ]
+
+    def test_same_as_dump_as_insert(self):
+        for kwargs, newline in [
+                (dict(complete=True), '\n'),
+                (dict(complete=True, output_tab=True), '\n'),
+                (dict(complete=True, encoding='utf16'),
+                 u'\n'.encode('utf_16_le'))]:
+            f = StringIO()
+            self.assertEqual(
+                write_insert(f, 'user', self.USER_ROWS, **kwargs), 3)
+            self.assertEqual(
+                f.getvalue(),
+                dump_as_insert('user', self.USER_ROWS, **kwargs) + newline)
+
+    def test_one_row_at_a_time(self):
+        writes = []
+
+        class FakeFile(object):
+            def write(self, data):
+                writes.append(data)
+
+        def rows():
+            for i in xrange(1000):
+                # rows shouldn't be read until the previous one is written
+                self.assertEqual(len(writes), i)
+                yield [i, u'x' * 10]
+
+        write_insert(FakeFile(), 'user', rows())
+
+        self.assertLess(max(len(data) for data in writes), 100)
+        self.assertEqual(
+            parse_insert(''.join(writes).rstrip()),
+            ('user', [[i, u'x' * 10] for i in xrange(1000)]))
+
+    def test_bad_rows(self):
+        f = StringIO()
+        self.assertRaises(ValueError, write_insert, f, 'user', [])
+        self.assertRaises(ValueError, write_insert, f, '', [[1]])
+        self.assertEqual(f.getvalue(), '')
+
+        self.assertRaises(ValueError, write_insert, f, 'user', [[1], [2, 3]])
+        self.assertRaises(ValueError, write_insert, f, 'user',
+                          [{'id': 1}, {'uid': 2}], complete=True)
+
+
+class BatchedInsertWriterTestCase(unittest.TestCase):
+
+    USER_ROWS = [
+        {'id': 1, 'name': u'David Marin'},
+        {'id': 2, 'name': u'Nully Nullington'},
+        {'id': 3, 'name': u'Paul Erdős'},
+    ]
+
+    def test_group_rows(self):
+        f = StringIO()
+        with BatchedInsertWriter(f, complete=True) as writer:
+            for row in self.USER_ROWS:
+                writer.write('user', row)
+
+        self.assertEqual(
+            f.getvalue(),
+            dump_as_insert('user', self.USER_ROWS, complete=True) + '\n')
+
+    def test_new_statement_on_table_or_cols_change(self):
+        f = StringIO()
+        writer = BatchedInsertWriter(f, complete=True)
+        writer.write('user', {'id': 1})
+        writer.write('user', {'id': 2})
+        writer.write('score', {'id': 2})
+        writer.write('score', {'id': 3, 'score': 25.25})
+        writer.write('user', {'id': 4})
+        writer.close()
+
+        p = MySQLExtendedCompleteInsertProtocol()
+        self.assertEqual(
+            [p.read(line) for line in f.getvalue().splitlines()],
+            [(u'user', [{u'id': 1}, {u'id': 2}]),
+             (u'score', [{u'id': 2}]),
+             (u'score', [{u'id': 3, u'score': 25.25}]),
+             (u'user', [{u'id': 4}])])
+
+    def test_new_statement_on_row_length_change(self):
+        f = StringIO()
+        writer = BatchedInsertWriter(f)
+        writer.write('user', [1])
+        writer.write('user', [2, None])
+        writer.flush()
+
+        self.assertEqual(len(f.getvalue().splitlines()), 2)
+
+    def test_max_bytes(self):
+        rows = [[i, u'x' * 10] for i in xrange(100)]
+
+        f = StringIO()
+        writer = BatchedInsertWriter(f, max_bytes=100)
+        for row in rows:
+            writer.write('user', row)
+        writer.flush()
+
+        lines = f.getvalue().splitlines(True)
+        self.assertGreater(len(lines), 1)
+        for line in lines:
+            self.assertLessEqual(len(line), 100)
+
+        p = MySQLExtendedInsertProtocol()
+        self.assertEqual(
+            sum((p.read(line.rstrip())[1] for line in lines), []), rows)
+
+    def test_write_after_flush(self):
+        f = StringIO()
+        writer = BatchedInsertWriter(f, max_bytes=45)
+        for i in (1, 2, 3):
+            writer.write('user', [i])
+        writer.flush()
+        for i in (4, 5, 6):
+            writer.write('user', [i])
+        writer.flush()
+
+        # the second statement shouldn't count the first one's bytes
+        self.assertEqual(
+            f.getvalue(),
+            'INSERT INTO `user` VALUES (1), (2), (3);\n'
+            'INSERT INTO `user` VALUES (4), (5), (6);\n')
+
+    def test_row_bigger_than_max_bytes(self):
+        f = StringIO()
+        writer = BatchedInsertWriter(f, max_bytes=10)
+        writer.write('user', [1])
+        writer.write('user', [2])
+        writer.flush()
+
+        self.assertEqual(
+            f.getvalue(),
+            'INSERT INTO `user` VALUES (1);\n'
+            'INSERT INTO `user` VALUES (2);\n')
+
+    def test_encoding(self):
+        f = StringIO()
+        with BatchedInsertWriter(f, complete=True,
+                                 encoding='utf16') as writer:
+            for row in self.USER_ROWS:
+                writer.write('user', row)
+
+        self.assertEqual(
+            f.getvalue(),
+            dump_as_insert('user', self.USER_ROWS, complete=True,
+                           encoding='utf16') + u'\n'.encode('utf_16_le'))
+
+
 class MySQLInsertProtocolTestCase(RoundTripTestCase):
     PROTOCOLS = [
         MySQLInsertProtocol(),
@@ -206,6 +1508,7 @@ class MySQLInsertProtocolTestCase(RoundTripTestCase):
         ('user', [1, u'David Marin', 25.25, '\xc0\xde', None]),
         ('user', [2, u'Nully Nullington', None, None, None]),
         ('user', [3, u'Paul Erdős', 0, '\x0e\x2d\x05', None]),
+        ('user', [4, u"O'Neil\\", None, None, u'\r\n']),
     ]
 
 
@@ -245,6 +1548,26 @@ class MySQLCompleteInsertProtocolRoundTripTestCase(RoundTripTestCase):
     ]
 
 
+class MySQLCompleteInsertProtocolCompactRoundTripTestCase(
+        MySQLCompleteInsertProtocolRoundTripTestCase):
+    PROTOCOLS = [
+        MySQLCompleteInsertProtocol(compact=True),
+    ]
+
+
+class MySQLCompleteInsertProtocolLazyRoundTripTestCase(
+        MySQLCompleteInsertProtocolRoundTripTestCase):
+    PROTOCOLS = [
+        MySQLCompleteInsertProtocol(lazy=True),
+    ]
+
+
+class MySQLInsertProtocolLazyTestCase(MySQLInsertProtocolTestCase):
+    PROTOCOLS = [
+        MySQLInsertProtocol(lazy=True),
+    ]
+
+
 class MySQLExtendedInsertProtocolTestCase(RoundTripTestCase):
     PROTOCOLS = [
         MySQLExtendedInsertProtocol(),
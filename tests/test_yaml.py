@@ -11,7 +11,10 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from copy import deepcopy
+from datetime import date
 from decimal import Decimal
+import random
 
 try:
     import unittest2 as unittest
@@ -21,13 +24,21 @@ except ImportError:
 
 from mock import call
 from mock import Mock
+from mock import patch
+import yaml
 from yaml.constructor import ConstructorError
 from yaml.representer import RepresenterError
 
+from mr3po.yaml import CLoader
+from mr3po.yaml import InlineDumper
+from mr3po.yaml import LazyValue
+from mr3po.yaml import RESOLVERS
 from mr3po.yaml import SafeYAMLProtocol
 from mr3po.yaml import SafeYAMLValueProtocol
 from mr3po.yaml import YAMLProtocol
 from mr3po.yaml import YAMLValueProtocol
+from mr3po.yaml import dump_inline
+from mr3po.yaml import yaml_classes
 from tests.roundtrip import RoundTripTestCase
 
 
@@ -69,6 +80,8 @@ class YAMLProtocolRoundTripTestCase(RoundTripTestCase):
         YAMLProtocol(encoding='utf_7'),
         YAMLProtocol(encoding='utf_8'),
         YAMLProtocol(encoding='utf_16'),
+        YAMLProtocol(backend='auto'),
+        YAMLProtocol(encoding='utf_16', backend='auto'),
     ]
 
     WRW_KEY_VALUES = KEY_VALUES
@@ -81,6 +94,8 @@ class YAMLValueProtocolRoundTripTestCase(RoundTripTestCase):
         YAMLValueProtocol(encoding='utf_7'),
         YAMLValueProtocol(encoding='utf_8'),
         YAMLValueProtocol(encoding='utf_16'),
+        YAMLValueProtocol(backend='auto'),
+        YAMLValueProtocol(encoding='utf_16', backend='auto'),
     ]
 
     WRW_KEY_VALUES = KEY_VALUES
@@ -93,6 +108,8 @@ class SafeYAMLProtocolRoundTripTestCase(RoundTripTestCase):
         SafeYAMLProtocol(encoding='utf_7'),
         SafeYAMLProtocol(encoding='utf_8'),
         SafeYAMLProtocol(encoding='utf_16'),
+        SafeYAMLProtocol(backend='auto'),
+        SafeYAMLProtocol(encoding='utf_16', backend='auto'),
     ]
 
     WRW_KEY_VALUES = KEY_VALUES
@@ -105,6 +122,8 @@ class SafeYAMLValueProtocolRoundTripTestCase(RoundTripTestCase):
         SafeYAMLValueProtocol(encoding='utf_7'),
         SafeYAMLValueProtocol(encoding='utf_8'),
         SafeYAMLValueProtocol(encoding='utf_16'),
+        SafeYAMLValueProtocol(backend='auto'),
+        SafeYAMLValueProtocol(encoding='utf_16', backend='auto'),
     ]
 
     WRW_KEY_VALUES = KEY_VALUES
@@ -150,6 +169,140 @@ class SafetyTestCase(unittest.TestCase):
             ConstructorError, safe_p.read, p.write((), ()))
 
 
+class BackendTestCase(unittest.TestCase):
+
+    def test_pure_by_default(self):
+        self.assertEqual(yaml_classes(),
+                         (yaml.Loader, yaml.Dumper))
+        self.assertEqual(yaml_classes(safe=True),
+                         (yaml.SafeLoader, yaml.SafeDumper))
+
+    @unittest.skipIf(CLoader is None, 'PyYAML was built without libyaml')
+    def test_c(self):
+        for backend in ('auto', 'c'):
+            self.assertEqual(yaml_classes(backend=backend),
+                             (yaml.CLoader, yaml.CDumper))
+            self.assertEqual(yaml_classes(safe=True, backend=backend),
+                             (yaml.CSafeLoader, yaml.CSafeDumper))
+
+    def test_no_libyaml(self):
+        with patch('mr3po.yaml.CLoader', None):
+            self.assertEqual(yaml_classes(backend='auto'),
+                             (yaml.Loader, yaml.Dumper))
+            self.assertRaises(ImportError, yaml_classes, backend='c')
+            self.assertRaises(ImportError, SafeYAMLProtocol, backend='c')
+
+    def test_bad_backend(self):
+        self.assertRaises(ValueError, yaml_classes, backend='libyaml')
+        self.assertRaises(ValueError, YAMLProtocol, backend='libyaml')
+
+    def test_allow_unicode(self):
+        for backend in ('auto', 'pure'):
+            p = SafeYAMLProtocol(allow_unicode=True, backend=backend)
+            self.assertEqual(p.write(u'Qu\xe9bec', u'Ph\u1ede'),
+                             'Qu\xc3\xa9bec\tPh\xe1\xbb\x9e')
+            self.assertEqual(p.read('Qu\xc3\xa9bec\tPh\xe1\xbb\x9e'),
+                             (u'Qu\xe9bec', u'Ph\u1ede'))
+
+    def test_dump_inline_returns_unicode(self):
+        for backend in ('auto', 'pure'):
+            self.assertEqual(
+                dump_inline([u'Qu\xe9bec'], allow_unicode=True,
+                            backend=backend),
+                u'[Qu\xe9bec]')
+
+
+@unittest.skipIf(CLoader is None, 'PyYAML was built without libyaml')
+class BackendParityTestCase(unittest.TestCase):
+
+    # the extra values are things libyaml and PyYAML's emitters might
+    # reasonably disagree on
+    SAFE_KEY_VALUES = SAFE_KEY_VALUES + [
+        (u'x ' * 200, 'y\n' * 200),
+        (u'Ph\u1ede \U0001f600\u2028', [1e100, float('inf'), -0.0]),
+        ({'a': {'b': [{}, []]}}, ['- a', ': b', '#c', "'", '"', 'yes', '']),
+        ({'key': '\t\r\x00'}, [10 ** 30, True, 'null', '1.0', ' ']),
+    ]
+
+    UNSAFE_KEY_VALUES = [
+        (Decimal('1.3'), Decimal('3.1')),
+        (object(), object()),
+        ((1, 2), [u'', Decimal('NaN'), YAMLProtocol()]),
+    ]
+
+    def assert_same_output(self, protocol_class, key_values, **kwargs):
+        pure_p = protocol_class(backend='pure', **kwargs)
+        c_p = protocol_class(backend='c', **kwargs)
+
+        for key, value in key_values:
+            pure_line = pure_p.write(key, value)
+            c_line = c_p.write(key, value)
+
+            self.assertEqual(pure_line, c_line)
+
+            # both loaders should read it the same way (comparing the
+            # re-encoded values, since objects may not be comparable)
+            self.assertEqual(pure_p.write(*pure_p.read(c_line)),
+                             pure_p.write(*c_p.read(pure_line)))
+
+    def test_safe_protocols(self):
+        for protocol_class in (SafeYAMLProtocol, SafeYAMLValueProtocol):
+            for kwargs in (dict(), dict(allow_unicode=True),
+                           dict(encoding='utf_16')):
+                self.assert_same_output(
+                    protocol_class, self.SAFE_KEY_VALUES, **kwargs)
+
+    def test_known_differences(self):
+        for protocol_class, key, value in [
+                (SafeYAMLProtocol, {'': 1}, None),
+                (YAMLProtocol, YAMLProtocol, len)]:
+            pure_p = protocol_class(backend='pure')
+            c_p = protocol_class(backend='c')
+
+            pure_line = pure_p.write(key, value)
+            c_line = c_p.write(key, value)
+            self.assertNotEqual(pure_line, c_line)
+
+            # but they mean the same thing
+            self.assertEqual(pure_p.read(c_line), (key, value))
+            self.assertEqual(c_p.read(pure_line), (key, value))
+
+    def test_next_line(self):
+        # with allow_unicode, PyYAML writes u'\x85' (NEL) as-is, and then
+        # reads it as a line break. libyaml escapes it.
+        pure_p = SafeYAMLValueProtocol(backend='pure', allow_unicode=True)
+        c_p = SafeYAMLValueProtocol(backend='c', allow_unicode=True)
+
+        self.assertEqual(c_p.write(None, u'\x85'), '"\\N"')
+        self.assertEqual(pure_p.read(c_p.write(None, u'\x85')),
+                         (None, u'\x85'))
+        self.assertNotEqual(pure_p.read(pure_p.write(None, u'\x85')),
+                            (None, u'\x85'))
+
+    def test_unsafe_protocols(self):
+        for protocol_class in (YAMLProtocol, YAMLValueProtocol):
+            for kwargs in (dict(), dict(allow_unicode=True)):
+                self.assert_same_output(
+                    protocol_class,
+                    self.SAFE_KEY_VALUES + self.UNSAFE_KEY_VALUES,
+                    **kwargs)
+
+
+class DecodingTestCase(unittest.TestCase):
+
+    def test_count_fallbacks(self):
+        p = SafeYAMLValueProtocol()
+        self.assertEqual(p.read('Qu\xc3\xa9bec'), (None, u'Qu\xe9bec'))
+        self.assertEqual(p.read('Qu\xe9bec'), (None, u'Qu\xe9bec'))
+        self.assertEqual(p.decoder.fallbacks, 1)
+
+    def test_sticky_encoding(self):
+        p = SafeYAMLValueProtocol(sticky_encoding=True)
+        self.assertEqual(p.read('Qu\xe9bec'), (None, u'Qu\xe9bec'))
+        self.assertEqual(p.read('Qu\xc3\xa9bec'), (None, u'Qu\xc3\xa9bec'))
+        self.assertEqual(p.decoder.fallbacks, 1)
+
+
 class CachingTestCase(unittest.TestCase):
 
     def test_caching(self):
@@ -171,3 +324,516 @@ class CachingTestCase(unittest.TestCase):
              call('[b, 2]'), call('3'),
              # '[a, 1]' is re-decoded because the cache only holds one key
              call('[a, 1]'), call('3')])
+
+    def test_lru_key_cache(self):
+        p = YAMLProtocol(key_cache_size=2)
+        p.load = Mock(wraps=p.load)
+
+        self.assertEqual(p.read('[a, 1]\t2'), (['a', 1], 2))
+        self.assertEqual(p.read('[b, 2]\t3'), (['b', 2], 3))
+        self.assertEqual(p.read('[a, 1]\t3'), (['a', 1], 3))
+
+        self.assertEqual(
+            p.load.call_args_list,
+            [call('[a, 1]'), call('2'), call('[b, 2]'), call('3'),
+             # '[a, 1]' is still in the cache
+             call('3')])
+        self.assertEqual((p.key_cache.hits, p.key_cache.misses), (1, 2))
+
+    def test_value_cache(self):
+        for p, line in [
+                (SafeYAMLProtocol(value_cache_size=10), 'a\t{status: on}'),
+                (SafeYAMLValueProtocol(value_cache_size=10), '{status: on}')]:
+            p.load = Mock(wraps=p.load)
+
+            for _ in xrange(3):
+                self.assertEqual(p.read(line)[1], {'status': True})
+
+            self.assertEqual(p.value_cache.hits, 2)
+            self.assertEqual(p.value_cache.misses, 1)
+
+    def test_no_key_cache(self):
+        p = SafeYAMLProtocol(key_cache_size=0)
+        p.load = Mock(wraps=p.load)
+
+        p.read('a\t1')
+        p.read('a\t2')
+        self.assertEqual(p.load.call_args_list,
+                         [call('a'), call('1'), call('a'), call('2')])
+
+    def test_cached_values_are_copies(self):
+        p = SafeYAMLProtocol(value_cache_size=10)
+
+        key, value = p.read('[a, 1]\t{b: [1, 2], c: !!set {3: null}}')
+        key.append(2)
+        value['b'].append(3)
+        value['c'].add(4)
+
+        self.assertEqual(p.read('[a, 1]\t{b: [1, 2], c: !!set {3: null}}'),
+                         (['a', 1], {'b': [1, 2], 'c': set([3])}))
+
+    def test_cached_objects_are_copies(self):
+        p = YAMLValueProtocol(value_cache_size=10)
+
+        line = p.write(None, Decimal('1.5'))
+        value = p.read(line)[1]
+        # immutable, so no need to copy
+        self.assertIs(p.read(line)[1], value)
+
+        line = p.write(None, (1, [2]))
+        p.read(line)[1][1].append(3)
+        self.assertEqual(p.read(line), (None, (1, [2])))
+
+    def test_encoded_key_cache(self):
+        p = SafeYAMLProtocol()
+        p.dump = Mock(wraps=p.dump)
+
+        self.assertEqual(p.write('a', 1), 'a\t1')
+        self.assertEqual(p.write('a', 2), 'a\t2')
+        self.assertEqual(p.write('b', 2), 'b\t2')
+
+        self.assertEqual(
+            p.dump.call_args_list,
+            [call('a'), call(1),
+             # 'a' is cached
+             call(2),
+             call('b'), call(2)])
+        self.assertEqual(
+            (p.encoded_key_cache.hits, p.encoded_key_cache.misses), (1, 2))
+
+    def test_equal_keys_encoded_separately(self):
+        # 1 == 1L == 1.0 == True, but they're encoded differently
+        safe_keys = [1, 1L, 1.0, True, 'a', u'a', (1, 'a'), (True, u'a'),
+                     (1.0, 'a'), 0.0, -0.0]
+        unsafe_keys = safe_keys + [Decimal('1.0'), Decimal('1.00')]
+
+        for p_class, keys in [(SafeYAMLProtocol, safe_keys),
+                              (YAMLProtocol, unsafe_keys)]:
+            uncached_p = p_class(encoded_key_cache_size=0)
+            p = p_class(encoded_key_cache_size=100)
+
+            for _ in xrange(2):
+                for key in keys:
+                    self.assertEqual(p.write(key, None),
+                                     uncached_p.write(key, None))
+
+    def test_unhashable_keys(self):
+        p = SafeYAMLProtocol(encoded_key_cache_size=100)
+
+        self.assertEqual(p.write(['a'], 1), '[a]\t1')
+        self.assertEqual(p.write((['a'],), 1), '[[a]]\t1')
+        self.assertEqual(len(p.encoded_key_cache), 0)
+
+
+class FastPathTestCase(unittest.TestCase):
+
+    # strings that are easy to get wrong: they look like other types, or
+    # need quoting or escaping
+    TRICKY_STRINGS = [
+        '', 'a', 'a b', 'a  b', 'a ', ' a', '-a', '- a', '.a', 'a.b',
+        'true', 'No', 'null', '~', '1', '-1', '012', '0x1F', '1_000',
+        '1.5', '1e5', '.inf', '1:20', '2001-12-14', '<<', '=', 'y',
+        "it's", 'a: b', 'a #b', '[a]', '{a}', 'a,b', '!a', '&a', '*a',
+        'a\tb', 'a\n', '1\n', 'x' * 150, 'Qu\xc3\xa9bec', u'Qu\xe9bec',
+        u'Ph\u1ede']
+
+    FLOATS = [0.0, -0.0, 1.5, 0.1, 1e16, 1e20, 1e-7, -2.5e300,
+              float('inf'), float('-inf'), float('nan')]
+
+    def random_value(self, rand, depth=0):
+        choice = rand.randint(0, 9 if depth < 3 else 5)
+
+        if choice == 0:
+            return rand.choice([None, True, False])
+        elif choice == 1:
+            return rand.choice([0, -5, 1L, 10 ** 30])
+        elif choice == 2:
+            return rand.choice(self.FLOATS)
+        elif choice in (3, 4, 5):
+            s = rand.choice(self.TRICKY_STRINGS)
+            if rand.randint(0, 1):
+                if isinstance(s, str):
+                    return s.decode('utf_8')
+                else:
+                    return s.encode('utf_8')
+            return s
+        elif choice in (6, 7):
+            values = [self.random_value(rand, depth + 1)
+                      for _ in xrange(rand.randint(0, 3))]
+            return tuple(values) if choice == 7 else values
+        else:
+            return dict((rand.choice(self.TRICKY_STRINGS),
+                         self.random_value(rand, depth + 1))
+                        for _ in xrange(rand.randint(0, 3)))
+
+    def test_same_as_pyyaml(self):
+        rand = random.Random(0)
+
+        for _ in xrange(300):
+            value = self.random_value(rand)
+
+            for safe in (True, False):
+                for backend in ('auto', 'pure'):
+                    for allow_unicode in (False, True):
+                        kwargs = dict(safe=safe, backend=backend,
+                                      allow_unicode=allow_unicode)
+                        out = dump_inline(value, fast_path=False, **kwargs)
+                        self.assertEqual(dump_inline(value, **kwargs), out)
+
+                        loader = yaml_classes(safe, backend)[0]
+                        p_class = (SafeYAMLValueProtocol if safe
+                                   else YAMLValueProtocol)
+                        p = p_class(backend=backend)
+                        self.assert_same_value(
+                            p.load(out.encode('utf_8')),
+                            yaml.load(out, Loader=loader))
+
+    def assert_same_value(self, a, b):
+        self.assertEqual(type(a), type(b))
+
+        if isinstance(a, (list, tuple)):
+            self.assertEqual(len(a), len(b))
+            for x, y in zip(a, b):
+                self.assert_same_value(x, y)
+        elif isinstance(a, dict):
+            self.assert_same_value(sorted(a.items()), sorted(b.items()))
+        elif a != a:  # nan
+            self.assertNotEqual(b, b)
+        else:
+            self.assertEqual(a, b)
+
+    def test_shared_references(self):
+        # PyYAML uses anchors and aliases for these
+        for safe in (True, False):
+            items = ['a', 1]
+            self.assertEqual(dump_inline([items, items], safe=safe),
+                             '[&id001 [a, 1], *id001]')
+            self.assertEqual(dump_inline([[], []], safe=safe), '[[], []]')
+
+    def test_uses_pyyaml_for_complex_data(self):
+        p = SafeYAMLProtocol()
+
+        with patch.object(p._dumper, '_dump',
+                          wraps=p._dumper._dump) as mock_dump:
+            with patch('yaml.load', wraps=yaml.load) as mock_load:
+
+                self.assertEqual(p.write({'a': [1, 2.5]}, 'b'),
+                                 '{a: [1, 2.5]}\tb')
+                self.assertEqual(p.read('{a: [1, 2.5]}\tb'),
+                                 ({'a': [1, 2.5]}, 'b'))
+                self.assertFalse(mock_dump.called)
+                self.assertFalse(mock_load.called)
+
+                self.assertEqual(p.write('a: b', None), "'a: b'\tnull")
+                self.assertEqual(p.read('"a: b"\tnull'), ('a: b', None))
+                self.assertTrue(mock_dump.called)
+                self.assertTrue(mock_load.called)
+
+    def test_no_fast_path(self):
+        class ShoutingDumper(yaml.SafeDumper):
+            pass
+
+        ShoutingDumper.add_representer(
+            str, lambda dumper, s: dumper.represent_str(s.upper()))
+
+        with patch('mr3po.yaml.yaml_classes',
+                   return_value=(yaml.SafeLoader, ShoutingDumper)):
+            self.assertEqual(dump_inline(['a'], safe=True), '[a]')
+            self.assertEqual(
+                dump_inline(['a'], safe=True, fast_path=False), '[A]')
+
+            p = SafeYAMLValueProtocol(fast_path=False)
+            self.assertEqual(p.write(None, ['a']), '[A]')
+
+
+class InlineDumperTestCase(unittest.TestCase):
+
+    VALUES = [value for key_value in SAFE_KEY_VALUES
+              for value in key_value] + [
+        {'': 1}, 'a: b', u'\x85', 'x\n' * 200, float('nan'), -0.0]
+
+    def test_same_as_dump_inline(self):
+        for safe in (True, False):
+            for backend in ('auto', 'pure'):
+                for allow_unicode in (False, True):
+                    kwargs = dict(safe=safe, backend=backend,
+                                  allow_unicode=allow_unicode)
+                    dumper = InlineDumper(fast_path=False, **kwargs)
+
+                    # dump everything twice, to make sure the dumper
+                    # is reused
+                    for value in self.VALUES * 2:
+                        self.assertEqual(
+                            dumper.dump(value),
+                            dump_inline(value, fast_path=False, **kwargs))
+                        self.assertEqual(
+                            dumper.dump(value, encoding='utf_8'),
+                            dump_inline(value, encoding='utf_8',
+                                        fast_path=False, **kwargs))
+
+    def test_anchors_start_over(self):
+        dumper = InlineDumper(safe=True)
+        items = ['a: b']
+
+        for _ in xrange(2):
+            self.assertEqual(dumper.dump([items, items]),
+                             "[&id001 ['a: b'], *id001]")
+
+    def test_recover_from_errors(self):
+        dumper = InlineDumper(safe=True, fast_path=False)
+        self.assertEqual(dumper.dump(['a', 1]), '[a, 1]')
+
+        # fail in the middle of the document
+        self.assertRaises(RepresenterError, dumper.dump, ['a', object()])
+        self.assertEqual(dumper.dump(['a', 1]), '[a, 1]')
+
+
+class LoadManyTestCase(unittest.TestCase):
+
+    def test_load_many(self):
+        p = SafeYAMLProtocol()
+        self.assertEqual(p.load_many(['1', '[a, b]', "'a: b'", 'null']),
+                         [1, ['a', 'b'], 'a: b', None])
+        self.assertEqual(p.load_many([]), [])
+
+    def test_decode_repeats_once(self):
+        p = SafeYAMLProtocol()
+
+        with patch.object(p, 'load', wraps=p.load) as mock_load:
+            values = p.load_many(['{a: [1]}', '2', '{a: [1]}'])
+
+        self.assertEqual(values, [{'a': [1]}, 2, {'a': [1]}])
+        self.assertEqual(mock_load.call_count, 2)
+
+        # repeated values are copies
+        values[0]['a'].append(2)
+        self.assertEqual(values[2], {'a': [1]})
+
+    def test_bad_line(self):
+        p = SafeYAMLProtocol()
+        self.assertRaises(yaml.YAMLError, p.load_many, ['1', '[a'])
+
+
+class LazyValueTestCase(unittest.TestCase):
+
+    def test_read(self):
+        p = SafeYAMLProtocol(lazy_values=True)
+
+        key, value = p.read('[user, 1]\t{a: [1, 2], b: x}')
+        self.assertEqual(key, ['user', 1])
+        self.assertEqual(value.__class__, LazyValue)
+        self.assertFalse(value.loaded)
+        self.assertEqual(value.raw, '{a: [1, 2], b: x}')
+        self.assertEqual(repr(value), "LazyValue(raw='{a: [1, 2], b: x}')")
+
+        self.assertEqual(value['a'], [1, 2])
+        self.assertTrue(value.loaded)
+        self.assertEqual(value, {'a': [1, 2], 'b': 'x'})
+        self.assertEqual(value.value, {'a': [1, 2], 'b': 'x'})
+        self.assertEqual(sorted(value), ['a', 'b'])
+        self.assertEqual(len(value), 2)
+        self.assertIn('b', value)
+        self.assertEqual(value.get('c', 3), 3)
+        self.assertEqual(repr(value), "LazyValue({'a': [1, 2], 'b': 'x'})")
+
+    def test_value_protocol(self):
+        p = SafeYAMLValueProtocol(lazy_values=True)
+
+        key, value = p.read('[1, 2]')
+        self.assertEqual(key, None)
+        self.assertFalse(value.loaded)
+        self.assertEqual(value, [1, 2])
+        self.assertEqual(p.write(None, value), '[1, 2]')
+
+    def test_not_lazy_by_default(self):
+        self.assertEqual(SafeYAMLProtocol().read('a\t[1]'), ('a', [1]))
+
+    def test_pass_through(self):
+        p = SafeYAMLProtocol(lazy_values=True)
+
+        # not how we'd write this value, so we can tell it wasn't re-dumped
+        line = 'a\t{ b: "x", a: 1 }'
+
+        with patch.object(p, 'load', wraps=p.load) as mock_load:
+            with patch.object(p, 'dump', wraps=p.dump) as mock_dump:
+                self.assertEqual(p.write(*p.read(line)), line)
+
+                # the key still gets decoded and encoded, but not the value
+                self.assertEqual(mock_load.call_args_list, [call('a')])
+                self.assertEqual(mock_dump.call_args_list, [call('a')])
+
+    def test_dump_if_used(self):
+        p = SafeYAMLProtocol(lazy_values=True)
+        key, value = p.read('a\t{ b: "x", a: 1 }')
+
+        value['c'] = 2
+        self.assertEqual(p.write(key, value), 'a\t{a: 1, b: x, c: 2}')
+
+    def test_pass_through_to_compatible_protocol(self):
+        reader = SafeYAMLValueProtocol(lazy_values=True)
+        writer = SafeYAMLValueProtocol(backend='auto')
+
+        self.assertEqual(writer.write(*reader.read('{ a: 1 }')), '{ a: 1 }')
+
+    def test_dump_for_incompatible_protocol(self):
+        reader = SafeYAMLValueProtocol(lazy_values=True, allow_unicode=True)
+
+        for writer in [SafeYAMLValueProtocol(),
+                       SafeYAMLValueProtocol(allow_unicode=True,
+                                             encoding='utf_16'),
+                       YAMLValueProtocol(allow_unicode=True)]:
+            self.assertEqual(writer.write(*reader.read('Qu\xc3\xa9bec')),
+                             writer.write(None, u'Qu\xe9bec'))
+
+    def test_dump_latin_1(self):
+        p = SafeYAMLValueProtocol(lazy_values=True, allow_unicode=True)
+
+        # fallback to latin-1 on read, but always write UTF-8
+        self.assertEqual(p.write(*p.read('Qu\xe9bec')), 'Qu\xc3\xa9bec')
+
+    def test_bad_values_fail_when_used(self):
+        p = SafeYAMLProtocol(lazy_values=True)
+
+        key, value = p.read('a\t[b')
+        self.assertEqual(p.write(key, value), 'a\t[b')
+        self.assertRaises(yaml.YAMLError, lambda: value.value)
+
+    def test_value_cache(self):
+        p = SafeYAMLValueProtocol(lazy_values=True, value_cache_size=10)
+
+        for _ in xrange(3):
+            self.assertEqual(p.read('[1]')[1], [1])
+
+        self.assertEqual(p.value_cache.misses, 1)
+        self.assertEqual(p.value_cache.hits, 2)
+
+    def test_copy(self):
+        p = SafeYAMLValueProtocol(lazy_values=True)
+        value = p.read('[1]')[1]
+
+        value_copy = deepcopy(value)
+        self.assertFalse(value.loaded)
+        self.assertFalse(value_copy.loaded)
+        self.assertEqual(value_copy, [1])
+
+        # copies of decoded values are independent
+        value_copy.append(2)
+        self.assertEqual(deepcopy(value_copy), [1, 2])
+        self.assertEqual(value, [1])
+
+
+class ResolversTestCase(unittest.TestCase):
+
+    LINE = ('[2001-12-14, 0x1F, 012, 1_000, yes, ~, null, true, 5, -1.5,'
+            ' 1e5, 1.0e+20, .inf]')
+
+    def test_full(self):
+        for backend in ('auto', 'pure'):
+            p = SafeYAMLValueProtocol(backend=backend)
+            self.assertEqual(
+                p.read(self.LINE),
+                (None, [date(2001, 12, 14), 31, 10, 1000, True, None,
+                        None, True, 5, -1.5, '1e5', 1e20, float('inf')]))
+            self.assertEqual(p.read('1:20'), (None, 80))
+
+    def test_json_like(self):
+        for backend in ('auto', 'pure'):
+            for fast_path in (False, True):
+                p = SafeYAMLValueProtocol(backend=backend,
+                                          fast_path=fast_path,
+                                          resolvers='json-like')
+                self.assertEqual(
+                    p.read(self.LINE),
+                    (None, ['2001-12-14', '0x1F', '012', '1_000', 'yes',
+                            None, None, True, 5, -1.5, 1e5, 1e20,
+                            float('inf')]))
+                self.assertEqual(p.read('1:20'), (None, '1:20'))
+
+    def test_strings_only(self):
+        for backend in ('auto', 'pure'):
+            for fast_path in (False, True):
+                p = SafeYAMLValueProtocol(backend=backend,
+                                          fast_path=fast_path,
+                                          resolvers='strings-only')
+                self.assertEqual(
+                    p.read(self.LINE),
+                    (None, ['2001-12-14', '0x1F', '012', '1_000', 'yes',
+                            '~', 'null', 'true', '5', '-1.5', '1e5',
+                            '1.0e+20', '.inf']))
+                self.assertEqual(p.read('1:20'), (None, '1:20'))
+
+                # quoting and explicit tags still work
+                self.assertEqual(p.read("['5', !!int 5, !!null '']"),
+                                 (None, ['5', 5, None]))
+
+    def test_quoting_dumper(self):
+        for resolvers in ('json-like', 'strings-only'):
+            loader, dumper = yaml_classes(safe=True, resolvers=resolvers)
+            self.assertTrue(issubclass(loader, yaml.SafeLoader))
+            self.assertTrue(issubclass(dumper, yaml.SafeDumper))
+            self.assertNotEqual(dumper, yaml.SafeDumper)
+
+            # so we still quote strings that look like other types
+            p = SafeYAMLValueProtocol(resolvers=resolvers)
+            self.assertEqual(p.write(None, ['2001-12-14', 'yes']),
+                             "['2001-12-14', 'yes']")
+
+    # strings that 'json-like' would read as floats, ints, bools, or null
+    # (the first few aren't numbers in YAML 1.1)
+    JSON_LIKE_STRINGS = ['1e5', '-1E+05', '2e-3', '1.e5', '+3', '.5', '1.',
+                         '-.inf', '.NaN', 'TRUE', 'Null']
+
+    def test_quote_json_like_strings(self):
+        for backend in ('auto', 'pure'):
+            for fast_path in (False, True):
+                for resolvers in ('json-like', 'strings-only'):
+                    p = SafeYAMLValueProtocol(backend=backend,
+                                              fast_path=fast_path,
+                                              resolvers=resolvers)
+                    self.assertEqual(p.write(None, '1e5'), "'1e5'")
+                    self.assertEqual(p.write(None, ['2e-3', 2e-3]),
+                                     "['2e-3', 0.002]")
+
+    def test_full_writes_what_pyyaml_would(self):
+        for backend in ('auto', 'pure'):
+            for fast_path in (False, True):
+                p = SafeYAMLProtocol(backend=backend, fast_path=fast_path)
+                self.assertEqual(p.write('1e5', ['-.5', '2e-3']),
+                                 "1e5\t[-.5, 2e-3]")
+                self.assertEqual(
+                    p.write(None, self.JSON_LIKE_STRINGS),
+                    'null\t' + yaml.safe_dump(self.JSON_LIKE_STRINGS,
+                                               width=float('inf')).strip())
+
+    def test_round_trip_json_like_strings(self):
+        strings = self.JSON_LIKE_STRINGS
+        key_values = ([(s, s) for s in strings] +
+                      [(strings, dict((s, [s]) for s in strings))])
+
+        for protocol_class in (SafeYAMLProtocol, YAMLProtocol):
+            for backend in ('auto', 'pure'):
+                for fast_path in (False, True):
+                    for resolvers in RESOLVERS:
+                        p = protocol_class(backend=backend,
+                                           fast_path=fast_path,
+                                           resolvers=resolvers)
+                        for key, value in key_values:
+                            self.assertEqual(p.read(p.write(key, value)),
+                                             (key, value))
+
+    def test_no_pass_through_across_resolvers(self):
+        full_p = SafeYAMLValueProtocol(lazy_values=True)
+        json_like_p = SafeYAMLValueProtocol(lazy_values=True,
+                                            resolvers='json-like')
+
+        value = full_p.read('1e5')[1]
+        self.assertEqual(json_like_p.read(json_like_p.write(None, value)),
+                         (None, '1e5'))
+
+    def test_loader_classes_are_reused(self):
+        self.assertEqual(yaml_classes(resolvers='json-like'),
+                         yaml_classes(resolvers='json-like'))
+
+    def test_bad_resolvers(self):
+        self.assertRaises(ValueError, yaml_classes, resolvers='json')
+        self.assertRaises(ValueError, SafeYAMLProtocol, resolvers='json')